@@ -6,61 +6,52 @@ import os
 brain_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'brain')
 first_run_file = os.path.join(brain_folder, "first_run.txt")
 
-def get_pythonw_path():
-    """Find pythonw.exe in the current Python installation directory."""
-    python_dir = os.path.dirname(sys.executable)  # Get the directory of the current Python interpreter
-    pythonw_path = os.path.join(python_dir, 'pythonw.exe')  # Path to pythonw.exe
-    if os.path.exists(pythonw_path):
-        return pythonw_path
-    else:
-        return None  # Return None if pythonw.exe is not found
-# this is not a comment
-def relaunch_with_pythonw():
-    """Relaunch the script using pythonw.exe to avoid showing the terminal window."""
-    pythonw_executable = get_pythonw_path()
-    if pythonw_executable:
-        # Relaunch using pythonw.exe
-        subprocess.Popen([pythonw_executable, __file__], close_fds=True)
-        sys.exit(0)  # Exit the current instance to prevent double execution
-
-def run_script(script_name, use_pythonw=True):
-    """Run the given Python script located in the 'brain' folder."""
+def hide_console():
+    """Detach from the console window when started with python.exe, instead of relaunching under pythonw.exe.
+
+    \n\nThe app then runs in this process: no relaunch and no child process on the way to the tray icon."""
+    if sys.platform != "win32" or "pythonw" in sys.executable:
+        return
+    import ctypes
+    ctypes.windll.kernel32.FreeConsole()  # Closes the window if it was opened just for this process
+    sys.stdout = sys.stderr = open(os.devnull, "w")  # As under pythonw.exe, print() output goes nowhere
+
+def run_setup():
+    """Run setup.py, which installs the dependencies, so it needs an interpreter of its own."""
     try:
-        script_path = os.path.join(brain_folder, script_name)
-        python_executable = get_pythonw_path() if use_pythonw else sys.executable
-        result = subprocess.run([python_executable, script_path], check=True)
+        script_path = os.path.join(brain_folder, 'setup.py')
+        result = subprocess.run([sys.executable, script_path, '--no-launch'], check=True, cwd=brain_folder)
         return result.returncode == 0
     except subprocess.CalledProcessError:
         return False
 
-def main():
-    # Check if the script is already being run by pythonw.exe
-    if "pythonw" not in sys.executable:
-        relaunch_with_pythonw()  # Relaunch using pythonw.exe if it is not already running with it
+def run_app():
+    """Run backgroundai in this process."""
+    sys.path.insert(0, brain_folder)
+    import backgroundai  # Heavy modules (openai, the speech engine, the settings UI) are only loaded when first used
+    backgroundai.main()
 
+def main():
     if not os.path.exists(first_run_file):
         # First time running the script
         print("First run detected. Running setup.py...")
 
         # Run setup.py and retry if it fails
-        if not run_script('setup.py', use_pythonw=False):  # Use python.exe for setup
+        if not run_setup():
             print("setup.py failed. Retrying...")
-            if not run_script('setup.py', use_pythonw=False):
+            if not run_setup():
                 print("setup.py failed twice. Exiting.")
                 return
 
         # Setup completed, create first_run_file in 'brain' folder
         with open(first_run_file, 'w') as f:
             f.write("Setup completed")
-
-        # Now run backgroundai.py using pythonw.exe
-        print("Running backgroundai.py...")
-        run_script('backgroundai.py', use_pythonw=True)
-
     else:
-        # Not the first run, just run backgroundai.py using pythonw.exe
-        print("Not the first run. Running backgroundai.py...")
-        run_script('backgroundai.py', use_pythonw=True)
+        print("Not the first run.")
+
+    print("Running backgroundai...")
+    hide_console()
+    run_app()
 
 if __name__ == "__main__":
     main()
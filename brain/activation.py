@@ -0,0 +1,417 @@
+import threading
+
+from model_registry import COMPLETION
+from capture_engine import CaptureBuffer, HOTKEY, KEY_DOWN
+from key_dispatcher import MODIFIER_KEYS
+from jobs import Job
+from response_cache import ResponseCache, chunk_text
+from resilience import Candidate
+from rate_limits import request_cost
+from output_pipeline import CancelToken
+from timeline import SETTINGS_LOADED, CAPTURE_END, REQUEST_SENT
+
+# What a conversation's old turns are compacted into, by a background thread, once they no longer fit its token budget
+SUMMARY_INSTRUCTIONS = ("Summarize the conversation below in a few sentences, keeping the facts, names and decisions a "
+                        "follow-up question could refer to. Fold in the earlier summary, if there is one.")
+
+
+def build_prompt(action:str, captured_text:str) -> str:
+    """Turn the captured text into the prompt sent to the model, based on which keybind started the capture."""
+    if action == 'completion':
+        return f"Continue the following text: {captured_text}"
+    return captured_text  # Use the captured text as is
+
+
+class Activation:
+    """The activation path, from the trigger key press to the last keystroke of the answer: wait for a profile's
+    trigger, capture the prompt, send the request (response cache, rate limiter, hedging, resilience) and hand its output
+    over to the job scheduler.
+
+    \n\nKey input comes from capture_engine (fed by the key dispatcher) and output goes to the sinks of output_pipeline,
+    so the app (the OS keyboard hook, keyboard.write, the speech engine) and the benchmark harness (synthetic key events,
+    a fake keyboard and speech backend) run the same code with their own services. backgroundai builds the app's one."""
+
+    def __init__(self, dispatcher, capture_engine, output_pipeline, providers, stream_engine, model_registry, profiles,
+                 jobs, timelines, response_cache, rate_limiter, hedger, resilience, conversations, speculator, speech):
+        self.dispatcher = dispatcher
+        self.capture_engine = capture_engine
+        self.output_pipeline = output_pipeline
+        self.providers = providers
+        self.stream_engine = stream_engine
+        self.model_registry = model_registry
+        self.profiles = profiles
+        self.jobs = jobs
+        self.timelines = timelines
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.hedger = hedger
+        self.resilience = resilience
+        self.conversations = conversations
+        self.speculator = speculator
+        self.speech = speech
+
+        # Set from the trigger key press until the prompt is captured: keys typed meanwhile are the prompt, they don't stop output
+        self.capturing = threading.Event()
+
+        # Dispatcher ids of every profile's prompt/completion hotkeys, replaced whenever the keybinds change
+        self.trigger_hotkeys = []
+
+    def register_trigger_hotkeys(self, current_settings) -> None:
+        """Resolve the profiles of the settings, then compile each one's prompt and completion keybinds (single keys, chords
+        like "ctrl+shift+k" or sequences) into the dispatcher, named after the profile so a key press picks it directly."""
+        profile_set = self.profiles.configure(current_settings)
+        for hotkey_id in self.trigger_hotkeys:
+            self.dispatcher.remove_hotkey(hotkey_id)
+        self.trigger_hotkeys[:] = [
+            self.dispatcher.add_hotkey(binding, lambda name=name: self.on_trigger(name), name=name)
+            for name, binding in profile_set.bindings
+        ]
+        reset_hotkey = self.dispatcher.add_hotkey(current_settings.get('conversation_reset_keybind', ""),
+                                                  self.reset_conversation, name="reset_conversation")
+        if reset_hotkey is not None:
+            self.trigger_hotkeys.append(reset_hotkey)
+
+    def on_trigger(self, name: str) -> None:
+        """A profile's prompt or completion keybind was pressed (runs on the keyboard hook)."""
+        if self.capture_engine.running.is_set():
+            self.capturing.set()  # Right away, so the first keys of the prompt can't stop an answer that's still being typed
+        self.capture_engine.push_hotkey(name)
+
+    def reset_conversation(self) -> None:
+        """Forget every profile's conversation history (runs on the keyboard hook, so it only clears a few references)."""
+        self.conversations.reset()
+        print("Conversation reset.")
+
+    def stop_output_listener(self, event) -> None:
+        """Subscribed to the key dispatcher once: a key pressed outside a capture stops the answer being output and drops
+        the waiting ones. The keys of a prompt being captured, the trigger keys, modifiers (held e.g. for a chord like
+        ctrl+alt+c that starts a capture) and the keys KeyGenie sends itself (the paste sink's ctrl+v) don't."""
+        if event.event_type == 'down' and self.jobs.busy and not event.hotkey and not event.injected \
+                and not self.capturing.is_set() and event.name not in MODIFIER_KEYS:
+            # Stop typing, TTS and the stream loop (cancelling again on later keys does nothing)
+            self.jobs.cancel_all()
+
+    def wait_for_keypress(self):
+        triggers = ", ".join(f"{binding} ({name})" for name, binding in self.profiles.current.bindings)
+        print(f"Press {triggers} to start typing.")
+
+        # Drop keys seen since the last activation (including the ones KeyGenie typed itself)
+        self.capture_engine.clear()
+
+        # Continuously wait for any profile's prompt or completion keybind
+        while True:
+            self.capture_engine.running.wait()  # Wait while capture is paused
+            event = self.capture_engine.next_event()  # Returns None straight away when paused
+            if event is not None and event.event_type == HOTKEY:
+                self.timelines.begin(event.name, event.timestamp)  # timestamp is when the hook saw the keypress
+                action, current_settings = self.profiles.resolve(event.name)  # The profile's settings, already in memory
+                self.timelines.current.mark(SETTINGS_LOADED)
+                return action, current_settings  # Return which keybind was pressed ('prompt' or 'completion'), and the settings of its profile
+
+    def capture_input(self, on_keystroke=None):
+        print("Started capturing text. Type now... (Press the same key to stop)")
+
+        captured_text = CaptureBuffer()
+        while True:
+            self.capture_engine.running.wait()  # Wait while capture is paused
+            event = self.capture_engine.next_event()
+            if event is None:
+                continue
+
+            # Stop capturing input when either keybind is pressed again
+            if event.event_type == HOTKEY:
+                self.timelines.current.mark(CAPTURE_END, event.timestamp)
+                break
+
+            if event.event_type == KEY_DOWN:
+                # Modifier and function keys don't change the text
+                if captured_text.apply(event.name) and on_keystroke is not None:
+                    on_keystroke(captured_text.text)
+
+        # Join the captured characters into a single string
+        captured_string = captured_text.text
+        print("\nCaptured text:\n" + captured_string)
+
+        return captured_string
+
+    def start_stream(self, prompt:str, current_settings):
+        """Start a streaming request for the settings' model on the provider it's mapped to, and return its handle."""
+        temperature = current_settings.get('temperature', 1.0)
+        max_tokens = current_settings.get('max_tokens', 256)
+        model_id = current_settings['model']
+        custom_instructions = current_settings['custom_instructions']
+        provider = self.providers.for_settings(current_settings)
+
+        # Which endpoint the model is called through, and its limits (an O(1) lookup; unknown models are assumed to be chat models)
+        model = self.model_registry.lookup(model_id, provider.name)
+        if model.max_output:
+            max_tokens = min(max_tokens, model.max_output)
+
+        # Prepare the prompt or messages
+        if model.endpoint != COMPLETION:
+            # Use the Chat Completion API
+            if current_settings.get('conversation_mode', False):
+                # The earlier turns of the profile's conversation that fit its token budget, from their cached estimates
+                messages = self.conversations.get(current_settings).messages(custom_instructions, prompt)
+            else:
+                messages = []
+                if custom_instructions.strip():
+                    messages.append({"role": "system", "content": custom_instructions})
+                messages.append({"role": "user", "content": prompt})
+
+            return self.stream_engine.stream(
+                provider.client.chat.completions.create,
+                model=model_id,
+                messages=messages,
+                stream=model.streaming,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0
+            )
+        else:
+            # Use the Legacy Completion API (always a single turn, conversation mode needs a chat model)
+            # Combine custom instructions and prompt
+            combined_prompt = f"{custom_instructions}\n{prompt}" if custom_instructions.strip() else prompt
+
+            return self.stream_engine.stream(
+                provider.client.completions.create,
+                model=model_id,
+                prompt=combined_prompt,
+                stream=model.streaming,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0
+            )
+
+    def stream_openai_completion(self, prompt:str, current_settings):
+        try:
+            temperature = current_settings.get('temperature', 1.0)
+            max_tokens = current_settings.get('max_tokens', 256)
+            model_id = current_settings['model']
+            custom_instructions = current_settings['custom_instructions']
+            provider = self.providers.for_settings(current_settings)
+
+            # Serve repeated prompts from the response cache, with no network round trip
+            cache_key = None
+            if ResponseCache.is_cacheable(current_settings):
+                cache_key = ResponseCache.make_key(f"{provider.name}/{model_id}", custom_instructions, prompt, temperature, max_tokens)
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    print("Replaying cached response.")
+                    return self.response_cache.replay(cached_text)
+
+            # Hold the request briefly, or send it to the cheaper rate_limit_model, rather than have the provider reject it
+            routes = [(provider.name, model_id)]
+            if current_settings.get('rate_limit_model'):
+                cheaper_settings = dict(current_settings, model=current_settings['rate_limit_model'],
+                                        provider=current_settings.get('rate_limit_provider') or provider.name)
+                routes.append((self.providers.for_settings(cheaper_settings).name, cheaper_settings['model']))
+            if current_settings.get('conversation_mode', False):
+                cost = current_settings.get('conversation_token_budget', 2000) + max_tokens  # The whole request fits the budget
+            else:
+                cost = request_cost([custom_instructions, prompt], max_tokens)
+            if self.rate_limiter.admit(routes, cost, current_settings.get('rate_limit_max_wait_ms', 3000) / 1000):
+                current_settings = cheaper_settings
+                model_id = current_settings['model']
+                provider = self.providers.for_settings(current_settings)
+                if cache_key is not None:
+                    cache_key = ResponseCache.make_key(f"{provider.name}/{model_id}", custom_instructions, prompt, temperature, max_tokens)
+
+            # Optionally hedge against a slow first token with a second request to a backup model or provider
+            hedging = current_settings.get('hedging', "off")
+            hedged = []  # The hedged stream of every attempt, to tell which model answered
+            if hedging in ("delay", "race"):
+                backup_settings = dict(current_settings,
+                                       model=current_settings.get('hedge_model') or model_id,
+                                       provider=current_settings.get('hedge_provider') or provider.name)
+
+                def primary():
+                    hedged.append(self.hedger.stream(lambda: self.start_stream(prompt, current_settings),
+                                                     lambda: self.start_stream(prompt, backup_settings),
+                                                     mode=hedging, delay_ms=current_settings.get('hedge_delay_ms', 400)))
+                    return hedged[-1]
+            else:
+                primary = lambda: self.start_stream(prompt, current_settings)
+
+            # Timeouts, retries and circuit breaking around the request, then the fallback model if it still fails
+            candidates = [Candidate("primary", provider.name, primary)]
+            if current_settings.get('fallback_model'):
+                fallback_settings = dict(current_settings, model=current_settings['fallback_model'],
+                                         provider=current_settings.get('fallback_provider') or provider.name)
+                candidates.append(Candidate("fallback", self.providers.for_settings(fallback_settings).name,
+                                            lambda: self.start_stream(prompt, fallback_settings)))
+            response = self.resilience.stream(candidates, current_settings)
+            if cache_key is not None:
+                # Stores the response once it has streamed in full, unless the fallback model or the hedge's backup model is
+                # the one that answered (it would keep being replayed as the primary's answer)
+                return self.response_cache.record(cache_key, response, keep=lambda: not response.fallback_used and (
+                    not hedged or hedged[-1].winner == "primary"))
+            return response
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            if self.resilience.on_error is not None:
+                self.resilience.on_error("KeyGenie request failed", str(e))
+            return None
+
+    def summarize_conversation(self, summary: str, messages: list, current_settings) -> str:
+        """Summarize a conversation's old turns with the profile's model. Called on the conversation's compaction thread,
+        never on the request path."""
+        provider = self.providers.for_settings(current_settings)
+        request = [{"role": "system", "content": SUMMARY_INSTRUCTIONS}]
+        if summary:
+            request.append({"role": "system", "content": f"Earlier summary: {summary}"})
+        response = self.stream_engine.stream(
+            provider.client.chat.completions.create,
+            model=current_settings['model'],
+            messages=request + messages,
+            stream=True,
+            temperature=0,
+            max_tokens=current_settings.get('conversation_summary_tokens', 200)
+        )
+        text = ''.join(chunk_text(chunk) or '' for chunk in response)
+        if response.error is not None:
+            raise response.error
+        return text.strip()
+
+    def type_out_text_fast_streamed(self, response, current_settings, answer:list|None=None,
+                                    cancel_token:CancelToken|None=None, timeline=None) -> dict:
+        """Fans the streamed tokens out to the output sinks (typing, text-to-speech (tts), ...) until the stream ends or
+        cancel_token (the job's, stopped by stop_output_listener) is cancelled.
+        \n\nReturns each sink's metrics (queue high-water mark, lag, ...), for the activation's timeline. If answer is a
+        list, the tokens are also appended to it (for the conversation history)."""
+        print("\nTyping out the text as it's received...")
+
+        if response is None:
+            return {}
+
+        # One cancellation token for the stream loop and every sink of this request
+        if cancel_token is None:
+            cancel_token = CancelToken()
+        if timeline is None:
+            timeline = self.timelines.current
+        session = self.output_pipeline.open(current_settings, cancel_token, timeline)
+
+        # Abort the HTTP stream itself as soon as the user stops the output, not just when the next chunk arrives
+        if hasattr(response, 'cancel'):
+            cancel_token.on_cancel(response.cancel)
+
+        # Iterate over each streamed chunk as it comes in
+        for chunk in response:
+            if cancel_token.is_set():
+                break  # Stop processing if the user pressed a key
+            token = chunk_text(chunk)
+            if token:
+                timeline.chunk()
+                session.publish(token)
+                if answer is not None:
+                    answer.append(token)
+
+        # Wait for the sinks to finish what they've been given
+        sink_metrics = session.end()
+        print("Output sink metrics:", sink_metrics)
+        return sink_metrics
+
+    def submit_activation(self, action: str, prompt: str, current_settings, timeline, response_stream=None) -> bool:
+        """Hand a captured prompt over to the job scheduler: its request is sent right away (unless it's a conversation's
+        follow-up, which waits for the earlier answers it follows up on), its answer is output once the outputs it uses
+        are free. response_stream is the speculative stream started on this exact prompt, if any."""
+        jobs = self.jobs
+        jobs.configure(current_settings)
+        conversation_mode = current_settings.get('conversation_mode', False)
+        answer = [] if conversation_mode else None
+        targets = self.output_pipeline.enabled(current_settings)
+        if conversation_mode:
+            targets.append(f"conversation:{current_settings.get('profile', 'default')}")
+
+        def request():
+            if response_stream is not None:
+                print("\nUsing the speculative response...\n")
+                timeline.mark(REQUEST_SENT, response_stream.started_ns)
+                timeline.extra["speculative"] = True
+                return response_stream
+            print("\nSending captured text to OpenAI for real-time completion...\n")
+            timeline.mark(REQUEST_SENT)
+            return self.stream_openai_completion(prompt, current_settings)
+
+        def output(response, cancel_token):
+            # Type out the completion text fast as it's received
+            timeline.queues = self.type_out_text_fast_streamed(response, current_settings, answer, cancel_token, timeline)
+
+        def finish(job):
+            if conversation_mode:
+                # Keep the turn (as far as it was typed) for the next prompt; compacting old turns happens in the background
+                conversation = self.conversations.get(current_settings)
+                timeline.extra.update(conversation.last_request)  # Prompt size, next to this activation's TTFT
+                conversation.record(prompt, ''.join(answer),
+                                    lambda summary, messages: self.summarize_conversation(summary, messages, current_settings))
+            timeline.extra["job_wait_ms"] = round((job.output_started - job.submitted) * 1000) if job.output_started else None
+            self.timelines.finish(timeline)
+            print("Connection stats:", self.providers.stats())
+            print("Stream stats:", self.stream_engine.stats())
+            print("Response cache stats:", self.response_cache.stats())
+            print("Profile stats:", self.profiles.stats())
+            print("Resilience stats:", self.resilience.stats())
+            print("Job stats:", jobs.stats())
+            print("Rate limit stats:", self.rate_limiter.stats())
+            if conversation_mode:
+                print("Conversation stats:", self.conversations.get(current_settings).stats())
+            if current_settings.get('hedging', "off") != "off":
+                print("Hedging stats:", self.hedger.stats())
+            if current_settings.get('speculative_prefetch', False):
+                print("Speculation stats:", self.speculator.stats())
+
+        if jobs.submit(Job(f"{action}-{jobs.submitted + 1}", targets, request, output, finish, eager=not conversation_mode)):
+            return True
+        # Rejected: stop the speculative stream (it would keep streaming and using tokens), and close the timeline
+        if hasattr(response_stream, 'cancel'):
+            response_stream.cancel()
+        timeline.extra["job_rejected"] = True
+        self.timelines.finish(timeline)
+        return False
+
+    def run_once(self) -> str:
+        """One activation, up to the hand-over of its prompt to the job scheduler: wait for a trigger, warm up what the
+        request and the output will need while the user types, capture the prompt and submit it. Returns the prompt."""
+        # Wait for a profile's prompt or completion keybind to start
+        # That profile's settings are used for the whole activation (no file reads, and consistent even if the menu saves meanwhile)
+        action, current_settings = self.wait_for_keypress()
+
+        # Open the connection to the API while the user types, so the handshake isn't paid after they finish
+        provider = self.providers.warm_up(current_settings)
+
+        # Re-list the provider's models in the background once the cached listing is older than model_cache_hours
+        self.model_registry.refresh_if_stale(provider, self.stream_engine,
+                                             current_settings.get('model_cache_hours', 24) * 3600)
+
+        # Likewise create the speech engine (on first use) while the user types, not on the way to the first spoken word
+        if current_settings.get('play_tts', False):
+            self.speech.start()
+
+        # Optionally start requests on the partial prompt whenever the user pauses typing. Not in conversation mode: the
+        # request would be built on a history that may not have the previous answer in it yet
+        speculate = current_settings.get('speculative_prefetch', False) and not current_settings.get('conversation_mode', False)
+        if speculate:
+            self.speculator.begin(lambda text: build_prompt(action, text),
+                                  lambda speculative_prompt: self.stream_openai_completion(speculative_prompt, current_settings),
+                                  pause_ms=current_settings.get('speculation_pause_ms', 700),
+                                  max_requests=current_settings.get('max_speculative_requests', 2))
+
+        # Capture the input from the user
+        timeline = self.timelines.current
+        try:
+            captured_text = self.capture_input(self.speculator.on_keystroke if speculate else None)
+        finally:
+            self.capturing.clear()
+
+        # Determine the prompt based on the keybind pressed
+        prompt = build_prompt(action, captured_text)
+
+        # Use the speculative stream if it was started on this exact prompt, otherwise the job sends the captured text.
+        # Either way the caller goes straight back to waiting for the next trigger while this answer is output.
+        self.submit_activation(action, prompt, current_settings, timeline,
+                               self.speculator.take(prompt) if speculate else None)
+        return prompt
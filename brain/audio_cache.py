@@ -0,0 +1,149 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class AudioCache:
+    """A bounded, content-addressed cache of rendered sentences, keyed on the text, the engine, the voice and the rate.
+
+    \n\nEntries live in memory, least-recently-used first out once they exceed max_bytes. With a directory, every entry
+    is also written to disk (one file per key, also LRU-bounded by disk_max_bytes), so cached sentences survive a
+    restart and an entry evicted from memory can be read back instead of being synthesized again."""
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, directory: str | None = None,
+                 disk_max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> audio bytes, least recently used first
+        self._memory_bytes = 0
+        self._disk = OrderedDict()    # key -> file size, least recently used first
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            files = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime)
+            for entry in files:
+                if entry.is_file() and entry.name.endswith(".audio"):
+                    self._disk[entry.name[:-len(".audio")]] = entry.stat().st_size
+                    self._disk_bytes += entry.stat().st_size
+
+        # Instrumentation
+        self.hits = 0
+        self.disk_hits = 0  # Hits that had to be read back from disk
+        self.misses = 0
+
+    @staticmethod
+    def make_key(engine: str, voice: str, rate: int, text: str) -> str:
+        return hashlib.sha256(f"{engine}\0{voice}\0{int(rate)}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".audio")
+
+    def get(self, key: str) -> bytes | None:
+        """Return the rendered audio for key, or None on a miss."""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+            if key in self._disk:
+                try:
+                    with open(self._path(key), "rb") as audio_file:
+                        audio = audio_file.read()
+                    os.utime(self._path(key))  # Keeps the disk LRU order across restarts
+                    self._disk.move_to_end(key)
+                    self._remember(key, audio)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return audio
+                except OSError:
+                    self._disk_bytes -= self._disk.pop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, audio: bytes) -> None:
+        """Store rendered audio, evicting the least recently used entries to stay within the size limits."""
+        if not isinstance(audio, (bytes, bytearray)) or len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            self._remember(key, bytes(audio))
+            if self.directory and key not in self._disk:
+                try:
+                    with open(self._path(key), "wb") as audio_file:
+                        audio_file.write(audio)
+                except OSError as e:
+                    print(f"Could not write to the audio cache: {e}")
+                    return
+                self._disk[key] = len(audio)
+                self._disk_bytes += len(audio)
+                while self._disk_bytes > self.disk_max_bytes and self._disk:
+                    old_key, old_size = self._disk.popitem(last=False)
+                    self._disk_bytes -= old_size
+                    try:
+                        os.remove(self._path(old_key))
+                    except OSError:
+                        pass
+
+    def _remember(self, key: str, audio: bytes) -> None:
+        """Add an entry to the memory tier (must hold the lock)."""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_bytes:
+            _, old_audio = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_audio)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+if __name__ == "__main__":
+    # Speak the same answer twice (as when a cached response is replayed) with a stand-in synthesizer that counts its
+    # invocations, then again from a fresh process's point of view, reading the disk tier back.
+    import tempfile
+    from speech import SpeechService, FakeSpeechBackend
+
+    answer = [f"This is sentence {n} of an answer that gets spoken more than once." for n in range(10)]
+
+    def speak(service):
+        service.begin_request()
+        for sentence in answer:
+            service.say(sentence)
+        service.mark().wait()
+        return service.first_audio[-1] * 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        backend = FakeSpeechBackend(render_seconds_per_char=0.002, speech_chars_per_second=2000)
+        service = SpeechService(lambda: backend)
+        service.audio_cache = AudioCache(directory=directory)
+        cold = speak(service)
+        after_cold = len(backend.synthesized)
+        warm = speak(service)
+        print(f"first audio: cold {cold:.0f} ms, cached {warm:.0f} ms; "
+              f"synthesizer calls: {after_cold} then {len(backend.synthesized) - after_cold}")
+        print("cache:", service.audio_cache.stats())
+        service.shutdown()
+
+        restarted_backend = FakeSpeechBackend(render_seconds_per_char=0.002, speech_chars_per_second=2000)
+        restarted = SpeechService(lambda: restarted_backend)
+        restarted.audio_cache = AudioCache(directory=directory)
+        from_disk = speak(restarted)
+        print(f"after a restart: first audio {from_disk:.0f} ms, synthesizer calls: {len(restarted_backend.synthesized)}")
+        print("cache:", restarted.audio_cache.stats())
+        restarted.shutdown()
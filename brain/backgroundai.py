@@ -1,29 +1,55 @@
+import time
+STARTED_AT = time.perf_counter()  # For the time to tray-ready; everything below is part of startup
 import keyboard
-from openai import OpenAI
 import os
-import time
+import json
 import threading
 from PyQt5.QtWidgets import QApplication, QSystemTrayIcon, QMenu, QAction
 from PyQt5.QtGui import QIcon
-from menu import (SettingsWindow, load_or_create_api_key, load_settings)
+from PyQt5.QtCore import pyqtSignal, QTimer
+from settings_service import settings_service, load_or_create_api_key, PRIVATE_FOLDER
+from providers import ProviderRegistry
+from model_registry import model_registry
+from stream_engine import StreamEngine
+from capture_engine import CaptureEngine
+from key_dispatcher import dispatcher
+from profiles import ProfileRegistry
+from conversation import ConversationStore
+from jobs import JobScheduler
+from response_cache import ResponseCache
+from speculation import Speculator
+from hedging import Hedger
+from resilience import ResilientRequests
+from rate_limits import RateLimiter
+from output_pipeline import OutputPipeline, FileSink
+from output_sinks import TypingSink, TTSSink
+from clipboard_output import PasteSink, Win32ClipboardBackend
+from speech import speech_service
+from audio_cache import AudioCache
+from timeline import TimelineRecorder, process_rss_bytes
+from activation import Activation
 import sys
 import ctypes
 from ctypes import wintypes
-from win32com.client import Dispatch
-import pythoncom
-
-from queue import Queue, Empty
 
 class SystemTrayIcon(QSystemTrayIcon):
+    timelines_updated = pyqtSignal()  # Emitted from the background task, handled on the GUI thread
+    error_notified = pyqtSignal(str, str)  # (title, message) of a failed request, shown as a tray notification
+    jobs_updated = pyqtSignal()  # Emitted by the job scheduler whenever a job starts, waits or finishes
+
     def __init__(self, app: QApplication):
         super().__init__(app)
-        self.settings_window = None  # Track the settings window instance
+        self.settings_window = None  # Built on the first open, then reused
+        self.menu_open_ms = []  # Click-to-visible latency of every open
 
         script_directory = os.path.dirname(os.path.abspath(__file__))
         image_path = os.path.join(script_directory, "write.png")
         icon = QIcon(image_path) if os.path.exists(image_path) else app.style().standardIcon(QSystemTrayIcon.SP_ComputerIcon)
         self.setIcon(icon)
         self.setToolTip("OpenAI App")
+        self.timelines_updated.connect(self.update_tooltip)
+        self.error_notified.connect(self.show_error)
+        self.jobs_updated.connect(self.update_tooltip)
 
         # Create the menu
         self.menu = QMenu()
@@ -41,28 +67,54 @@ class SystemTrayIcon(QSystemTrayIcon):
         # Connect the activated signal to handle icon clicks
         self.activated.connect(self.on_icon_clicked)
 
+    def update_tooltip(self):
+        """Show what the jobs are doing and the recent p50/p95 latencies in the tray tooltip."""
+        rate_limits = rate_limiter.summary_text()
+        self.setToolTip(f"OpenAI App\nJobs: {jobs.status_text()}\n" + timelines.summary_text()
+                        + (f"\nRate limits:\n{rate_limits}" if rate_limits else ""))
+
+    def show_error(self, title: str, message: str):
+        """Tell the user why an answer is missing or incomplete (print() output is lost under pythonw.exe)."""
+        self.showMessage(title, message, QSystemTrayIcon.Warning, 5000)
+
     def on_icon_clicked(self, reason):
         """Handle system tray icon click events"""
         if reason == QSystemTrayIcon.Trigger:  # Trigger is typically the left-click
             self.open_menu()
 
     def open_menu(self):
-        """Open the settings window or bring it to the front if already open."""
-        if self.settings_window is None or not self.settings_window.isVisible():  # Only open if not already open
-            pause_event.clear()  # Pause the background task
-            self.settings_window = SettingsWindow()  # Create the window instance
-            self.settings_window.show()
+        """Show the settings window, or bring it to the front if it's already open.
+
+        \n\nThe window is built on the first open and reused after that, only refreshing its fields from the current
+        settings. The background task keeps running while it's open; saved changes reach it as one new snapshot."""
+        started = time.perf_counter()
+        if self.settings_window is None:
+            from menu import SettingsWindow  # The settings UI is only loaded once the menu is first opened
+            self.settings_window = SettingsWindow(on_active_changed=self.on_settings_window_active)
             self.settings_window.finished.connect(self.on_settings_window_closed)  # Track window closing
+        if not self.settings_window.isVisible():
+            self.settings_window.refresh()
+            self.settings_window.show()
+            # Measured once the event loop has painted the window
+            QTimer.singleShot(0, lambda: self.record_menu_open(started))
+        # Bring the window to the front
+        self.settings_window.raise_()
+        self.settings_window.activateWindow()  # Activate/focus the window
+
+    def record_menu_open(self, started: float) -> None:
+        self.menu_open_ms.append(round((time.perf_counter() - started) * 1000, 1))
+        print(f"Settings window visible in {self.menu_open_ms[-1]} ms (previous opens: {self.menu_open_ms[:-1][-5:]})")
+
+    def on_settings_window_active(self, active: bool) -> None:
+        """While the user types into the settings window, its keys mustn't trigger or feed an activation."""
+        if active:
+            capture_engine.pause()
         else:
-            # Bring the window to the front if it's already open
-            self.settings_window.raise_()  # Bring the window to the front
-            self.settings_window.activateWindow()  # Activate/focus the window
+            capture_engine.resume()
 
     def on_settings_window_closed(self):
-        """Reset the settings window tracking when it's closed."""
-        self.settings_window = None  # Set to None when window is closed
-        reload_settings()  # Reload keybinds, settings, and custom instructions after the menu is closed
-        pause_event.set()  # Resume the background task
+        """The window is hidden, not destroyed, so the next open is instant."""
+        capture_engine.resume()  # In case it was closed without losing focus first
 
 
 # Default keybinds
@@ -78,20 +130,57 @@ if not api_key:
     print("API key not found. Please set it in the settings.")
     #sys.exit(1)
 
-# Initialize the OpenAI client with your API key
-client = OpenAI(api_key=api_key)
+# Requests run on the stream engine's asyncio loop, so a stop can abort the HTTP stream immediately.
+stream_engine = StreamEngine()
+
+# Each model's requests/min and tokens/min budget, learned from the providers' rate-limit headers, so a request that
+# would get a 429 is held briefly or sent to the rate_limit_model instead
+rate_limiter = RateLimiter()
+
+# One async client per configured provider (the OpenAI API, a local OpenAI-compatible server, ...), each on its own
+# keep-alive connection pool that can be warmed up ahead of a request. Rebuilt when the "providers" setting changes.
+# Clients are created (and openai imported) on the first warm-up, not here.
+providers = ProviderRegistry(load_or_create_api_key, stream_engine, on_response=rate_limiter.observe_response)
+providers.configure(settings_service.get())
+
+# On-disk cache of complete responses, replayed instead of calling the API for repeated prompts
+response_cache = ResponseCache(os.path.join(PRIVATE_FOLDER, "response_cache.sqlite3"),
+                               max_bytes=int(settings_service.get().get('cache_max_mb', 20) * 1024 * 1024))
 
-# Event to control background task pause/resume
-pause_event = threading.Event()
+# Rendered sentences, replayed instead of synthesizing them again (in memory, plus on disk if tts_cache_on_disk is on)
+if settings_service.get().get('tts_cache', True):
+    speech_service.audio_cache = AudioCache(
+        max_bytes=int(settings_service.get().get('tts_cache_mb', 16) * 1024 * 1024),
+        directory=os.path.join(PRIVATE_FOLDER, "tts_cache") if settings_service.get().get('tts_cache_on_disk', False) else None)
 
-# Events to control stopping of typing and TTS
-typing_stop_event = threading.Event()
-tts_stop_event = threading.Event()
+# Sends a second request to a backup model/provider when the first token is slow (hedging setting "delay" or "race")
+hedger = Hedger()
 
-# Global variables to hold settings
-settings = load_settings()
-keybinds = settings["keybinds"]
-custom_instructions = settings["custom_instructions"]
+# Watches every request for a missing first token or a stalled stream, retries transient errors with jittered backoff,
+# skips providers whose circuit breaker is open and fails over to the fallback_model; errors end up in the tray
+resilience = ResilientRequests()
+
+# Records a timeline of every activation to a rotating JSONL file (print() output is lost under pythonw.exe)
+timelines = TimelineRecorder(os.path.join(PRIVATE_FOLDER, "timeline.jsonl"))
+
+# Each profile's rolling message history, for follow-up prompts (when conversation_mode is on)
+conversations = ConversationStore()
+
+# Starts requests on the partial prompt while the user pauses typing (when speculative_prefetch is on)
+speculator = Speculator()
+
+# Runs each activation's request and output as a job, so the next prompt can be captured while an answer is typed;
+# answers to the same output (typing, speech, ...) still come out one after the other
+jobs = JobScheduler()
+
+# Buffers timestamped key events from the key dispatcher's hook, instead of blocking in keyboard.read_event(). Paused
+# while the settings window has focus (its running event); answers being output carry on meanwhile
+capture_engine = CaptureEngine()
+
+# Every profile's settings, resolved in memory once per settings snapshot; the hotkey pressed picks the profile
+profiles = ProfileRegistry(settings_service.get())
+
+# Settings are read from settings_service.get(), an immutable snapshot that is swapped atomically when settings.json changes
 
 # Define constants for mutex
 CREATE_MUTEX = 0x00000001
@@ -106,327 +195,35 @@ def check_single_instance():
         sys.exit(0)  # Exit the program if another instance is found
 
 
-def is_chat_model(model_id):
-    """Determine if the model is a chat model or a legacy completion model."""
-    # List of known chat models
-    chat_models = [
-        'gpt-3.5-turbo',
-        'gpt-3.5-turbo-16k',
-        'gpt-3.5-turbo-0125',
-        'gpt-3.5-turbo-1106',
-        'gpt-4',
-        'gpt-4-0613',
-        'gpt-4-1106-preview',
-        'gpt-4-turbo',
-        'gpt-4-turbo-2024-04-09',
-        'gpt-4-turbo-preview',
-        'gpt-4o',
-        'gpt-4o-2024-05-13',
-        'gpt-4o-mini',
-        'gpt-4o-mini-2024-07-18',
-        'gpt4o-0806-loco-vm',
-    ]
-    return model_id in chat_models
-
-
-def wait_for_keypress():
-    print(f"Press {keybinds['prompt']} or {keybinds['completion']} to start typing.")
-
-    # Continuously wait for either the prompt or completion keybind
-    while True:
-        pause_event.wait()  # Wait if the event is paused
-        event = keyboard.read_event() # this blocks until a key is pressed on the keyboard, which means that if pause event happens, would still be waiting for a key press
-        if event.event_type == keyboard.KEY_DOWN and event.name in [keybinds['prompt'], keybinds['completion']]:
-            return event.name  # Return the key that was pressed to start the input capture
+def paste_from_clipboard() -> None:
+    keyboard.send('ctrl+v')  # The paste sink marks the keystroke on its answer's timeline
 
 
-def capture_input():
-    print("Started capturing text. Type now... (Press the same key to stop)")
+# Fans each answer out to the output sinks, which run on their own long-lived threads
+output_pipeline = OutputPipeline()
+output_pipeline.register(TypingSink(keyboard.write, timelines))
+output_pipeline.register(TTSSink(speech_service, timelines))
+output_pipeline.register(PasteSink(Win32ClipboardBackend(), paste_from_clipboard, mark=dispatcher.injecting))
+output_pipeline.register(FileSink())
 
-    captured_text = []
-    while True:
-        pause_event.wait()  # Wait if the event is paused
-        event = keyboard.read_event()
-        if event.event_type == keyboard.KEY_DOWN:
-            key = event.name
-
-            # Stop capturing input when either keybind is pressed again
-            if key in [keybinds['prompt'], keybinds['completion']]:
-                break
-
-            if key == 'backspace':
-                if captured_text:
-                    captured_text.pop()  # Remove last character on backspace
-            elif key == 'space':
-                captured_text.append(' ')  # Append space
-            elif key == 'enter':
-                captured_text.append('\n')  # Append newline on enter
-            elif len(key) == 1:  # Only add single character keys
-                captured_text.append(key)
-
-    # Join the list of captured text into a single string
-    captured_string = ''.join(captured_text)
-    print("\nCaptured text:\n" + captured_string)
-
-    return captured_string
-
-
-def stream_openai_completion(prompt:str):
-    try:
-        # Load settings
-        current_settings = load_settings()
-        temperature = current_settings.get('temperature', 1.0)
-        max_tokens = current_settings.get('max_tokens', 256)
-        model_id = current_settings['model']
-        custom_instructions = current_settings['custom_instructions']
-
-        # Prepare the prompt or messages
-        if is_chat_model(model_id):
-            # Use the Chat Completion API
-            messages = []
-            if custom_instructions.strip():
-                messages.append({"role": "system", "content": custom_instructions})
-            messages.append({"role": "user", "content": prompt})
-
-            response = client.chat.completions.create(
-                model=model_id,
-                messages=messages,
-                stream=True,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0
-            )
-        else:
-            # Use the Legacy Completion API
-            # Combine custom instructions and prompt
-            combined_prompt = f"{custom_instructions}\n{prompt}" if custom_instructions.strip() else prompt
-
-            response = client.completions.create(
-                model=model_id,
-                prompt=combined_prompt,
-                stream=True,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0
-            )
-        return response
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return None
-
-
-def clean_text(text:str) -> str:
-    """Clean the text by removing newlines and non-printable characters."""
-    # Remove newlines
-    text = text.replace('\n', ' ').replace('\r', ' ')
-    # Remove non-printable or unwanted characters
-    text = ''.join(c for c in text if c.isprintable())
-    return text.strip()
-
-
-def type_out_text_fast_streamed(response) -> None:
-    """spawns typing, text-to-speech (tts), and stop-listener workers using multithreading"""
-    print("\nTyping out the text as it's received...")
-
-    if response is None:
-        return
-
-    # Load settings
-    current_settings = load_settings()
-    auto_type = current_settings.get('auto_type', True)
-    typing_speed_wpm = current_settings.get('typing_speed_wpm', 200)
-    letter_by_letter = current_settings.get('letter_by_letter', True)
-    play_tts = current_settings.get('play_tts', False)
-    tts_rate = current_settings.get('tts_rate', 0)
-
-    # Initialize queues and threads
-    typing_queue = Queue()
-    tts_queue = Queue()
-
-    # Clear stop events
-    typing_stop_event.clear()
-    tts_stop_event.clear()
-
-    if auto_type:
-        typing_thread = threading.Thread(target=typing_worker, args=(typing_queue, typing_speed_wpm, letter_by_letter, typing_stop_event))
-        typing_thread.daemon = True
-        typing_thread.start()
-
-    if play_tts:
-        tts_thread = threading.Thread(target=tts_worker, args=(tts_queue, tts_rate, tts_stop_event))
-        tts_thread.daemon = True
-        tts_thread.start()
-
-    # Start the stop listener
-    stop_listener = threading.Thread(target=stop_listener_worker)
-    stop_listener.daemon = True
-    stop_listener.start()
-
-    # Iterate over each streamed chunk as it comes in
-    for chunk in response:
-        pause_event.wait()  # Wait if the event is paused
-        if typing_stop_event.is_set() or tts_stop_event.is_set():
-            break  # Stop processing if stop event is set
-        if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
-            choice = chunk.choices[0]
-            token = None
-            if hasattr(choice, 'delta') and hasattr(choice.delta, 'content'):
-                # Chat completion response
-                token = choice.delta.content
-            elif hasattr(choice, 'text'):
-                # Legacy completion response
-                token = choice.text
-            else:
-                continue  # Skip if no content
-
-            if token:
-                # Put token into queues
-                if auto_type:
-                    typing_queue.put(token)
-                if play_tts:
-                    tts_queue.put(token)
-
-    # Signal the workers to stop
-    if auto_type:
-        typing_queue.put(None)  # Sentinel value
-        typing_thread.join()
-    if play_tts:
-        tts_queue.put(None)
-        tts_thread.join()
-
-    # Stop the stop listener
-    keyboard.unhook_all()
-
-
-def typing_worker(typing_queue:Queue, typing_speed_wpm:int, letter_by_letter:bool, stop_event:threading.Event) -> None:
-    # Calculate delay between characters based on typing speed (WPM)
-    chars_per_minute = typing_speed_wpm * 5  # Approximate words per minute to characters per minute
-    delay_per_char = 60 / chars_per_minute  # Time per character in seconds
 
-    while True:
-        if stop_event.is_set():
-            break  # Exit the loop
-
-        try:
-            token = typing_queue.get(timeout=0.1)
-        except Empty:
-            continue
-
-        if token is None:
-            break  # Exit the loop
-
-        if letter_by_letter:
-            for char in token:
-                if stop_event.is_set():
-                    break  # Exit the loop
-                keyboard.write(char)
-                time.sleep(delay_per_char)
-        else:
-            keyboard.write(token)
-            time.sleep(len(token) * delay_per_char)
-        typing_queue.task_done()
-
-
-def tts_worker(tts_queue:Queue, tts_rate:int, stop_event:threading.Event) -> None:
-    pythoncom.CoInitialize()
-    try:
-        speaker = Dispatch("SAPI.SpVoice")
-        SVSFlagsAsync = 1  # Manually define SVSFlagsAsync
-
-        # Set the TTS rate
-        speaker.Rate = tts_rate
-
-        sentence_buffer = ""
-        sentence_terminators = {'.', '!', '?'}
-
-        while True:
-            if stop_event.is_set():
-                speaker.Speak("", 3)  # SVSFPurgeBeforeSpeak to stop speaking immediately
-                break  # Exit the loop
-
-            try:
-                token = tts_queue.get(timeout=0.1)
-            except Empty:
-                continue  # Wait for more tokens
-
-            if token is None:
-                # Process any remaining text
-                if sentence_buffer.strip():
-                    clean_sentence = clean_text(sentence_buffer)
-                    if clean_sentence:
-                        speaker.Speak(clean_sentence, SVSFlagsAsync)
-                        speaker.WaitUntilDone(-1)
-                break  # Exit the loop
-            else:
-                # Accumulate tokens into sentences
-                sentence_buffer += token
-
-                # Process any complete sentences in the buffer
-                while True:
-                    # Find the earliest occurrence of a sentence terminator
-                    indices = [sentence_buffer.find(t) for t in sentence_terminators if sentence_buffer.find(t) != -1]
-                    if indices:
-                        min_index = min(indices)
-                        # Include the terminator
-                        sentence_end = min_index + 1
-                        sentence = sentence_buffer[:sentence_end]
-                        # Clean and speak the sentence
-                        clean_sentence = clean_text(sentence)
-                        if clean_sentence:
-                            speaker.Speak(clean_sentence, SVSFlagsAsync)
-                            speaker.WaitUntilDone(-1)
-                        # Remove the sentence from the buffer
-                        sentence_buffer = sentence_buffer[sentence_end:]
-                    else:
-                        break  # No complete sentences left in the buffer
-
-            tts_queue.task_done()
-    finally:
-        pythoncom.CoUninitialize()
-
-
-def stop_listener_worker() -> None:
-    """Sets a keyboard hook that, on keydown event, sets the typing_stop_event and the tts_stop_event flags that stop the other workers providing the AI's output."""
-    def on_key_event(event):
-        if event.event_type == 'down':
-            # Set the stop events to stop typing and TTS
-            typing_stop_event.set()
-            tts_stop_event.set()
-            # Unhook the listener
-            keyboard.unhook_all()
-
-    # Hook the keyboard to listen for any key press
-    keyboard.hook(on_key_event)
+# The activation path itself (capture, request, output as a job), on the services above; the bench harness runs the
+# same one on a fake keyboard
+activation = Activation(dispatcher, capture_engine, output_pipeline, providers, stream_engine, model_registry, profiles,
+                        jobs, timelines, response_cache, rate_limiter, hedger, resilience, conversations, speculator,
+                        speech_service)
 
 
 def background_task() -> None:
     """The semi-self-contained function run as a background subprocess to listen to keyboard input, send the input to the AI model, and output the resulting response. 
-    \n\nCan be paused by the setting of the pause_event threading.Event (when the settings menu is being used.) """
+    \n\nThe request and output of each prompt run as a job (see Activation.submit_activation), so this loop only ever waits for
+    the user. Waits while capture is paused (when the settings menu is being used), without holding up the answers
+    being output."""
     # Continuous loop to keep the program running indefinitely
     while True:
-        pause_event.wait()  # Wait if the event is paused
-        # Wait for prompt or completion keybind to start
-        key_pressed = wait_for_keypress()
-
-        # Capture the input from the user
-        captured_text = capture_input()
-
-        # Determine the prompt based on the key pressed
-        if key_pressed == keybinds['prompt']:
-            prompt = captured_text  # Use the captured text as is
-        elif key_pressed == keybinds['completion']:
-            prompt = f"Continue the following text: {captured_text}"
-
-        # Send the captured text to OpenAI for streaming completion
-        print("\nSending captured text to OpenAI for real-time completion...\n")
-        response_stream = stream_openai_completion(prompt)
-
-        # Type out the completion text fast as it's received
-        type_out_text_fast_streamed(response_stream)
+        capture_engine.running.wait()  # Wait while capture is paused
+        # Wait for a trigger, capture the prompt and submit it as a job, then go straight back to waiting
+        activation.run_once()
 
 
 
@@ -436,22 +233,30 @@ def background_task() -> None:
 #     # No need to call sys.exit() here; the main thread will exit after icon.stop()
 
 
-def reload_settings():
-    """Reload keybinds, settings, and custom instructions after settings are updated."""
-    global keybinds, settings, custom_instructions
-    settings = load_settings()
-    keybinds = settings['keybinds']
-    custom_instructions = settings['custom_instructions']
-    print("Settings reloaded:", keybinds, settings)
-
+def report_startup(app: QApplication, benchmark: bool = False) -> None:
+    """Print the time from the first import to tray-ready. With --startup-benchmark, also print the idle RSS as JSON
+    a couple of seconds later, then quit (used by python -m bench.startup)."""
+    tray_ready_ms = round((time.perf_counter() - STARTED_AT) * 1000, 1)
+    print(f"Tray ready in {tray_ready_ms} ms")
+    if benchmark:
+        def report_idle():
+            rss = process_rss_bytes()
+            print(json.dumps({"tray_ready_ms": tray_ready_ms,
+                              "idle_rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None}), flush=True)
+            app.quit()
+        QTimer.singleShot(2000, report_idle)
 
 
-if __name__ == "__main__":
+def main() -> None:
+    """Start the app: the keyboard hook, the background task and the tray icon, all in this one process."""
     # Ensure only one instance of the program is running
     check_single_instance()
 
-    # Set the event to 'set' (background task can run)
-    pause_event.set()
+    # Start capturing (the background task waits until then)
+    capture_engine.resume()
+
+    # Pick up edits made to settings.json while the program is running
+    settings_service.start_watching()
 
     # Initialize QApplication
     app = QApplication(sys.argv)
@@ -459,6 +264,23 @@ if __name__ == "__main__":
     # ensure that the application doesn't quit when the settings window is closed.
     app.setQuitOnLastWindowClosed(False)
 
+    # Write the response cache's hit/miss counters out on the way out (lookups don't write to disk)
+    app.aboutToQuit.connect(response_cache.close)
+
+    # Install the one keyboard hook, and route its events to the capture engine and the trigger hotkeys
+    dispatcher.subscribe(capture_engine.on_event)
+    dispatcher.subscribe(activation.stop_output_listener)  # A key press stops the answers being output
+    activation.register_trigger_hotkeys(settings_service.get())
+    settings_service.subscribe(activation.register_trigger_hotkeys)  # Recompile the hotkeys whenever the keybinds change
+    dispatcher.install()
+
+    # Rebuild the provider clients when the "providers" setting changes
+    settings_service.subscribe(providers.configure)
+
+    # Rate/voice changes from the settings menu apply to the speech engine live (it's only created when first used)
+    speech_service.configure(settings_service.get())
+    settings_service.subscribe(speech_service.configure)
+
     # Run the background task in a separate thread
     task_thread = threading.Thread(target=background_task)
     task_thread.daemon = True
@@ -467,5 +289,22 @@ if __name__ == "__main__":
     # Setup the system tray icon
     tray_icon = SystemTrayIcon(app)
 
+    # Refresh the tray tooltip's p50/p95 latencies after every activation
+    timelines.on_finish = tray_icon.timelines_updated.emit
+
+    # Failed and cut-off requests, and prompts dropped because too many answers are waiting, show up as tray notifications
+    resilience.on_error = tray_icon.error_notified.emit
+    jobs.on_error = tray_icon.error_notified.emit
+
+    # Show what the jobs are doing in the tray tooltip
+    jobs.on_change = tray_icon.jobs_updated.emit
+
+    # Report how long it took to get here once the event loop is running, i.e. the tray icon is up
+    QTimer.singleShot(0, lambda: report_startup(app, "--startup-benchmark" in sys.argv))
+
     # Start the event loop
     sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+"""Headless end-to-end benchmarks of an activation: synthetic key events, a local mock OpenAI-compatible server, and
+fake keyboard and speech backends. Runs on any OS. Run it with python -m bench from the brain folder."""
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from bench.harness import BenchHarness, SCENARIOS, METRICS, environment, compare
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def print_summary(name: str, results: dict) -> None:
+    summary = results["summary"]
+    print(f"{name}: " + ", ".join(f"{metric} {summary[metric]}" for metric in METRICS if metric in summary)
+          + ("" if summary["all_correct"] else "  [OUTPUT MISMATCH]"))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="End-to-end latency benchmarks of an activation.")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="Recorded activations per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="Unrecorded activations before them")
+    parser.add_argument("--out", help="Where to save the results (default: bench/results/<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="A previous results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative worsening reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own output during the runs")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    harness = BenchHarness(verbose=args.verbose)
+    results = {**environment(), "runs_per_scenario": args.runs, "scenarios": {}}
+    try:
+        for name in args.scenarios or SCENARIOS:
+            results["scenarios"][name] = harness.run_scenario(SCENARIOS[name], runs=args.runs, warmup=args.warmup)
+            print_summary(name, results["scenarios"][name])
+    finally:
+        harness.shutdown()
+
+    out = args.out or os.path.join(RESULTS_FOLDER, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results saved to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, results, args.tolerance)
+        print(f"Compared with {args.compare} (commit {baseline.get('git_commit')}):")
+        for scenario, metric, before, after, change in regressions:
+            print(f"  REGRESSION {scenario} {metric}: {before} -> {after}"
+                  + (f" ({change * 100:+.0f}%)" if change is not None else ""))
+        if regressions:
+            return 1
+        print("  no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from stream_engine import StreamEngine
+from providers import ProviderRegistry
+from response_cache import chunk_text
+from conversation import Conversation
+from metrics import percentile
+
+from bench.harness import BRAIN_FOLDER, BENCH_MODEL, environment, bench_settings
+from bench.mock_server import MockServerProcess
+
+# A server whose first token takes longer the longer the prompt is, like a real model's prefill
+SERVER = {"ttft_ms": 150, "gap_ms": 2, "token_chars": 5, "tokens": 80, "prefill_us_per_char": 20}
+
+
+def run_session(engine, provider, turns: int, token_budget: int, keep_turns: int, max_tokens: int) -> list:
+    """turns follow-up activations in one conversation: the prompt size and time to first token of each."""
+    conversation = Conversation(token_budget=token_budget, keep_turns=keep_turns)
+
+    def summarize(summary, messages):
+        request = [{"role": "system", "content": "Summarize this conversation in a few sentences."}]
+        if summary:
+            request.append({"role": "system", "content": summary})
+        handle = engine.stream(provider.client.chat.completions.create, model=BENCH_MODEL, messages=request + messages,
+                               stream=True, max_tokens=max_tokens)
+        return ''.join(chunk_text(chunk) or '' for chunk in handle)[:400]
+
+    results = []
+    for turn in range(turns):
+        prompt = f"Follow-up question number {turn} about the answer above, in a sentence of ordinary length."
+        started = time.perf_counter()
+        messages = conversation.messages("Answer briefly.", prompt)
+        build_ms = (time.perf_counter() - started) * 1000
+        request_sent = time.perf_counter()
+        handle = engine.stream(provider.client.chat.completions.create, model=BENCH_MODEL, messages=messages, stream=True,
+                               max_tokens=max_tokens)
+        answer, first_chunk = [], None
+        for chunk in handle:
+            token = chunk_text(chunk)
+            if token:
+                first_chunk = first_chunk or time.perf_counter()
+                answer.append(token)
+        recorded = time.perf_counter()
+        conversation.record(prompt, ''.join(answer), summarize)
+        results.append({
+            "turn": turn + 1,
+            **conversation.last_request,
+            "request_chars": sum(len(message["content"]) for message in messages),
+            "build_ms": round(build_ms, 3),
+            "ttft_ms": round((first_chunk - request_sent) * 1000, 1) if first_chunk else None,
+            "record_ms": round((time.perf_counter() - recorded) * 1000, 3),
+        })
+    results[-1]["stats"] = conversation.stats()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.conversation",
+                                     description="Prompt size and time to first token as a conversation's history grows.")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--budget", type=int, default=1500, help="conversation_token_budget of the budgeted session")
+    parser.add_argument("--keep-turns", type=int, default=2)
+    parser.add_argument("--out", help="Where to save the results (default: bench/results/conversation-<time>.json)")
+    args = parser.parse_args()
+
+    server = MockServerProcess(**SERVER).start()
+    engine = StreamEngine()
+    providers = ProviderRegistry(lambda: "", engine)
+    try:
+        provider = providers.warm_up(bench_settings(SERVER, server.url))
+        run_session(engine, provider, 1, args.budget, args.keep_turns, SERVER["tokens"])  # The first request is slower
+        results = {**environment(), "server": SERVER, "sessions": {}}
+        # The same conversation without a budget (every turn resent), then with one
+        for name, budget in (("unbounded", 10 ** 9), ("budgeted", args.budget)):
+            session = run_session(engine, provider, args.turns, budget, args.keep_turns, SERVER["tokens"])
+            results["sessions"][name] = session
+            print(f"{name}:")
+            print(f"  {'turn':>4} {'prompt tokens':>13} {'turns sent':>10} {'ttft ms':>8} {'build ms':>8} {'record ms':>9}")
+            for result in session:
+                print(f"  {result['turn']:>4} {result['prompt_tokens']:>13} {result['history_turns']:>10} "
+                      f"{result['ttft_ms']:>8} {result['build_ms']:>8} {result['record_ms']:>9}")
+            print(f"  p50 ttft {percentile([result['ttft_ms'] for result in session], 0.5)} ms, "
+                  f"last turn {session[-1]['ttft_ms']} ms; {session[-1]['stats']}")
+    finally:
+        server.stop()
+        engine.shutdown()
+
+    out = args.out or os.path.join(BRAIN_FOLDER, "bench", "results", time.strftime("conversation-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results saved to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
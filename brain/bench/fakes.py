@@ -0,0 +1,54 @@
+import time
+import threading
+
+from key_dispatcher import KEY_DOWN, KEY_UP
+
+
+class FakeKeyboard:
+    """Stands in for keyboard.write: records every injected string with the time it was written."""
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.writes = []  # (timestamp ns, text)
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> None:
+        with self._lock:
+            self.writes.append((self.clock(), text))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.writes = []
+
+    @property
+    def text(self) -> str:
+        return ''.join(text for _, text in self.writes)
+
+
+class SyntheticTypist:
+    """Feeds key events into a KeyDispatcher as if a user pressed the trigger, typed the prompt, then pressed it again."""
+
+    def __init__(self, dispatcher, trigger: str, text: str, key_interval_ms: float = 5, pause_before_ms: float = 20):
+        self.dispatcher = dispatcher
+        self.trigger = trigger
+        self.text = text
+        self.key_interval = key_interval_ms / 1000
+        self.pause_before = pause_before_ms / 1000
+
+    def press(self, name: str) -> None:
+        self.dispatcher.inject(name, KEY_DOWN)
+        self.dispatcher.inject(name, KEY_UP)
+
+    def run(self) -> None:
+        time.sleep(self.pause_before)
+        self.press(self.trigger)
+        for char in self.text:
+            time.sleep(self.key_interval)
+            self.press('space' if char == ' ' else char)
+        time.sleep(self.key_interval)
+        self.press(self.trigger)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True, name="synthetic-typist")
+        thread.start()
+        return thread
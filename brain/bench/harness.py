@@ -0,0 +1,246 @@
+import io
+import os
+import json
+import time
+import platform
+import threading
+import contextlib
+import subprocess
+
+from key_dispatcher import KeyDispatcher
+from capture_engine import CaptureEngine
+from stream_engine import StreamEngine
+from providers import ProviderRegistry
+from model_registry import ModelRegistry
+from profiles import ProfileRegistry
+from conversation import ConversationStore
+from jobs import JobScheduler
+from response_cache import ResponseCache
+from speculation import Speculator
+from hedging import Hedger
+from resilience import ResilientRequests
+from rate_limits import RateLimiter
+from output_pipeline import OutputPipeline
+from output_sinks import TypingSink, TTSSink
+from speech import SpeechService, FakeSpeechBackend
+from timeline import TimelineRecorder, CAPTURE_END, FIRST_CHUNK, FIRST_KEYSTROKE, FIRST_AUDIO, LAST_KEYSTROKE
+from activation import Activation
+from metrics import percentile
+
+from bench.fakes import FakeKeyboard, SyntheticTypist
+from bench.mock_server import MockServerProcess, synthetic_answer
+
+BRAIN_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIGGER_KEY = "right shift"
+BENCH_MODEL = "bench-model"
+
+# The options of the mock server, and their defaults
+SERVER_OPTIONS = {"ttft_ms": 250, "gap_ms": 20, "token_chars": 4, "tokens": 120, "sentence_tokens": 12, "jitter_ms": 0, "seed": 0,
+                  "prefill_us_per_char": 0}
+
+# Named scenarios: the mock server's stream, plus the typing speed and whether the answer is also spoken
+SCENARIOS = {
+    "baseline": {"ttft_ms": 250, "gap_ms": 20, "token_chars": 4, "tokens": 120, "typing_speed_wpm": 2000},
+    "fast_stream": {"ttft_ms": 100, "gap_ms": 4, "token_chars": 4, "tokens": 300, "typing_speed_wpm": 6000},
+    "slow_first_token": {"ttft_ms": 1200, "gap_ms": 30, "token_chars": 4, "tokens": 60, "typing_speed_wpm": 1000},
+    "large_tokens": {"ttft_ms": 250, "gap_ms": 40, "token_chars": 24, "tokens": 40, "jitter_ms": 20, "typing_speed_wpm": 3000},
+}
+
+# Summarized metrics: name -> (higher is better, noise floor). A change smaller than the floor (in the metric's own
+# unit) is never reported as a regression, however large it is relative to the baseline.
+METRICS = {
+    "first_chunk_ms": (False, 5),
+    "first_keystroke_ms": (False, 5),
+    "first_audio_ms": (False, 10),
+    "last_keystroke_ms": (False, 25),
+    "pacing_error_pct": (False, 1),
+    "mean_lateness_ms": (False, 0.5),
+    "tokens_per_second": (True, 1),
+    "characters_per_second": (True, 5),
+    "cpu_us_per_token": (False, 25),
+}
+
+
+def bench_settings(scenario: dict, base_url: str) -> dict:
+    """The default settings, pointed at the mock server and set up for the scenario."""
+    with open(os.path.join(BRAIN_FOLDER, "defaultSettings.json"), encoding="utf-8") as defaults:
+        settings = json.load(defaults)
+    settings.update({
+        "model": BENCH_MODEL,
+        "provider": "bench",
+        "providers": {"bench": {"base_url": base_url, "api_key": "", "timeout": 30, "connect_timeout": 2,
+                                "models": [BENCH_MODEL]}},
+        "auto_type": True,
+        "output_mode": "type",
+        "letter_by_letter": True,
+        "typing_speed_wpm": scenario.get("typing_speed_wpm", 2000),
+        "play_tts": scenario.get("play_tts", True),
+        "tts_rate": 0,
+        "tts_voice": "",
+        "max_tokens": scenario.get("tokens", SERVER_OPTIONS["tokens"]),
+    })
+    return settings
+
+
+class BenchHarness:
+    """Drives the app's activation path (activation.Activation) headlessly: synthetic key events in, a fake keyboard and
+    a fake speech backend out.
+
+    \n\nThe services are the app's own (key dispatcher, capture engine, stream engine, provider registry, response cache,
+    rate limiter, hedger, resilience, job scheduler, output pipeline with the typing and TTS sinks, timeline recorder),
+    wired the way backgroundai wires them. Only the operating system's keyboard and speech engine are replaced."""
+
+    def __init__(self, render_seconds_per_char: float = 0.0005, speech_chars_per_second: float = 1000.0,
+                 verbose: bool = False):
+        self.verbose = verbose
+        self.dispatcher = KeyDispatcher()
+        self.capture_engine = CaptureEngine()
+        self.capture_engine.resume()
+        self.dispatcher.subscribe(self.capture_engine.on_event)
+
+        self.stream_engine = StreamEngine()
+        self.rate_limiter = RateLimiter()
+        self.providers = ProviderRegistry(lambda: "", self.stream_engine, on_response=self.rate_limiter.observe_response)
+        self.timelines = TimelineRecorder()
+        self.jobs = JobScheduler()
+        self.resilience = ResilientRequests()
+
+        self.keyboard = FakeKeyboard()
+        self.speech_backend = FakeSpeechBackend(render_seconds_per_char, speech_chars_per_second)
+        self.speech = SpeechService(lambda: self.speech_backend).start()
+        self.output_pipeline = OutputPipeline()
+        self.output_pipeline.register(TypingSink(self.keyboard.write, self.timelines))
+        self.output_pipeline.register(TTSSink(self.speech, self.timelines))
+
+        self.activation = Activation(self.dispatcher, self.capture_engine, self.output_pipeline, self.providers,
+                                     self.stream_engine, ModelRegistry(cache_file=None), ProfileRegistry(), self.jobs,
+                                     self.timelines, ResponseCache(":memory:"), self.rate_limiter, Hedger(),
+                                     self.resilience, ConversationStore(), Speculator(), self.speech)
+        self.dispatcher.subscribe(self.activation.stop_output_listener)
+
+        # Set when an activation's job has written its timeline
+        self._finished = threading.Event()
+        self.timelines.on_finish = self._finished.set
+        self._errors = []
+        self.resilience.on_error = lambda title, message: self._errors.append(message)
+
+    def configure(self, settings: dict) -> None:
+        """Apply a scenario's settings, as the settings service's subscribers do when the settings change."""
+        self.providers.configure(settings)
+        self.activation.register_trigger_hotkeys(settings)
+
+    def run_activation(self, prompt: str, settings: dict, answer: list) -> dict:
+        """One activation, from the trigger keypress to the last keystroke, and its metrics."""
+        self.keyboard.reset()
+        spoken_before = len(self.speech_backend.synthesized)
+        self._finished.clear()
+        self._errors.clear()
+        typist = SyntheticTypist(self.dispatcher, TRIGGER_KEY, prompt).start()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output) if not self.verbose else contextlib.nullcontext():
+            cpu_started = time.process_time()
+            captured = self.activation.run_once()  # Returns once the job is submitted, like the background task
+            if not self._finished.wait(60):
+                raise RuntimeError("The activation's job never finished")
+            cpu_seconds = time.process_time() - cpu_started
+            while self.jobs.busy:
+                time.sleep(0.001)  # The job prints its stats after writing the timeline
+        typist.join()
+        if self._errors:
+            raise RuntimeError(f"The stream failed: {self._errors[0]}")
+        record = self.timelines.recent[-1]
+
+        milestones = record["milestones_ms"]
+
+        def since_capture_end(milestone):
+            if milestone not in milestones:
+                return None
+            return round(milestones[milestone] - milestones[CAPTURE_END], 1)
+
+        pacing = self.output_pipeline.get("typing").pacer.stats()
+        target_wpm = pacing["target_wpm"]
+        return {
+            "first_chunk_ms": since_capture_end(FIRST_CHUNK),
+            "first_keystroke_ms": since_capture_end(FIRST_KEYSTROKE),
+            "first_audio_ms": since_capture_end(FIRST_AUDIO),
+            "last_keystroke_ms": since_capture_end(LAST_KEYSTROKE),
+            "tokens_per_second": record["tokens_per_second_received"],
+            "characters_per_second": record["characters_per_second_typed"],
+            "target_wpm": target_wpm,
+            "achieved_wpm": pacing["achieved_wpm"],
+            "pacing_error_pct": round(abs(pacing["achieved_wpm"] / target_wpm - 1) * 100, 2) if target_wpm else None,
+            "mean_lateness_ms": pacing["mean_lateness_ms"],
+            "inject_calls": pacing["inject_calls"],
+            "cpu_us_per_token": round(cpu_seconds / record["chunks_received"] * 1e6, 1) if record["chunks_received"] else None,
+            "tokens": record["chunks_received"],
+            "characters_typed": record["characters_typed"],
+            "sentences_spoken": len(self.speech_backend.synthesized) - spoken_before,
+            "prompt_captured": captured == prompt,
+            "typed_correctly": self.keyboard.text == ''.join(answer),
+            "queues": record["queues"],
+        }
+
+    def run_scenario(self, scenario: dict, runs: int = 5, warmup: int = 1, prompt: str = "write a benchmark answer") -> dict:
+        """Start a mock server for the scenario, then run warmup unrecorded and runs recorded activations against it."""
+        server_options = {name: scenario.get(name, default) for name, default in SERVER_OPTIONS.items()}
+        answer = synthetic_answer(server_options["tokens"], server_options["token_chars"],
+                                  server_options["sentence_tokens"], server_options["seed"])
+        server = MockServerProcess(**server_options).start()
+        try:
+            settings = bench_settings(scenario, server.url)
+            self.configure(settings)  # A new server for every scenario, as if the settings had changed
+            for _ in range(warmup):
+                self.run_activation(prompt, settings, answer)  # The first one also opens the connection
+            results = [self.run_activation(prompt, settings, answer) for _ in range(runs)]
+        finally:
+            server.stop()
+        return {"config": dict(server_options, **scenario), "runs": results, "summary": summarize(results)}
+
+    def shutdown(self) -> None:
+        self.speech.shutdown()
+        self.stream_engine.shutdown()
+
+
+def summarize(results: list) -> dict:
+    """The median of every metric over the runs."""
+    summary = {}
+    for name in METRICS:
+        values = [result[name] for result in results if result.get(name) is not None]
+        if values:
+            summary[name] = round(percentile(values, 0.5), 2)
+    summary["all_correct"] = all(result["typed_correctly"] and result["prompt_captured"] for result in results)
+    return summary
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BRAIN_FOLDER, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_commit": git_commit(), "platform": platform.platform(),
+            "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.15) -> list:
+    """The regressions of current against baseline: (scenario, metric, baseline value, current value, change).
+
+    \n\nA metric regresses when it got worse by more than tolerance (relative) and by more than its noise floor."""
+    regressions = []
+    for scenario, results in current["scenarios"].items():
+        if scenario not in baseline.get("scenarios", {}):
+            continue
+        before, after = baseline["scenarios"][scenario]["summary"], results["summary"]
+        if before.get("all_correct") and not after.get("all_correct"):
+            regressions.append((scenario, "all_correct", True, False, None))
+        for name, (higher_is_better, noise_floor) in METRICS.items():
+            if before.get(name) is None or after.get(name) is None:
+                continue
+            worse_by = before[name] - after[name] if higher_is_better else after[name] - before[name]
+            if worse_by > noise_floor and worse_by > tolerance * abs(before[name]):
+                change = worse_by / abs(before[name]) if before[name] else None
+                regressions.append((scenario, name, before[name], after[name], change))
+    return regressions
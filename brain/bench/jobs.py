@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from stream_engine import StreamEngine
+from providers import ProviderRegistry
+from response_cache import chunk_text
+from output_pipeline import OutputPipeline
+from output_sinks import TypingSink
+from timeline import TimelineRecorder, CAPTURE_END, REQUEST_SENT, FIRST_CHUNK, FIRST_KEYSTROKE
+from jobs import JobScheduler, Job
+from metrics import percentile
+
+from bench.fakes import FakeKeyboard
+from bench.harness import BRAIN_FOLDER, BENCH_MODEL, environment, bench_settings
+from bench.mock_server import MockServerProcess, synthetic_answer
+
+# Answers that take a few seconds to type, like a long answer at an ordinary typing speed
+SERVER = {"ttft_ms": 250, "gap_ms": 10, "token_chars": 4, "tokens": 40, "sentence_tokens": 12, "seed": 0,
+          "typing_speed_wpm": 1200}
+
+
+def run_session(engine, provider, settings: dict, activations: int, capture_ms: float, scheduled: bool) -> dict:
+    """activations back-to-back prompts, each typed by the user for capture_ms. Without the scheduler, the next prompt
+    can only be captured once the previous answer has been typed (the old serial loop)."""
+    keyboard = FakeKeyboard()
+    timelines = TimelineRecorder()
+    pipeline = OutputPipeline()
+    pipeline.register(TypingSink(keyboard.write, timelines))
+    scheduler = JobScheduler(queue_depth=activations, policy="queue")
+    records, blocked = [], 0.0
+
+    def submit(n):
+        timeline = timelines.current
+        timeline.mark(CAPTURE_END)
+
+        def request():
+            timeline.mark(REQUEST_SENT)
+            return engine.stream(provider.client.chat.completions.create, model=BENCH_MODEL, stream=True,
+                                 messages=[{"role": "user", "content": f"prompt {n}"}], max_tokens=SERVER["tokens"])
+
+        def output(response, cancel_token):
+            session = pipeline.open(settings, cancel_token, timeline)
+            for chunk in response:
+                token = chunk_text(chunk)
+                if token:
+                    timeline.chunk()
+                    session.publish(token)
+            timeline.queues = session.end()
+
+        def finish(job):
+            records.append(timelines.finish(timeline))
+
+        scheduler.submit(Job(f"prompt-{n}", pipeline.enabled(settings), request, output, finish))
+
+    started = time.perf_counter()
+    for n in range(activations):
+        timelines.begin("prompt")
+        time.sleep(capture_ms / 1000)  # The user types the prompt
+        submit(n)
+        if not scheduled:
+            waited = time.perf_counter()
+            while scheduler.busy:
+                time.sleep(0.001)
+            blocked += time.perf_counter() - waited
+    while scheduler.busy:
+        time.sleep(0.001)
+    total = time.perf_counter() - started
+
+    def since_capture_end(milestone):
+        return [record["milestones_ms"][milestone] - record["milestones_ms"][CAPTURE_END] for record in records
+                if milestone in record["milestones_ms"]]
+
+    answer = ''.join(synthetic_answer(SERVER["tokens"], SERVER["token_chars"], SERVER["sentence_tokens"], SERVER["seed"]))
+    return {
+        "total_s": round(total, 2),
+        "activations_per_minute": round(activations / total * 60, 1),
+        "user_blocked_s": round(blocked, 2),
+        "first_chunk_ms_p50": round(percentile(since_capture_end(FIRST_CHUNK), 0.5)),
+        "first_keystroke_ms_p50": round(percentile(since_capture_end(FIRST_KEYSTROKE), 0.5)),
+        "first_keystroke_ms_max": round(max(since_capture_end(FIRST_KEYSTROKE))),
+        "typed_in_order": keyboard.text == answer * activations,
+        "scheduler": scheduler.stats(),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.jobs",
+                                     description="Throughput of back-to-back activations, serial vs. with the job scheduler.")
+    parser.add_argument("--activations", type=int, default=5)
+    parser.add_argument("--capture-ms", type=float, default=500, help="How long the user takes to type each prompt")
+    parser.add_argument("--out", help="Where to save the results (default: bench/results/jobs-<time>.json)")
+    args = parser.parse_args()
+
+    server_options = {name: value for name, value in SERVER.items() if name != "typing_speed_wpm"}
+    server = MockServerProcess(**server_options).start()
+    engine = StreamEngine()
+    providers = ProviderRegistry(lambda: "", engine)
+    try:
+        settings = dict(bench_settings(SERVER, server.url), play_tts=False)
+        provider = providers.warm_up(settings)
+        run_session(engine, provider, settings, 1, 0, False)  # The first request is slower
+        results = {**environment(), "server": SERVER, "activations": args.activations, "capture_ms": args.capture_ms,
+                   "sessions": {}}
+        for name, scheduled in (("serial", False), ("scheduled", True)):
+            session = run_session(engine, provider, settings, args.activations, args.capture_ms, scheduled)
+            results["sessions"][name] = session
+            print(f"{name:>9}: {session['total_s']} s, {session['activations_per_minute']} activations/min, "
+                  f"user blocked {session['user_blocked_s']} s, first chunk p50 {session['first_chunk_ms_p50']} ms, "
+                  f"first keystroke p50 {session['first_keystroke_ms_p50']} ms (max {session['first_keystroke_ms_max']}), "
+                  f"typed in order: {session['typed_in_order']}")
+    finally:
+        server.stop()
+        engine.shutdown()
+
+    out = args.out or os.path.join(BRAIN_FOLDER, "bench", "results", time.strftime("jobs-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results saved to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
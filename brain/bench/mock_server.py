@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def synthetic_answer(tokens: int = 120, token_chars: int = 4, sentence_tokens: int = 12, seed: int = 0) -> list:
+    """The tokens of the mock answer: " word" pieces of token_chars characters, ending a sentence every sentence_tokens.
+
+    \n\nDeterministic for a given seed, so the harness can check that exactly this text was typed."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    answer = []
+    for n in range(tokens):
+        word = ''.join(rng.choice(letters) for _ in range(max(1, token_chars - 1)))
+        if (n + 1) % sentence_tokens == 0 or n == tokens - 1:
+            word = word[:-1] + "." if len(word) > 1 else "."
+        answer.append(" " + word)
+    return answer
+
+
+def format_reset(seconds: float) -> str:
+    """A duration the way OpenAI's x-ratelimit-reset-* headers write it: "20ms", "1.5s", "6m0s"."""
+    if seconds < 1:
+        return f"{round(seconds * 1000)}ms"
+    minutes, seconds = divmod(round(seconds, 3), 60)
+    return f"{int(minutes)}m{seconds:g}s" if minutes else f"{seconds:g}s"
+
+
+class MockOpenAIServer:
+    """An OpenAI-compatible chat completions endpoint that streams the synthetic answer over SSE.
+
+    \n\nThe first token is sent ttft_ms after the request (plus prefill_us_per_char for every character of the request's
+    messages, like a model reading a longer prompt), then one token every gap_ms (plus up to jitter_ms of random
+    delay).
+
+    \n\nscript injects failures, one comma-separated step per request (the requests after the last step are answered
+    normally): "ok", an HTTP status such as "429" or "503", "delay:MS" (a slower first token), "stall:N" (N tokens, then
+    nothing) or "disconnect:N" (N tokens, then the connection is dropped). Tokens are scheduled against absolute deadlines, so the server's own overhead doesn't stretch the stream.
+
+    \n\nrpm and tpm (0: no limit) rate-limit each model like the OpenAI API: a request costs its prompt (4 characters per
+    token) plus its max_tokens, every response carries the x-ratelimit-* headers, and a request over the limit gets a
+    429 with Retry-After."""
+
+    def __init__(self, ttft_ms: float = 250, gap_ms: float = 20, token_chars: int = 4, tokens: int = 120,
+                 sentence_tokens: int = 12, jitter_ms: float = 0, seed: int = 0, prefill_us_per_char: float = 0,
+                 script: str = "", rpm: int = 0, tpm: int = 0, port: int = 0):
+        self.ttft_ms = ttft_ms
+        self.prefill_us_per_char = prefill_us_per_char
+        self.gap_ms = gap_ms
+        self.jitter_ms = jitter_ms
+        self.seed = seed
+        self.answer = synthetic_answer(tokens, token_chars, sentence_tokens, seed)
+        self.script = [step.strip() for step in script.split(",") if step.strip()]
+        self.requests = 0
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rate_limited = 0
+        self._buckets = {}  # model -> [requests left, tokens left, time.monotonic() of the last refill]
+        self._buckets_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1/"
+
+    def take_budget(self, model: str, tokens: int) -> tuple:
+        """Charge a request to the model's buckets if it fits. Returns (allowed, rate-limit headers)."""
+        with self._buckets_lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(model, [self.rpm, self.tpm, now])
+            elapsed, bucket[2] = now - bucket[2], now
+            bucket[0] = min(self.rpm, bucket[0] + elapsed * self.rpm / 60)
+            bucket[1] = min(self.tpm, bucket[1] + elapsed * self.tpm / 60)
+            waits = []
+            if self.rpm and bucket[0] < 1:
+                waits.append((1 - bucket[0]) * 60 / self.rpm)
+            if self.tpm and bucket[1] < tokens:
+                waits.append((tokens - bucket[1]) * 60 / self.tpm)
+            allowed = not waits
+            if allowed:
+                bucket[0] -= 1 if self.rpm else 0
+                bucket[1] -= tokens if self.tpm else 0
+            else:
+                self.rate_limited += 1
+            headers = {}
+            if self.rpm:
+                headers.update({"x-ratelimit-limit-requests": str(self.rpm),
+                                "x-ratelimit-remaining-requests": str(int(bucket[0])),
+                                "x-ratelimit-reset-requests": format_reset((self.rpm - bucket[0]) * 60 / self.rpm)})
+            if self.tpm:
+                headers.update({"x-ratelimit-limit-tokens": str(self.tpm),
+                                "x-ratelimit-remaining-tokens": str(int(bucket[1])),
+                                "x-ratelimit-reset-tokens": format_reset((self.tpm - bucket[1]) * 60 / self.tpm)})
+            if not allowed:
+                headers["retry-after-ms"] = str(round(max(waits) * 1000))
+                headers["retry-after"] = str(math.ceil(max(waits)))
+            return allowed, headers
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Each token leaves at once
+
+            def do_POST(self):
+                started = time.perf_counter()
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                mock.requests += 1
+                rng = random.Random(mock.seed + mock.requests)
+                prompt_chars = sum(len(message.get("content") or "") for message in body.get("messages", []))
+                prefill_ms = prompt_chars * mock.prefill_us_per_char / 1000
+                step = mock.script[mock.requests - 1] if mock.requests <= len(mock.script) else "ok"
+                action, _, argument = step.partition(":")
+                if action.isdigit():
+                    self._send_error(int(action))
+                    return
+                limit_headers = {}
+                if mock.rpm or mock.tpm:
+                    allowed, limit_headers = mock.take_budget(body.get("model", "mock"),
+                                                              -(-prompt_chars // 4) + (body.get("max_tokens") or 0))
+                    if not allowed:
+                        self._send_error(429, limit_headers, f"Rate limit reached for {body.get('model', 'mock')}")
+                        return
+                if action == "delay":
+                    prefill_ms += float(argument)
+                cut_after = int(argument) if action in ("stall", "disconnect") else None
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                for name, value in limit_headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    for n, token in enumerate(mock.answer):
+                        if n == cut_after:
+                            if action == "stall":
+                                time.sleep(3600)  # Until the client gives up and closes the connection
+                            self.close_connection = True
+                            return  # Without the terminating chunk: the client sees the connection drop
+                        deadline = started + (mock.ttft_ms + prefill_ms + n * mock.gap_ms + rng.uniform(0, mock.jitter_ms)) / 1000
+                        delay = deadline - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        event = {"id": "bench", "object": "chat.completion.chunk", "created": 0,
+                                 "model": body.get("model", "mock"),
+                                 "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except OSError:
+                    self.close_connection = True  # The client cancelled the stream
+
+            def _send_error(self, status: int, headers: dict | None = None, message: str | None = None) -> None:
+                body = json.dumps({"error": {"message": message or f"Injected {status}", "type": "mock_error",
+                                             "code": status}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "MockOpenAIServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-openai").start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MockServerProcess:
+    """Runs a MockOpenAIServer in a child process, so its CPU time isn't counted against the client being measured."""
+
+    def __init__(self, **config):
+        self.config = config
+        self.url = None
+        self._process = None
+
+    def start(self) -> "MockServerProcess":
+        arguments = [f"--{name.replace('_', '-')}={value}" for name, value in self.config.items()]
+        self._process = subprocess.Popen([sys.executable, "-m", "bench.mock_server", *arguments],
+                                         stdout=subprocess.PIPE, text=True,
+                                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.url = self._process.stdout.readline().strip()  # The server prints its URL once it's listening
+        if not self.url:
+            raise RuntimeError("The mock server did not start")
+        return self
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A mock OpenAI-compatible server that streams a synthetic answer.")
+    parser.add_argument("--ttft-ms", type=float, default=250)
+    parser.add_argument("--gap-ms", type=float, default=20)
+    parser.add_argument("--token-chars", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--sentence-tokens", type=int, default=12)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefill-us-per-char", type=float, default=0)
+    parser.add_argument("--script", default="", help="Failures to inject, one step per request: 429,503,delay:2000,stall:5,disconnect:5,ok")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute per model (0: no limit)")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute per model (0: no limit)")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(**vars(args)).start()
+    print(server.url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,144 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from metrics import percentile
+from bench.harness import BRAIN_FOLDER, environment
+
+# What backgroundai imports before the tray icon appears, apart from PyQt5 and the keyboard hook
+CORE_MODULES = ["settings_service", "metrics", "model_registry", "providers", "stream_engine", "capture_engine",
+                "key_dispatcher", "response_cache", "speculation", "hedging", "jobs", "rate_limits", "output_pipeline",
+                "output_sinks", "clipboard_output", "speech", "audio_cache", "timeline", "activation"]
+
+# Loaded on first use (the first warm-up, the first spoken sentence, the first menu open), never at startup
+DEFERRED_MODULES = ["openai", "httpx", "win32com", "pythoncom", "menu"]
+
+# Regression budget: the benchmark fails when a median exceeds its budget
+BUDGET = {"core_import_ms": 250, "core_rss_mb": 60, "tray_ready_ms": 1500, "idle_rss_mb": 120}
+
+# Imports the core modules in a fresh interpreter, and reports the time, memory and what else got loaded
+CORE_IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import importlib
+for name in {modules!r}:
+    importlib.import_module(name)
+import_ms = (time.perf_counter() - started) * 1000
+import sys, json
+from timeline import process_rss_bytes
+print(json.dumps({{"import_ms": import_ms, "rss_bytes": process_rss_bytes(),
+                  "deferred_loaded": [name for name in {deferred!r} if name in sys.modules]}}))
+"""
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_breakdown(stderr: str, top: int = 12) -> list:
+    """The slowest modules imported directly by the script, from python -X importtime output: (module, cumulative ms)."""
+    direct = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match and match.group(4) == "site":
+            direct = []  # Everything up to site is the interpreter's own startup
+        elif match and len(match.group(3)) == 1:  # Nested imports are indented further
+            direct.append((match.group(4), round(int(match.group(2)) / 1000, 1)))
+    return sorted(direct, key=lambda entry: entry[1], reverse=True)[:top]
+
+
+def measure_core(runs: int) -> dict:
+    """Import the core modules in runs fresh interpreters."""
+    script = CORE_IMPORT_SCRIPT.format(modules=CORE_MODULES, deferred=DEFERRED_MODULES)
+    results, breakdown = [], None
+    for _ in range(runs):
+        child = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=BRAIN_FOLDER,
+                               capture_output=True, text=True, check=True)
+        results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+        breakdown = import_breakdown(child.stderr)
+    rss = [result["rss_bytes"] for result in results if result["rss_bytes"] is not None]
+    return {
+        "core_import_ms": round(percentile([result["import_ms"] for result in results], 0.5), 1),
+        "core_rss_mb": round(percentile(rss, 0.5) / 1024 / 1024, 1) if rss else None,
+        "deferred_loaded": sorted({name for result in results for name in result["deferred_loaded"]}),
+        "import_breakdown_ms": breakdown,
+    }
+
+
+def measure_app(runs: int, timeout: float = 30) -> dict:
+    """Start the whole app with --startup-benchmark, which reports its time to tray-ready and idle RSS, then quits.
+
+    \n\nNeeds the app's dependencies (PyQt5, keyboard) and a desktop session; otherwise the error is reported instead."""
+    results = []
+    for _ in range(runs):
+        try:
+            child = subprocess.run([sys.executable, "backgroundai.py", "--startup-benchmark"], cwd=BRAIN_FOLDER,
+                                   capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"error": f"no report within {timeout} s"}
+        reports = [line for line in child.stdout.splitlines() if line.startswith("{")]
+        if not reports:
+            error = (child.stderr.strip().splitlines() or [f"exit code {child.returncode}"])[-1]
+            return {"error": error}
+        results.append(json.loads(reports[-1]))
+    rss = [result["idle_rss_mb"] for result in results if result["idle_rss_mb"] is not None]
+    return {
+        "tray_ready_ms": round(percentile([result["tray_ready_ms"] for result in results], 0.5), 1),
+        "idle_rss_mb": percentile(rss, 0.5) if rss else None,
+    }
+
+
+def over_budget(results: dict, budget: dict) -> list:
+    """(metric, value, budget) for every metric above its budget, plus the deferred modules loaded at startup."""
+    failures = [(name, results[name], limit) for name, limit in budget.items()
+                if results.get(name) is not None and results[name] > limit]
+    failures += [(f"{name} loaded at startup", True, False) for name in results["deferred_loaded"]]
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.startup",
+                                     description="Cold start: import time breakdown, time to tray-ready and idle RSS.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", help="Where to save the results (default: bench/results/startup-<time>.json)")
+    parser.add_argument("--budget", action="append", default=[], metavar="METRIC=VALUE",
+                        help=f"Override a budget ({', '.join(f'{name}={value}' for name, value in BUDGET.items())})")
+    parser.add_argument("--skip-app", action="store_true", help="Only measure the core imports")
+    args = parser.parse_args()
+
+    budget = dict(BUDGET)
+    for override in args.budget:
+        name, _, value = override.partition("=")
+        if name not in BUDGET:
+            parser.error(f"unknown budget: {name}")
+        budget[name] = float(value)
+
+    results = {**environment(), "budget": budget, **measure_core(args.runs)}
+    print(f"core imports: {results['core_import_ms']} ms, {results['core_rss_mb']} MB RSS")
+    for module, milliseconds in results["import_breakdown_ms"]:
+        print(f"  {module:<24} {milliseconds:>7} ms")
+    print(f"deferred modules loaded at startup: {results['deferred_loaded'] or 'none'}")
+    if not args.skip_app:
+        results["app"] = measure_app(args.runs)
+        if "error" in results["app"]:
+            print(f"app: not measured ({results['app']['error']})")
+        else:
+            results.update(results["app"])
+            print(f"app: tray ready in {results['tray_ready_ms']} ms, idle RSS {results['idle_rss_mb']} MB")
+
+    out = args.out or os.path.join(BRAIN_FOLDER, "bench", "results", time.strftime("startup-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results saved to {out}")
+
+    failures = over_budget(results, budget)
+    for name, value, limit in failures:
+        print(f"  OVER BUDGET {name}: {value} (budget {limit})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import time
+import threading
+from collections import deque, namedtuple
+
+# A keyboard event as stored in the ring buffer. timestamp is time.perf_counter_ns() when the hook saw the event.
+KeyEvent = namedtuple("KeyEvent", ["timestamp", "event_type", "name"])
+
+KEY_DOWN = "down"
+HOTKEY = "hotkey"  # event_type of the events pushed by push_hotkey(), whose name is the hotkey's action
+
+
+class CaptureBuffer:
+    """Rebuilds the prompt text from key names, the same way capture_input always has."""
+
+    def __init__(self):
+        self.characters = []
+
+    def apply(self, key: str) -> bool:
+        """Apply one key-down to the text. Returns False for keys that don't change it (modifiers, F-keys, ...)."""
+        if key == 'backspace':
+            if self.characters:
+                self.characters.pop()  # Remove last character on backspace
+        elif key == 'space':
+            self.characters.append(' ')  # Append space
+        elif key == 'enter':
+            self.characters.append('\n')  # Append newline on enter
+        elif len(key) == 1:  # Only add single character keys
+            self.characters.append(key)
+        else:
+            return False
+        return True
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.characters)
+
+
+class CaptureEngine:
+    """Receives every keyboard event from one hook callback and buffers it for the background task.
+
+    \n\nThe hook thread only appends to a deque and sets an Event. deque.append/popleft are atomic in CPython, so the
+    ring needs no lock and the hook never waits on the consumer. next_event() returns as soon as the engine is
+    paused or cancelled, instead of waiting for the next key press like keyboard.read_event() did."""
+
+    def __init__(self, running_event: threading.Event | None = None, capacity: int = 4096, clock=time.perf_counter_ns):
+        self.running = running_event if running_event is not None else threading.Event()  # Set while not paused
+        self.clock = clock
+        self._ring = deque(maxlen=capacity)
+        self._signal = threading.Event()
+        self._cancelled = False
+
+        # Instrumentation
+        self.events_received = 0
+        self.events_dropped = 0   # Lost because the ring was full
+        self.hook_ns = 0          # Total time spent inside on_event()
+
+    def on_event(self, event) -> None:
+        """The keyboard hook callback. Also used by inject() to feed synthetic events."""
+        started = self.clock()
+        if getattr(event, 'hotkey', None):
+            pass  # This key press completed a hotkey, which arrives through push_hotkey() instead
+        elif getattr(event, 'injected', False):
+            pass  # KeyGenie sent this key itself (e.g. the paste sink's ctrl+v), it isn't part of the prompt
+        elif self.running.is_set():
+            if len(self._ring) == self._ring.maxlen:
+                self.events_dropped += 1
+            self._ring.append(KeyEvent(started, event.event_type, event.name))
+            self.events_received += 1
+            self._signal.set()
+        self.hook_ns += self.clock() - started
+
+    def push_hotkey(self, action: str) -> None:
+        """Buffer a matched hotkey (e.g. the prompt keybind), in order with the key events around it."""
+        self.on_event(KeyEvent(None, HOTKEY, action))
+
+    def inject(self, name: str, event_type: str = KEY_DOWN) -> None:
+        """Feed a synthetic event, exactly as if the hook had seen it (for tests and benchmarks)."""
+        self.on_event(KeyEvent(None, event_type, name))
+
+    def next_event(self, timeout: float | None = None) -> KeyEvent | None:
+        """Return the oldest buffered event. Returns None on timeout, or straight away when paused or cancelled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._cancelled or not self.running.is_set():
+                return None
+            try:
+                return self._ring.popleft()
+            except IndexError:
+                pass
+            self._signal.clear()
+            if self._ring:
+                continue  # An event arrived between popleft() and clear()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self._signal.wait(remaining)
+
+    def clear(self) -> None:
+        """Forget buffered events (e.g. the keys KeyGenie typed itself while outputting an answer)."""
+        self._ring.clear()
+
+    def pause(self) -> None:
+        """Stop buffering events and wake up any waiting consumer immediately."""
+        self.running.clear()
+        self._ring.clear()
+        self._signal.set()
+
+    def resume(self) -> None:
+        self._cancelled = False
+        self.running.set()
+        self._signal.set()
+
+    def cancel(self) -> None:
+        """Make the current next_event() call return None right away (until resume())."""
+        self._cancelled = True
+        self._signal.set()
+
+    def stats(self) -> dict:
+        return {
+            "events_received": self.events_received,
+            "events_dropped": self.events_dropped,
+            "hook_ns_per_event": round(self.hook_ns / self.events_received) if self.events_received else 0,
+        }
+
+
+if __name__ == "__main__":
+    # Synthetic burst test: a producer thread injects keys far faster than anyone types, the consumer rebuilds the text.
+    import random
+    import string
+
+    engine = CaptureEngine()
+    engine.resume()
+    random.seed(1)
+    keys = [random.choice(string.ascii_lowercase + "     ") for _ in range(20_000)]
+    keys = ['space' if key == ' ' else key for key in keys]
+    keys[100:110] = ['backspace'] * 10
+    expected = CaptureBuffer()
+    for key in keys:
+        expected.apply(key)
+
+    def producer(rate_per_second=2000):
+        interval = 1 / rate_per_second
+        next_time = time.perf_counter()
+        for key in keys:
+            engine.inject(key)
+            engine.inject(key, "up")
+            next_time += interval
+            while time.perf_counter() < next_time:
+                pass
+        engine.inject("right shift")
+
+    threading.Thread(target=producer, daemon=True).start()
+    captured = CaptureBuffer()
+    consumer_ns = 0
+    while True:
+        event = engine.next_event()
+        started = time.perf_counter_ns()
+        if event.event_type == KEY_DOWN:
+            if event.name == "right shift":
+                break
+            captured.apply(event.name)
+        consumer_ns += time.perf_counter_ns() - started
+
+    print(f"text rebuilt correctly: {captured.text == expected.text} ({len(captured.text)} chars)")
+    print(f"stats: {engine.stats()}, consumer ns/event: {consumer_ns // engine.events_received}")
@@ -0,0 +1,185 @@
+import time
+from contextlib import nullcontext
+
+from output_pipeline import OutputSink
+
+
+class ClipboardBackend:
+    """Reads and writes the system clipboard as text."""
+
+    def get_text(self) -> str | None:
+        raise NotImplementedError
+
+    def set_text(self, text: str) -> None:
+        raise NotImplementedError
+
+
+class Win32ClipboardBackend(ClipboardBackend):
+    """The Windows clipboard, through pywin32 (imported on first use)."""
+
+    def get_text(self) -> str | None:
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            if win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_UNICODETEXT):
+                return win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
+            return None  # Images, files, ... can't be saved as text, so they aren't restored
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def set_text(self, text: str) -> None:
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardData(win32clipboard.CF_UNICODETEXT, text)
+        finally:
+            win32clipboard.CloseClipboard()
+
+
+class InMemoryClipboard(ClipboardBackend):
+    """A stand-in clipboard for tests and benchmarks. paste() appends the clipboard to .document, like ctrl+v would."""
+
+    def __init__(self, text: str | None = None):
+        self.text = text
+        self.document = []
+
+    def get_text(self) -> str | None:
+        return self.text
+
+    def set_text(self, text: str) -> None:
+        self.text = text
+
+    def paste(self) -> None:
+        self.document.append(self.text)
+
+
+class ChunkedPaster:
+    """Inserts text in large chunks by pasting it, restoring the user's clipboard after every chunk.
+
+    \n\nText is buffered until chunk_chars characters are waiting or the oldest waiting text is flush_ms old."""
+
+    def __init__(self, clipboard: ClipboardBackend, paste, chunk_chars: int = 400, flush_ms: int = 150,
+                 settle_ms: int = 40, clock=time.monotonic, sleep=time.sleep):
+        self.clipboard = clipboard
+        self.paste = paste  # e.g. lambda: keyboard.send('ctrl+v')
+        self.chunk_chars = chunk_chars
+        self.flush_seconds = flush_ms / 1000
+        self.settle_seconds = settle_ms / 1000  # Time for the target window to read the clipboard before it's restored
+        self.clock = clock
+        self.sleep = sleep
+        self._pending = []
+        self._pending_chars = 0
+        self._pending_since = None
+        self.chunks = 0
+        self.chars = 0
+
+    def feed(self, text: str) -> None:
+        if not self._pending:
+            self._pending_since = self.clock()
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.chunk_chars:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        if self._pending and self.clock() - self._pending_since >= self.flush_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        text = ''.join(self._pending)
+        self._pending, self._pending_chars, self._pending_since = [], 0, None
+        saved = self.clipboard.get_text()
+        try:
+            self.clipboard.set_text(text)
+            self.paste()
+            self.sleep(self.settle_seconds)
+        finally:
+            # Even if the paste failed, the user's clipboard doesn't keep the answer's chunk
+            if saved is not None:
+                self.clipboard.set_text(saved)
+        self.chunks += 1
+        self.chars += len(text)
+
+    def discard(self) -> None:
+        self._pending, self._pending_chars, self._pending_since = [], 0, None
+
+
+class PasteSink(OutputSink):
+    """Inserts the answer by pasting it in chunks, when auto_type is on and output_mode is "paste".
+
+    \n\nmark, if given, is a context manager set around every paste (e.g. the key dispatcher's injecting mark), so the
+    keys of the paste shortcut aren't taken for the user's and don't stop the answer they're pasting."""
+
+    name = "paste"
+
+    def __init__(self, clipboard: ClipboardBackend, paste, mark=None, **kwargs):
+        super().__init__(**kwargs)
+        self.clipboard = clipboard
+        self.paste = paste
+        self.mark = mark
+
+    def enabled(self, settings) -> bool:
+        return settings.get('auto_type', True) and settings.get('output_mode', "type") == "paste"
+
+    def begin(self, settings) -> None:
+        self.paster = ChunkedPaster(self.clipboard, self.pasted,
+                                    chunk_chars=settings.get('paste_chunk_chars', 400),
+                                    flush_ms=settings.get('paste_flush_ms', 150))
+        self.wake_interval = self.paster.flush_seconds  # Flush on time even if no new token arrives
+
+    def pasted(self) -> None:
+        with self.mark if self.mark is not None else nullcontext():
+            self.paste()
+        if self.timeline is not None:
+            self.timeline.keystrokes(0)  # Marks the first/last keystroke (the paster's own stats count the characters)
+
+    def consume(self, token: str) -> None:
+        self.paster.feed(token)
+
+    def tick(self) -> None:
+        self.paster.flush_if_due()
+
+    def end(self, cancelled: bool) -> None:
+        if cancelled:
+            self.paster.discard()
+        else:
+            self.paster.flush()
+        self.wake_interval = None
+        print(f"Pasted {self.paster.chars} characters in {self.paster.chunks} chunks")
+
+
+if __name__ == "__main__":
+    # Time to insert a 2,000-token answer: chunked paste (real time, in-memory clipboard) vs. the typing path at 200 WPM.
+    import random
+    from output_pipeline import OutputPipeline, CancelToken
+    from pacing import PacingEngine
+
+    random.seed(0)
+    tokens = [random.choice(["the ", "quick ", "brown ", "fox ", "jumps ", "over ", "lazy ", "dogs. "]) for _ in range(2000)]
+    answer = ''.join(tokens)
+
+    clipboard = InMemoryClipboard("what the user had copied")
+    pipeline = OutputPipeline()
+    pipeline.register(PasteSink(clipboard, clipboard.paste))
+    settings = {"auto_type": True, "output_mode": "paste"}
+    started = time.perf_counter()
+    session = pipeline.open(settings, CancelToken())
+    for token in tokens:
+        session.publish(token)
+    session.end()
+    paste_seconds = time.perf_counter() - started
+    assert ''.join(clipboard.document) == answer and clipboard.text == "what the user had copied"
+
+    simulated = {"now": 0.0}
+    typing = PacingEngine(200, lambda text: None, clock=lambda: simulated["now"],
+                          sleep=lambda seconds: simulated.__setitem__("now", simulated["now"] + seconds))
+    for token in tokens:
+        typing.type(token)
+
+    print(f"{len(answer)} characters: paste {paste_seconds:.2f} s, typing at 200 WPM {simulated['now']:.0f} s "
+          f"(clipboard restored: {clipboard.text == 'what the user had copied'})")
@@ -0,0 +1,223 @@
+import re
+import time
+import threading
+from collections import deque
+
+from profiles import DEFAULT_PROFILE
+
+# Words and punctuation marks, the pieces the token estimate counts
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Tokens the chat format adds around every message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def estimate_tokens(text: str) -> int:
+    """A local estimate of the tokens in text, without a tokenizer: one per punctuation mark, one per word of up to four
+    characters and one more for every four after that, which is roughly how BPE tokenizers split English."""
+    return sum(1 + (len(piece) - 1) // 4 for piece in TOKEN_PATTERN.findall(text))
+
+
+class Message:
+    """A chat message with its token estimate and request payload, both computed once when it's created."""
+    __slots__ = ("tokens", "payload")
+
+    def __init__(self, role: str, content: str):
+        self.tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        self.payload = {"role": role, "content": content}
+
+
+class Conversation:
+    """The rolling message history of one profile's session.
+
+    \n\nmessages() fits the newest turns that fit into token_budget in front of the prompt, using the cached estimates,
+    so building a request is a walk over the turns and never waits on anything. When record() takes the history over
+    the budget, the turns older than the last keep_turns are summarized by a background thread, and swapped for the
+    summary once it's ready; until then, messages() simply leaves out the turns that don't fit."""
+
+    def __init__(self, token_budget: int = 2000, keep_turns: int = 2, idle_seconds: float = 1800):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.idle_seconds = idle_seconds
+
+        self.turns = deque()        # (user Message, assistant Message), oldest first
+        self.summary = None         # A system Message summarizing the turns that were compacted, or None
+        self.history_tokens = 0     # Estimated tokens of all turns, kept up to date incrementally
+        self._instructions = None   # The last custom instructions' Message, reused while they don't change
+        self._lock = threading.Lock()
+        self._generation = 0        # Bumped by reset(), so a compaction of the old session is discarded
+        self._compacting = False
+        self._last_used = time.monotonic()
+
+        # Instrumentation
+        self.last_request = {}
+        self.compactions = 0
+        self.compaction_failures = 0
+        self.compaction_seconds = 0.0
+        self.turns_compacted = 0
+
+    def configure(self, token_budget: int, keep_turns: int, idle_seconds: float) -> None:
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.idle_seconds = idle_seconds
+
+    def reset(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        self.turns.clear()
+        self.summary = None
+        self.history_tokens = 0
+        self._generation += 1
+        self._compacting = False
+
+    def messages(self, custom_instructions: str, prompt: str) -> list:
+        """The messages of a request for prompt: instructions, summary, as many recent turns as fit, then the prompt."""
+        prompt_message = Message("user", prompt)
+        with self._lock:
+            if self.turns and time.monotonic() - self._last_used > self.idle_seconds:
+                self._reset()  # A new session after a long break
+            head = []
+            if custom_instructions.strip():
+                if self._instructions is None or self._instructions.payload["content"] != custom_instructions:
+                    self._instructions = Message("system", custom_instructions)
+                head.append(self._instructions)
+            if self.summary is not None:
+                head.append(self.summary)
+            budget = self.token_budget - prompt_message.tokens - sum(message.tokens for message in head)
+            history = []
+            for user, assistant in reversed(self.turns):
+                cost = user.tokens + assistant.tokens
+                if cost > budget:
+                    break  # Older turns than this one don't fit either (or are being summarized)
+                budget -= cost
+                history.append(assistant)
+                history.append(user)
+            history.reverse()
+            self.last_request = {
+                "prompt_tokens": self.token_budget - budget,
+                "history_turns": len(history) // 2,
+                "turns_left_out": len(self.turns) - len(history) // 2,
+                "summarized": self.summary is not None,
+            }
+        return [message.payload for message in head + history + [prompt_message]]
+
+    def record(self, prompt: str, answer: str, summarize=None) -> None:
+        """Add a finished turn. summarize(summary, messages) -> str, if given, is what compacts old turns (in the background)."""
+        if not answer.strip():
+            return  # Nothing was answered (an error), so there's nothing to follow up on
+        turn = (Message("user", prompt), Message("assistant", answer))
+        with self._lock:
+            self.turns.append(turn)
+            self.history_tokens += turn[0].tokens + turn[1].tokens
+            self._last_used = time.monotonic()
+            summary_tokens = self.summary.tokens if self.summary is not None else 0
+            if self.history_tokens + summary_tokens <= self.token_budget or len(self.turns) <= self.keep_turns:
+                return
+            old_turns = list(self.turns)[:len(self.turns) - self.keep_turns]
+            if summarize is None:
+                self._drop(old_turns)  # Nothing to summarize with, so the old turns are forgotten
+                return
+            if self._compacting:
+                return  # The next record() picks up whatever this compaction didn't cover
+            self._compacting = True
+            generation = self._generation
+            previous_summary = self.summary.payload["content"][len(SUMMARY_PREFIX):] if self.summary is not None else ""
+        threading.Thread(target=self._compact, args=(old_turns, previous_summary, summarize, generation),
+                         daemon=True, name="conversation-compaction").start()
+
+    def _drop(self, old_turns: list) -> None:
+        for turn in old_turns:
+            self.turns.popleft()
+            self.history_tokens -= turn[0].tokens + turn[1].tokens
+
+    def _compact(self, old_turns: list, previous_summary: str, summarize, generation: int) -> None:
+        started = time.perf_counter()
+        try:
+            summary = summarize(previous_summary, [message.payload for turn in old_turns for message in turn])
+        except Exception as e:
+            summary = None
+            print(f"Conversation summary failed: {e}")
+        with self._lock:
+            if generation != self._generation:
+                return  # The session was reset meanwhile
+            self._compacting = False
+            if not summary:
+                self.compaction_failures += 1
+                return
+            self._drop(old_turns)  # Still the oldest turns: only this thread removes turns from the front
+            self.summary = Message("system", SUMMARY_PREFIX + summary)
+            self.compactions += 1
+            self.turns_compacted += len(old_turns)
+            self.compaction_seconds += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "turns": len(self.turns),
+            "history_tokens": self.history_tokens,
+            "summary_tokens": self.summary.tokens if self.summary is not None else 0,
+            "compactions": self.compactions,
+            "compaction_failures": self.compaction_failures,
+            "turns_compacted": self.turns_compacted,
+            "compaction_ms": round(self.compaction_seconds * 1000, 1),
+            **self.last_request,
+        }
+
+
+class ConversationStore:
+    """One Conversation per profile, set up from the settings of each activation."""
+
+    def __init__(self):
+        self.sessions = {}
+
+    def get(self, settings) -> Conversation:
+        profile = settings.get('profile', DEFAULT_PROFILE)
+        conversation = self.sessions.get(profile)
+        if conversation is None:
+            conversation = self.sessions.setdefault(profile, Conversation())
+        conversation.configure(settings.get('conversation_token_budget', 2000), settings.get('conversation_keep_turns', 2),
+                               settings.get('conversation_idle_minutes', 30) * 60)
+        return conversation
+
+    def reset(self) -> None:
+        """Start a new session in every profile."""
+        for conversation in list(self.sessions.values()):
+            conversation.reset()
+
+    def stats(self) -> dict:
+        return {profile: conversation.stats() for profile, conversation in self.sessions.items()}
+
+
+if __name__ == "__main__":
+    # Benchmark: building requests as the history grows, with a slow summarizer that must never delay them.
+    import random
+
+    rng = random.Random(0)
+    words = ["the", "model", "answer", "keyboard", "summarize", "conversation", "budget", "token", "a", "fast", "reply"]
+
+    def sentence(n):
+        return " ".join(rng.choice(words) for _ in range(n)) + "."
+
+    def slow_summarize(summary, messages):
+        time.sleep(0.2)  # A summary request to the model
+        return (summary + " " + " ".join(message["content"][:40] for message in messages))[-600:]
+
+    conversation = Conversation(token_budget=1500, keep_turns=2)
+    print(f"{'turn':>4} {'prompt tokens':>13} {'turns sent':>10} {'left out':>8} {'summary':>7} {'build us':>8}")
+    for turn in range(1, 41):
+        prompt = sentence(20)
+        started = time.perf_counter()
+        messages = conversation.messages("Answer briefly.", prompt)
+        build_us = (time.perf_counter() - started) * 1e6
+        request = conversation.last_request
+        if turn % 4 == 0:
+            print(f"{turn:>4} {request['prompt_tokens']:>13} {request['history_turns']:>10} {request['turns_left_out']:>8} "
+                  f"{str(request['summarized']):>7} {build_us:>8.1f}")
+        started = time.perf_counter()
+        conversation.record(prompt, sentence(120), slow_summarize)
+        assert time.perf_counter() - started < 0.05, "record() waited for the summary"
+        time.sleep(0.05)  # The user reads the answer and types the next prompt
+    print("stats:", conversation.stats())
@@ -0,0 +1,244 @@
+import time
+import threading
+from queue import Queue, Empty
+
+from response_cache import chunk_text
+from metrics import percentile
+
+_DONE = object()  # A candidate's stream has ended
+
+
+class HedgedStream:
+    """Runs a primary request and, if it hasn't produced a token within delay seconds, a backup one.
+
+    \n\nThe first candidate to produce a token wins: its chunks are passed through and the other one is cancelled.
+    A candidate that ends without any token (e.g. an error) starts the backup straight away. With a delay of 0 both
+    requests race from the start. cancel() is thread-safe and stops both."""
+
+    def __init__(self, primary_factory, backup_factory, delay: float, on_finish=None, clock=time.perf_counter):
+        self.clock = clock
+        self.delay = delay
+        self.on_finish = on_finish  # Called with the stream once its winner has been read to the end
+        self._factories = [primary_factory, backup_factory]
+        self._responses = [None, None]
+        self._events = Queue()
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self.started_at = clock()
+        self.hedged = False   # Whether the backup request was started
+        self.winner = None    # "primary" or "backup"
+        self.ttft = None      # Seconds from the request to the winner's first token
+        self._start(0)
+
+    def _start(self, index: int) -> None:
+        with self._lock:
+            if self._cancelled or self._responses[index] is not None:
+                return
+            self._responses[index] = True  # Claimed; replaced by the response once it's created
+        if index == 1:
+            self.hedged = True
+        threading.Thread(target=self._read, args=(index,), daemon=True).start()
+
+    def _read(self, index: int) -> None:
+        try:
+            response = self._factories[index]()
+            with self._lock:
+                self._responses[index] = response
+                cancelled = self._cancelled or (self.winner is not None and self.winner != self.name(index))
+            if response is None:
+                return
+            if cancelled:
+                response.cancel()
+            for chunk in response:
+                self._events.put((index, chunk))
+        except Exception as e:
+            print(f"Hedged {self.name(index)} request failed: {e}")
+        finally:
+            self._events.put((index, _DONE))
+
+    @staticmethod
+    def name(index: int) -> str:
+        return ("primary", "backup")[index]
+
+    def _cancel(self, index: int) -> None:
+        response = self._responses[index]
+        if response is not None and response is not True and hasattr(response, 'cancel'):
+            response.cancel()
+
+    def __iter__(self):
+        buffered = ([], [])
+        finished = [False, False]
+        winner = None
+        try:
+            # Race until one candidate produces a token
+            while winner is None:
+                if self._cancelled:
+                    return  # Stopped before either candidate produced a token (the backup won't be started now)
+                timeout = None
+                if not self.hedged:
+                    timeout = max(0.0, self.started_at + self.delay - self.clock())
+                try:
+                    index, chunk = self._events.get(timeout=timeout)
+                except Empty:
+                    self._start(1)  # The primary is too slow: hedge
+                    continue
+                if chunk is _DONE:
+                    finished[index] = True
+                    if not self.hedged:
+                        self._start(1)  # The primary ended without a token: fail over right away
+                    elif all(finished) or self._cancelled:
+                        winner = index  # Neither produced a token; pass through whatever the last one sent
+                    continue
+                buffered[index].append(chunk)
+                if chunk_text(chunk):
+                    winner = index
+            with self._lock:
+                self.winner = self.name(winner)
+            self.ttft = self.clock() - self.started_at
+            self._cancel(1 - winner)  # The loser stops downloading right away
+
+            yield from buffered[winner]
+            while not finished[winner]:
+                index, chunk = self._events.get()
+                if index != winner:
+                    continue
+                if chunk is _DONE:
+                    finished[winner] = True
+                else:
+                    yield chunk
+        except GeneratorExit:
+            self.cancel()
+            raise
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+        self._cancel(0)
+        self._cancel(1)
+
+    close = cancel
+
+    @property
+    def _winning_response(self):
+        if self.winner is None:
+            return None
+        response = self._responses[0 if self.winner == "primary" else 1]
+        return None if response is True else response
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled or getattr(self._winning_response, 'cancelled', False)
+
+    @property
+    def error(self):
+        return getattr(self._winning_response, 'error', None)
+
+
+class Hedger:
+    """Starts hedged requests (hedging setting "delay" or "race") and keeps their telemetry."""
+
+    def __init__(self, history: int = 200, verbose: bool = True):
+        self.history = history
+        self.verbose = verbose
+        self.records = []  # (winner, ttft seconds, hedged) of recent hedged requests
+
+    def stream(self, primary_factory, backup_factory, mode: str = "delay", delay_ms: int = 400) -> HedgedStream:
+        delay = 0.0 if mode == "race" else delay_ms / 1000
+        return HedgedStream(primary_factory, backup_factory, delay, on_finish=self.record)
+
+    def record(self, stream: HedgedStream) -> None:
+        """Add a finished hedged request to the telemetry, and print which path won."""
+        if stream.winner is None or stream.ttft is None:
+            return
+        self.records.append((stream.winner, stream.ttft, stream.hedged))
+        del self.records[:-self.history]
+        if self.verbose:
+            print(f"Hedged request: {stream.winner} won, TTFT {stream.ttft * 1000:.0f} ms"
+                  f"{' (backup started)' if stream.hedged else ''}")
+
+    def stats(self) -> dict:
+        ttfts = [ttft for _, ttft, _ in self.records]
+        p50, p95 = percentile(ttfts, 0.5), percentile(ttfts, 0.95)
+        return {
+            "requests": len(self.records),
+            "hedged": sum(1 for _, _, hedged in self.records if hedged),
+            "backup_wins": sum(1 for winner, _, _ in self.records if winner == "backup"),
+            "ttft_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+if __name__ == "__main__":
+    # Two local mock servers: the primary is usually fast but has a slow tail, the backup is steady but slower.
+    # Compare time to first token without hedging, with a 150 ms hedge delay and in race mode.
+    import json
+    import random
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from openai import AsyncOpenAI
+    from stream_engine import StreamEngine
+
+    def mock_server(first_token_delay):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(first_token_delay())
+                try:
+                    for word in ["Hedged ", "answer."]:
+                        event = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+                                 "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                        data = f"data: {json.dumps(event)}\n\n".encode()
+                        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    done = b"data: [DONE]\n\n"
+                    self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+                except OSError:
+                    self.close_connection = True  # The hedge loser was cancelled
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    random.seed(3)
+    primary_server = mock_server(lambda: 1.0 if random.random() < 0.15 else random.uniform(0.04, 0.08))
+    backup_server = mock_server(lambda: random.uniform(0.15, 0.2))
+    engine = StreamEngine()
+    clients = [AsyncOpenAI(api_key="mock", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1/")
+               for server in (primary_server, backup_server)]
+
+    def factory(client):
+        return lambda: engine.stream(client.chat.completions.create, model="mock", stream=True, max_tokens=8,
+                                     messages=[{"role": "user", "content": "hi"}])
+
+    REQUESTS = 40
+    unhedged = []
+    for _ in range(REQUESTS):
+        started = time.perf_counter()
+        for chunk in factory(clients[0])():
+            if chunk_text(chunk):
+                unhedged.append(time.perf_counter() - started)
+                break
+    print(f"{'no hedging':>12}: TTFT p50 {percentile(unhedged, 0.5) * 1000:.0f} ms, "
+          f"p95 {percentile(unhedged, 0.95) * 1000:.0f} ms")
+
+    for mode in ("delay", "race"):
+        hedger = Hedger(verbose=False)
+        for _ in range(REQUESTS):
+            stream = hedger.stream(factory(clients[0]), factory(clients[1]), mode=mode, delay_ms=150)
+            text = ''.join(chunk_text(chunk) or "" for chunk in stream)
+            assert text == "Hedged answer.", text
+        stats = hedger.stats()
+        print(f"{mode + ' hedging':>12}: TTFT p50 {stats['ttft_p50_ms']:.0f} ms, p95 {stats['ttft_p95_ms']:.0f} ms "
+              f"(backup started {stats['hedged']}x, won {stats['backup_wins']}x)")
+    engine.shutdown()
+    primary_server.shutdown()
+    backup_server.shutdown()
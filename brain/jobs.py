@@ -0,0 +1,247 @@
+import time
+import threading
+from collections import deque
+
+from output_pipeline import CancelToken
+from metrics import percentile
+
+# Where a job is
+HELD = "held"            # Accepted, but its request waits for room in the queue ("queue" policy, queue full)
+WAITING = "waiting"      # Request sent, waiting for its output targets to be free
+OUTPUT = "output"        # Its answer is being output
+DONE, CANCELLED, REJECTED = "done", "cancelled", "rejected"
+
+# What a new job does when job_queue_depth jobs are already waiting ("replace" doesn't wait for anything)
+JOB_POLICIES = ("queue", "replace", "reject")
+
+
+class Job:
+    """One activation once its prompt has been captured: the request, then the output of the answer.
+
+    \n\nrequest() -> response sends the request; output(response, cancel_token) outputs the answer and returns once it's
+    done; finish(job), if given, runs after that (also when the job was cancelled), before the next job on the same
+    targets starts. targets are the names of what the output writes to (e.g. the enabled sinks): jobs that share one
+    are output one after the other, in the order they were submitted, so their text never interleaves."""
+
+    def __init__(self, name: str, targets, request, output, finish=None, eager: bool = True):
+        self.name = name
+        self.targets = frozenset(targets)
+        self.request = request
+        self.output = output
+        self.finish = finish
+        self.eager = eager  # Send the request when the job is accepted, rather than when its output turn comes
+        self.cancel_token = CancelToken()
+        self.state = None
+        self.submitted = time.perf_counter()
+        self.output_started = None
+        self._admitted = threading.Event()
+        self._turn = threading.Event()
+        # A cancelled job's thread stops waiting straight away
+        self.cancel_token.on_cancel(self._admitted.set)
+        self.cancel_token.on_cancel(self._turn.set)
+
+    def cancel(self) -> None:
+        self.cancel_token.cancel()
+
+
+class JobScheduler:
+    """Runs every activation as a job on its own thread, so the next prompt can be captured and its request sent while
+    earlier answers are still being typed.
+
+    \n\nEach job's output waits until its targets are free; a job never overtakes an earlier one on a shared target.
+    At most queue_depth jobs wait for each target: beyond that, policy "queue" holds the new job's request until there
+    is room, "reject" refuses the job, and "replace" (whatever the depth) cancels the unfinished jobs on its targets.
+
+    \n\non_change(), if set, is called after every change of state (e.g. to refresh the tray), and on_error(title,
+    message) when a job is rejected."""
+
+    def __init__(self, queue_depth: int = 2, policy: str = "queue"):
+        self.queue_depth = queue_depth
+        self.policy = policy
+        self.on_change = None
+        self.on_error = None
+        self._jobs = []      # Unfinished jobs, in submission order
+        self._busy = set()   # Targets being output to
+        self._lock = threading.Lock()
+
+        # Instrumentation
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.replaced = 0
+        self.max_in_flight = 0
+        self.waits = deque(maxlen=100)  # Seconds from submission to the start of the output
+
+    def configure(self, settings) -> None:
+        self.queue_depth = settings.get('job_queue_depth', 2)
+        policy = settings.get('job_policy', "queue")
+        self.policy = policy if policy in JOB_POLICIES else "queue"
+
+    def submit(self, job: Job) -> bool:
+        """Accept the job and start its thread. Returns False if it was rejected."""
+        with self._lock:
+            self.submitted += 1
+            queued = sum(1 for other in self._jobs if other.state in (WAITING, HELD) and other.targets & job.targets)
+            if self.policy == "replace":
+                for other in self._jobs:
+                    if other.targets & job.targets and not other.cancel_token.is_set():
+                        other.cancel()
+                        self.replaced += 1
+                job.state = WAITING
+            elif queued >= self.queue_depth:
+                if self.policy == "reject":
+                    job.state = REJECTED
+                    self.rejected += 1
+                else:
+                    job.state = HELD
+            else:
+                job.state = WAITING
+            if job.state != REJECTED:
+                self._jobs.append(job)
+                self.max_in_flight = max(self.max_in_flight, len(self._jobs))
+                self._dispatch()
+        if job.state == REJECTED:
+            self._notify_error(f"{queued} answers are already waiting, so the prompt was dropped.")
+            return False
+        threading.Thread(target=self._run, args=(job,), daemon=True, name=f"job-{job.name}").start()
+        self._changed()
+        return True
+
+    def _dispatch(self) -> None:
+        """Admit held jobs while there's room, and give every waiting job whose targets are free its output turn."""
+        blocked = set(self._busy)
+        waiting = {}  # Target -> jobs waiting for it
+        for job in self._jobs:
+            if job.state == HELD and all(waiting.get(target, 0) < self.queue_depth for target in job.targets):
+                job.state = WAITING
+            if job.state == WAITING:
+                job._admitted.set()
+                if job.targets.isdisjoint(blocked):
+                    job.state = OUTPUT
+                    self._busy |= job.targets
+                    job._turn.set()
+                else:
+                    for target in job.targets:
+                        waiting[target] = waiting.get(target, 0) + 1
+            blocked |= job.targets  # Later jobs don't overtake this one on its targets
+
+    def _run(self, job: Job) -> None:
+        response = None
+        try:
+            job._admitted.wait()
+            if job.eager and not job.cancel_token.is_set():
+                response = self._request(job)
+            job._turn.wait()
+            if not job.cancel_token.is_set():
+                job.output_started = time.perf_counter()
+                self.waits.append(job.output_started - job.submitted)
+                self._changed()
+                if not job.eager:
+                    response = self._request(job)
+                job.output(response, job.cancel_token)
+        except Exception as e:
+            print(f"Job {job.name} failed: {e}")
+        finally:
+            if job.finish is not None:
+                try:
+                    job.finish(job)
+                except Exception as e:
+                    print(f"Job {job.name} failed to finish: {e}")
+            with self._lock:
+                if job.state == OUTPUT:
+                    self._busy -= job.targets
+                if job.cancel_token.is_set():
+                    job.state = CANCELLED
+                    self.cancelled += 1
+                else:
+                    job.state = DONE
+                    self.completed += 1
+                self._jobs.remove(job)
+                self._dispatch()
+            self._changed()
+
+    def _request(self, job: Job):
+        response = job.request()
+        if hasattr(response, 'cancel'):
+            job.cancel_token.on_cancel(response.cancel)  # Abort the HTTP stream too, even before the output started
+        return response
+
+    def cancel_all(self) -> int:
+        """Stop the answer being output and drop the waiting ones. Returns how many jobs were cancelled."""
+        with self._lock:
+            jobs = [job for job in self._jobs if not job.cancel_token.is_set()]
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._jobs)
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"Job callback failed: {e}")
+
+    def _notify_error(self, message: str) -> None:
+        print(message)
+        if self.on_error is not None:
+            try:
+                self.on_error("KeyGenie is busy", message)
+            except Exception as e:
+                print(f"Could not show the error: {e}")
+
+    def status(self) -> dict:
+        """How many jobs are in each unfinished state."""
+        with self._lock:
+            states = [job.state for job in self._jobs]
+        return {state: states.count(state) for state in (OUTPUT, WAITING, HELD) if state in states}
+
+    def status_text(self) -> str:
+        status = self.status()
+        if not status:
+            return "Idle"
+        return ", ".join(f"{count} {'answering' if state == OUTPUT else state}" for state, count in status.items())
+
+    def stats(self) -> dict:
+        waits = [wait * 1000 for wait in self.waits]
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "replaced": self.replaced,
+            "max_in_flight": self.max_in_flight,
+            "wait_ms_p50": round(percentile(waits, 0.5)) if waits else None,
+            "wait_ms_p95": round(percentile(waits, 0.95)) if waits else None,
+            **self.status(),
+        }
+
+
+if __name__ == "__main__":
+    # Five jobs on one target and one on another: the first five are output in order, the other runs alongside them.
+    log = []
+
+    def make_job(name, targets, chars):
+        def output(response, cancel_token):
+            for char in response:
+                if cancel_token.wait(0.01):
+                    break
+                log.append((name, char))
+        return Job(name, targets, lambda: chars, output)
+
+    scheduler = JobScheduler(queue_depth=3, policy="queue")
+    started = time.perf_counter()
+    for i in range(5):
+        scheduler.submit(make_job(f"typing{i}", ["typing"], "abcde"))
+    scheduler.submit(make_job("speech", ["tts"], "xyz"))
+    print("status:", scheduler.status_text())
+    while scheduler.busy:
+        time.sleep(0.01)
+    typed = [name for name, _ in log if name.startswith("typing")]
+    print(f"done in {(time.perf_counter() - started) * 1000:.0f} ms, typing output in order without interleaving: "
+          f"{typed == sorted(typed)}, speech overlapped: {log.index(('speech', 'z')) < len(log) - 1}")
+    print("stats:", scheduler.stats())
@@ -0,0 +1,273 @@
+import time
+import itertools
+import threading
+from collections import namedtuple
+
+# What subscribers receive for every key event. hotkey is the name of the hotkey this key press completed, or None;
+# injected is True for the keys KeyGenie sent itself (see KeyDispatcher.injecting).
+KeyboardInput = namedtuple("KeyboardInput", ["event_type", "name", "hotkey", "injected"])
+
+# A key event fed through inject(), with the fields of the keyboard library's events that the dispatcher reads
+SyntheticKey = namedtuple("SyntheticKey", ["event_type", "name", "scan_code"])
+
+KEY_DOWN, KEY_UP = "down", "up"
+
+# Keys that are held for a chord: a chord is the modifiers held down plus the key just pressed
+MODIFIER_KEYS = {"shift", "left shift", "right shift", "ctrl", "left ctrl", "right ctrl", "alt", "left alt", "right alt",
+                 "alt gr", "windows", "left windows", "right windows"}
+
+
+def parse_binding(binding: str) -> tuple:
+    """Parse a keybind in the keyboard library's format into a tuple of chords.
+
+    \n\n"right shift" -> (frozenset({'right shift'}),), "ctrl+shift+k" -> one chord of three keys,
+    "ctrl+k, ctrl+j" -> a sequence of two chords."""
+    steps = []
+    for step in binding.split(','):
+        keys = frozenset(key.strip().lower() for key in step.split('+') if key.strip())
+        if keys:
+            steps.append(keys)
+    return tuple(steps)
+
+
+class InjectionMark:
+    """Set while KeyGenie sends key events of its own (e.g. the paste sink's ctrl+v), so they aren't taken for the
+    user's. Used as a context manager around the send; nested and concurrent uses are counted.
+
+    \n\nThe hook delivers events from its own thread, possibly after the send has returned, so the mark stays set for
+    grace_ms after the last send ends."""
+
+    def __init__(self, grace_ms: int = 100, clock=time.monotonic):
+        self.grace_seconds = grace_ms / 1000
+        self.clock = clock
+        self._depth = 0
+        self._until = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        with self._lock:
+            self._depth -= 1
+            self._until = self.clock() + self.grace_seconds
+
+    def is_set(self) -> bool:
+        return self._depth > 0 or self.clock() < self._until
+
+
+class _TrieNode:
+    __slots__ = ("children", "hotkeys")
+
+    def __init__(self):
+        self.children = {}  # chord (frozenset of key names) -> _TrieNode
+        self.hotkeys = {}   # hotkey id -> (name, callback), for bindings that end at this node
+
+
+class KeyDispatcher:
+    """Owns the one global keyboard hook and routes every event to subscribed handlers and hotkeys.
+
+    \n\nComponents subscribe and unsubscribe instead of calling keyboard.hook()/unhook_all() themselves, so they can't
+    remove each other's hooks and nothing is installed or torn down per request. Hotkeys (single keys, chords and
+    sequences) are compiled into a trie of chords, so matching a key press is one dict lookup."""
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self._ids = itertools.count(1)
+        self._handlers = {}        # id -> callback(KeyboardInput)
+        self._hotkey_paths = {}    # hotkey id -> tuple of chords, to find it again on removal
+        self._root = _TrieNode()
+        self._node = self._root    # Progress through a multi-step sequence
+        self._pressed = {}         # scan code (or name, for synthetic events) -> name of each key held down
+        self._lock = threading.Lock()
+        self._hook = None
+        self.injecting = InjectionMark()  # Set around the keys KeyGenie sends itself
+
+        # Instrumentation
+        self.injected = 0
+        self.events = 0
+        self.dispatch_ns = 0
+
+    def install(self) -> None:
+        """Install the global hook. Only ever called once, at startup."""
+        if self._hook is None:
+            import keyboard
+            self._hook = keyboard.hook(self.on_event)
+
+    def subscribe(self, callback) -> int:
+        """Deliver every key event to callback(KeyboardInput). O(1). Returns an id for unsubscribe()."""
+        handler_id = next(self._ids)
+        self._handlers[handler_id] = callback
+        return handler_id
+
+    def unsubscribe(self, handler_id: int) -> None:
+        self._handlers.pop(handler_id, None)
+
+    def add_hotkey(self, binding: str, callback, name: str | None = None) -> int | None:
+        """Call callback() when binding is pressed. Returns an id for remove_hotkey(), or None for an empty binding."""
+        path = parse_binding(binding)
+        if not path:
+            return None
+        hotkey_id = next(self._ids)
+        with self._lock:
+            node = self._root
+            for chord in path:
+                node = node.children.setdefault(chord, _TrieNode())
+            node.hotkeys[hotkey_id] = (name or binding, callback)
+            self._hotkey_paths[hotkey_id] = path
+        return hotkey_id
+
+    def remove_hotkey(self, hotkey_id: int | None) -> None:
+        with self._lock:
+            path = self._hotkey_paths.pop(hotkey_id, None)
+            if path is None:
+                return
+            trail = [self._root]
+            for chord in path:
+                trail.append(trail[-1].children[chord])
+            trail[-1].hotkeys.pop(hotkey_id, None)
+            # Prune nodes that no longer lead to any hotkey
+            for depth in range(len(path), 0, -1):
+                node = trail[depth]
+                if node.hotkeys or node.children:
+                    break
+                del trail[depth - 1].children[path[depth - 1]]
+            self._node = self._root
+
+    def _match(self, name: str) -> list:
+        """Advance the trie with the chord of this key press: the modifiers held down plus the key itself (other keys
+        still held, or whose key-up was missed, don't count). Returns the hotkeys completed by this key press."""
+        chord = frozenset([name, *(held for held in self._pressed.values() if held in MODIFIER_KEYS)])
+        with self._lock:
+            node = self._node.children.get(chord)
+            if node is None and self._node is not self._root:
+                node = self._root.children.get(chord)  # A broken sequence may be the start of another one
+            if node is None and name in MODIFIER_KEYS:
+                return []  # Pressing a modifier for the next step of a sequence doesn't break it
+            if node is None:
+                self._node = self._root
+                return []
+            if node.hotkeys:
+                self._node = self._root
+                return list(node.hotkeys.values())
+            self._node = node  # Part-way through a sequence
+            return []
+
+    def on_event(self, event) -> None:
+        """The hook callback. Also used to feed synthetic events in tests and benchmarks."""
+        started = self.clock()
+        name = (event.name or "").lower()
+        # The name of a key can differ between its down and up events ("!" goes down, "1" comes up), its scan code can't
+        scan_code = getattr(event, 'scan_code', None)
+        key = scan_code if scan_code is not None else name
+        injected = self.injecting.is_set()
+        matched = []
+        if event.event_type == KEY_DOWN:
+            if key not in self._pressed:  # Auto-repeat of a held key doesn't trigger hotkeys again
+                self._pressed[key] = name
+                if not injected:  # KeyGenie's own keys never trigger a hotkey
+                    matched = self._match(name)
+        else:
+            self._pressed.pop(key, None)
+        if injected:
+            self.injected += 1
+
+        keyboard_input = KeyboardInput(event.event_type, event.name, matched[0][0] if matched else None, injected)
+        for hotkey_name, callback in matched:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Hotkey {hotkey_name} failed: {e}")
+        for callback in list(self._handlers.values()):
+            try:
+                callback(keyboard_input)
+            except Exception as e:
+                print(f"Keyboard handler failed: {e}")
+        self.events += 1
+        self.dispatch_ns += self.clock() - started
+
+    def inject(self, name: str, event_type: str = KEY_DOWN, scan_code: int | None = None) -> None:
+        """Feed a synthetic event, exactly as if the hook had seen it."""
+        self.on_event(SyntheticKey(event_type, name, scan_code))
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "injected": self.injected,
+            "handlers": len(self._handlers),
+            "hotkeys": len(self._hotkey_paths),
+            "dispatch_ns_per_event": round(self.dispatch_ns / self.events) if self.events else 0,
+        }
+
+
+# The one dispatcher shared by the background task and the settings menu
+dispatcher = KeyDispatcher()
+
+
+if __name__ == "__main__":
+    # Per-event cost with a realistic set of handlers and hotkeys, matching with stale keys around, then idle CPU.
+    bench = KeyDispatcher()
+    fired = []
+    bench.add_hotkey("right shift", lambda: fired.append("prompt"))
+    bench.add_hotkey("right ctrl", lambda: fired.append("completion"))
+    bench.add_hotkey("ctrl+alt+k, ctrl+alt+j", lambda: fired.append("sequence"))
+    bench.subscribe(lambda keyboard_input: None)  # e.g. the capture engine
+
+    for key in ["ctrl", "alt", "k"]:
+        bench.inject(key)
+    bench.inject("k", KEY_UP)
+    bench.inject("j")
+    assert fired == ["sequence"], fired
+    for key in ["j", "alt", "ctrl"]:
+        bench.inject(key, KEY_UP)
+    # The same sequence with the modifiers let go and pressed again between the steps
+    for key, event_type in (("ctrl", KEY_DOWN), ("alt", KEY_DOWN), ("k", KEY_DOWN), ("k", KEY_UP), ("alt", KEY_UP),
+                            ("ctrl", KEY_UP), ("ctrl", KEY_DOWN), ("alt", KEY_DOWN), ("j", KEY_DOWN)):
+        bench.inject(key, event_type)
+    assert fired == ["sequence", "sequence"], fired
+    for key in ["j", "alt", "ctrl"]:
+        bench.inject(key, KEY_UP)
+
+    keys = "the quick brown fox jumps over the lazy dog"
+    for _ in range(5_000):
+        for key in keys:
+            bench.inject(key)
+            bench.inject(key, KEY_UP)
+    print("dispatch:", bench.stats())
+
+    # A key whose name changes between down and up, and a key-up that never arrives (e.g. after Win+L), used to leave a
+    # stale key held forever, so no trigger matched again until a restart
+    fired.clear()
+    bench.inject("shift", KEY_DOWN, scan_code=42)
+    bench.inject("!", KEY_DOWN, scan_code=2)
+    bench.inject("1", KEY_UP, scan_code=2)
+    bench.inject("shift", KEY_UP, scan_code=42)
+    bench.inject("x", KEY_DOWN, scan_code=45)  # Its key-up is missed
+    bench.inject("right shift", KEY_DOWN, scan_code=54)
+    bench.inject("right shift", KEY_UP, scan_code=54)
+    print("trigger still matches after a renamed key-up and a missed one:", fired == ["prompt"])
+
+    # The keys of a ctrl+v sent by KeyGenie itself reach the handlers marked as injected
+    seen = []
+    bench.subscribe(seen.append)
+    with bench.injecting:
+        for key, event_type in (("ctrl", KEY_DOWN), ("v", KEY_DOWN), ("v", KEY_UP), ("ctrl", KEY_UP)):
+            bench.inject(key, event_type)
+    print("own ctrl+v marked as injected:", all(keyboard_input.injected for keyboard_input in seen))
+
+    # Idle CPU of the whole process with the real global hook installed, as in the app
+    idle = KeyDispatcher()
+    idle.subscribe(lambda keyboard_input: None)
+    try:
+        idle.install()
+    except Exception as e:  # The keyboard library isn't installed, or may not hook the keyboard (e.g. not root on Linux)
+        print(f"idle: not measured, the keyboard hook could not be installed ({e!r})")
+    else:
+        idle_seconds = 5
+        cpu_before, wall_before = time.process_time(), time.perf_counter()
+        time.sleep(idle_seconds)  # Don't touch the keyboard meanwhile
+        cpu_used = time.process_time() - cpu_before
+        print(f"idle with the hook installed: {cpu_used * 1000:.2f} ms CPU over {time.perf_counter() - wall_before:.1f} s "
+              f"({cpu_used / idle_seconds * 100:.3f}% of one core, {idle.events} key events)")
@@ -6,66 +6,33 @@ import ctypes
 import copy
 from threading import Event
 from PyQt5.QtGui import QCloseEvent, QIcon, QPixmap, QFont, QPainter, QColor, QFont, QFontDatabase
-import keyboard
 from ctypes import wintypes
 from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QLineEdit, QTextEdit, QPushButton,
                              QVBoxLayout, QHBoxLayout, QSlider, QCheckBox, QComboBox, QMessageBox,
-                             QScrollArea, QDialog)
-from PyQt5.QtCore import Qt
-from win32com.client import Dispatch
-
-# File paths for saving settings
-PRIVATE_FOLDER = os.path.join(os.path.expanduser("~"), "privateVariables")
-API_KEY_FILE = os.path.join(PRIVATE_FOLDER, "apikey.txt")
-SETTINGS_FILE = os.path.join(PRIVATE_FOLDER, "settings.json")
-
-# Default keybinds and settings
+                             QScrollArea, QDialog, QInputDialog)
+from PyQt5.QtCore import Qt, QEvent
+from settings_service import (thaw, settings_service, load_or_create_api_key, PRIVATE_FOLDER, API_KEY_FILE,
+                              SETTINGS_FILE, DEFAULT_SETTINGS)
+from key_dispatcher import dispatcher
+from speech import default_backend
+from providers import model_entries, provider_for_model
+from profiles import DEFAULT_PROFILE, PROFILE_FIELDS, NO_KEYBINDS, profile_names, profile_settings, duplicate_keybinds
+
+# Default model
 DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
-with open(os.path.join("brain","defaultSettings.json"), "r") as file: DEFAULT_SETTINGS = json.load(file)
 
 # Startup shortcut paths
 APPDATA_FOLDER = os.getenv('APPDATA')
 STARTUP_SHORTCUT_PATH = os.path.join(APPDATA_FOLDER, r'Microsoft\Windows\Start Menu\Programs\Startup', 'AIKeyboard.lnk')
 
-model_ids = [
-            # Chat models
-            'gpt-4',
-            'gpt-4-0613',
-            'gpt-4-1106-preview',
-            'gpt-4-turbo',
-            'gpt-4-turbo-2024-04-09',
-            'gpt-4-turbo-preview',
-            'gpt-4o',
-            'gpt-4o-2024-05-13',
-            'gpt-4o-mini',
-            'gpt-4o-mini-2024-07-18',
-            'gpt4o-0806-loco-vm',
-            'gpt-3.5-turbo',
-            'gpt-3.5-turbo-16k',
-            'gpt-3.5-turbo-0125',
-            'gpt-3.5-turbo-1106',
-            'gpt-3.5-turbo-instruct',  # Legacy completion model
-            'gpt-3.5-turbo-instruct-0914',  # Legacy completion model
-            # Legacy completion models
-            'davinci-002',
-            'babbage-002',
-            'text-davinci-003',
-            'text-curie-001',
-            'text-babbage-001',
-            'text-ada-001',
-        ]
-
-def load_or_create_api_key() -> str:
-    """Load or create an API key."""
-    if not os.path.exists(PRIVATE_FOLDER):
-        os.makedirs(PRIVATE_FOLDER)
+# Application fonts, registered with Qt once per process: attribute name -> QFont
+custom_fonts = {}
 
-    if os.path.exists(API_KEY_FILE):
-        with open(API_KEY_FILE, "r") as file:
-            api_key = file.read().strip()
-        if api_key:
-            return api_key
-    return ""
+# Ways auto-type can insert the answer: (setting value, label in the menu)
+output_modes = [
+            ("type", "Type (paced to Typing Speed)"),
+            ("paste", "Paste in chunks (instant)"),
+        ]
 
 def enable_startup() -> None:
     """Enable the app to run on startup by creating a shortcut."""
@@ -78,6 +45,7 @@ def enable_startup() -> None:
 
     icon_path = os.path.join(script_directory, "write.ico")
 
+    from win32com.client import Dispatch  # Only needed here, so pywin32 isn't loaded with the menu
     shell = Dispatch('WScript.Shell')
     shortcut = shell.CreateShortCut(STARTUP_SHORTCUT_PATH)
     shortcut.Targetpath = pythonw_executable
@@ -119,56 +87,78 @@ class NoScrollSlider(QSlider):
         event.ignore()  # Ignore the wheel event
 
 def load_settings() -> dict[str:float|int|bool|str]:
-    """Load settings from file or use default settings."""
-    settings = DEFAULT_SETTINGS.copy()
-    if not os.path.exists(SETTINGS_FILE):
-        return DEFAULT_SETTINGS
-    with open(SETTINGS_FILE, "r") as file:
-        settings = json.load(file)
-    return settings
+    """Return an editable copy of the current settings snapshot (no file access, the settings service keeps it up to date)."""
+    return thaw(settings_service.get())
 
 
 def save_settings(settings:dict[str:float|int|bool|str]) -> None:
-    """Save settings to a file."""
+    """Save settings to a file and publish them to the settings service."""
     with open(SETTINGS_FILE, "w") as file:
         json.dump(settings, file, indent=4)
+    settings_service.publish(settings)
 
 class SettingsWindow(QDialog):
     class Settings():
-        def __init__(self,settings:dict[str:float|int|str|bool]):
+        """The settings being edited. While a named profile is selected, its own fields (model, instructions, keybinds,
+        ...) are read from and written to that profile, and everything else to the shared top-level settings."""
+        def __init__(self,settings:dict[str:float|int|str|bool], profile:str=DEFAULT_PROFILE):
             self._settings_dict = settings
-            self.model = settings["model"]
-            self.temperature = settings["temperature"]
-            self.max_tokens = settings["max_tokens"]
-            self.auto_type = settings["auto_type"]
-            self.typing_speed_wpm = settings["typing_speed_wpm"]
-            self.letter_by_letter = settings["letter_by_letter"]
-            self.play_tts = settings["play_tts"]
-            self.tts_rate = settings["tts_rate"]
-            self.custom_instructions = settings["custom_instructions"]
-            self.keybinds = settings["keybinds"]
-            self.keybind_prompt = settings["keybinds"]["prompt"]
-            self.keybind_completion = settings["keybinds"]["completion"]
+            self._profile = profile
+            settings.setdefault("provider", "openai")  # Which provider the model is sent to
+            settings.setdefault("output_mode", "type")  # Missing from settings files saved by older versions
+            settings.setdefault("tts_voice", "")  # "" is the system's default voice
+            settings.setdefault("profiles", {})  # Named profiles: name -> the fields it sets for itself
+            settings.setdefault("conversation_mode", False)
+        def _profile_dict(self) -> dict | None:
+            if self._profile == DEFAULT_PROFILE:
+                return None
+            return self._settings_dict["profiles"].setdefault(self._profile, {})
+        def __getattr__(self, name: str):
+            # Only called for names that aren't real attributes, i.e. the settings themselves
+            profile = self._profile_dict()
+            if profile is not None and name in PROFILE_FIELDS:
+                if name == "keybinds":
+                    return profile.setdefault("keybinds", dict(NO_KEYBINDS))  # Edited in place by select_keybind
+                if name in profile:
+                    return profile[name]
+            try:
+                return self._settings_dict[name]
+            except KeyError:
+                raise AttributeError(name)
         def __getitem__(self,key):
-            return self.__getattribute__(key)
+            return self.__getattr__(key)
         def __setitem__(self, key, value) -> None:
             return self.__setattr__(key,value)
         def __setattr__(self, name: str, value) -> None:
-            if name == "_settings_dict": #avoids key error when setting the self._settings_dict for the first time.
-                pass
-            elif name in self._settings_dict:
-                self.__getattribute__("_settings_dict")[name] = value
-            return super().__setattr__(name,value)
+            if name.startswith("_") or name == "profile":  # The wrapper's own state, not a setting
+                return super().__setattr__(name,value)
+            profile = self._profile_dict()
+            if profile is not None and name in PROFILE_FIELDS:
+                profile[name] = value
+            else:
+                self._settings_dict[name] = value
         def __iter__(self):
             return self._settings_dict.__iter__()
         @property
+        def profile(self) -> str: return self._profile
+        @profile.setter
+        def profile(self, profile: str) -> None: self._profile = profile
+        @property
         def settings_dict(self): return self._settings_dict.copy()
+        def resolved(self) -> dict:
+            """The selected profile's settings, as backgroundai will use them."""
+            return profile_settings(self._settings_dict, self._profile)
+
+    def __init__(self, on_active_changed=None) -> None:
+        """Built once per process and reused: refresh() shows the current settings each time it's opened again.
 
-    def __init__(self) -> None:
+        \n\non_active_changed(active) is called when the window gains or loses focus (backgroundai stops listening for
+        its keybinds while the user types in here)."""
         super().__init__()
+        self.on_active_changed = on_active_changed
 
-        settings_dict = load_settings()
-        self.settings = self.Settings(copy.deepcopy(settings_dict))
+        settings_dict = load_settings()  # Already a fresh copy of the snapshot
+        self.settings = self.Settings(settings_dict)
         self.saved_settings = self.Settings(copy.deepcopy(settings_dict))
 
         self.setWindowTitle("KeyGenie Menu")
@@ -204,42 +194,24 @@ class SettingsWindow(QDialog):
         self.api_key_visible = False  # Track visibility of the API key
     
     def load_custom_fonts(self):
-        # Load fonts
-        script_directory = os.path.dirname(os.path.abspath(__file__))
-        rowdies_path = os.path.join(script_directory, 'Rowdies-Regular.ttf')
-        ubuntu_bold_path = os.path.join(script_directory, 'Ubuntu-Bold.ttf')
-        noto_sans_path = os.path.join(script_directory, 'NotoSans-Medium.ttf')
-
-        # Load Rowdies-Regular for the title
-        if os.path.exists(rowdies_path):
-            rowdies_font_id = QFontDatabase.addApplicationFont(rowdies_path)
-            if rowdies_font_id != -1:
-                self.rowdies_font = QFont(QFontDatabase.applicationFontFamilies(rowdies_font_id)[0])
-            else:
-                print(f"Failed to load Rowdies font from {rowdies_path}")
-        else:
-            print(f"Rowdies font not found at {rowdies_path}")
-
-        # Load Ubuntu-Bold for bold sections
-        if os.path.exists(ubuntu_bold_path):
-            ubuntu_bold_font_id = QFontDatabase.addApplicationFont(ubuntu_bold_path)
-            if ubuntu_bold_font_id != -1:
-                self.ubuntu_bold_font = QFont(QFontDatabase.applicationFontFamilies(ubuntu_bold_font_id)[0])
-            else:
-                print(f"Failed to load Ubuntu-Bold font from {ubuntu_bold_path}")
-        else:
-            print(f"Ubuntu-Bold font not found at {ubuntu_bold_path}")
+        """Register the fonts with Qt the first time, then reuse them (the window is built once, but it can't hurt)."""
+        if not custom_fonts:
+            script_directory = os.path.dirname(os.path.abspath(__file__))
+            # Rowdies-Regular for the title, Ubuntu-Bold for bold sections, NotoSans-Medium for normal text
+            for attribute, file_name in (("rowdies_font", 'Rowdies-Regular.ttf'), ("ubuntu_bold_font", 'Ubuntu-Bold.ttf'),
+                                         ("noto_sans_font", 'NotoSans-Medium.ttf')):
+                font_path = os.path.join(script_directory, file_name)
+                if not os.path.exists(font_path):
+                    print(f"Font not found at {font_path}")
+                    continue
+                font_id = QFontDatabase.addApplicationFont(font_path)
+                if font_id != -1:
+                    custom_fonts[attribute] = QFont(QFontDatabase.applicationFontFamilies(font_id)[0])
+                else:
+                    print(f"Failed to load font from {font_path}")
+        for attribute, font in custom_fonts.items():
+            setattr(self, attribute, font)
 
-        # Load NotoSans-Medium for normal text
-        if os.path.exists(noto_sans_path):
-            noto_sans_font_id = QFontDatabase.addApplicationFont(noto_sans_path)
-            if noto_sans_font_id != -1:
-                self.noto_sans_font = QFont(QFontDatabase.applicationFontFamilies(noto_sans_font_id)[0])
-            else:
-                print(f"Failed to load NotoSans font from {noto_sans_path}")
-        else:
-            print(f"NotoSans font not found at {noto_sans_path}")
-    
     def init_ui(self) -> None:
         main_layout = QVBoxLayout(self)
 
@@ -339,6 +311,32 @@ class SettingsWindow(QDialog):
         # Load the API key after creating the layout
         self.load_api_key()
         
+        # Profiles Section: every setting below the profile selector, from the model to Play TTS, belongs to the selected profile
+        self.profile_label = QLabel("Profile:")
+        self.profile_label.setFont(make_bold(QFont(self.ubuntu_bold_font.family()), section_font_percentage, screen_height))  # Bold + bigger
+        content_layout.addWidget(self.profile_label)
+
+        profile_layout = QHBoxLayout()
+        self.profile_combo_box = NoScrollComboBox()
+        self.profile_combo_box.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage, screen_height))  # Bigger combo box text
+        self.profile_combo_box.addItems(profile_names(self.settings.settings_dict))
+        self.profile_combo_box.currentIndexChanged.connect(self.on_profile_changed)
+        profile_layout.addWidget(self.profile_combo_box)
+
+        self.new_profile_button = QPushButton("New")
+        self.new_profile_button.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage, screen_height))  # Normal + bigger
+        self.new_profile_button.setFixedWidth(100)
+        self.new_profile_button.clicked.connect(self.new_profile)
+        profile_layout.addWidget(self.new_profile_button)
+
+        self.delete_profile_button = QPushButton("Delete")
+        self.delete_profile_button.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage, screen_height))  # Normal + bigger
+        self.delete_profile_button.setFixedWidth(100)
+        self.delete_profile_button.clicked.connect(self.delete_profile)
+        self.delete_profile_button.setEnabled(False)  # The default profile can't be deleted
+        profile_layout.addWidget(self.delete_profile_button)
+        content_layout.addLayout(profile_layout)
+
         # 2. Model Selection Section
         self.model_label = QLabel("Model Selection:")
         self.model_label.setFont(make_bold(QFont(self.ubuntu_bold_font.family()), section_font_percentage, screen_height))  # Bold + bigger
@@ -347,15 +345,11 @@ class SettingsWindow(QDialog):
         # Use NoScrollComboBox to prevent scroll wheel interaction
         self.model_combo_box = NoScrollComboBox()  # Replace QComboBox with NoScrollComboBox
         self.model_combo_box.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage, screen_height))  # Bigger combo box text
-        self.model_combo_box.addItems(model_ids)
+        # Every model of every configured provider (OpenAI, a local OpenAI-compatible server, ...)
+        self.model_entries = model_entries(self.settings.settings_dict)
+        self.model_combo_box.addItems([f"{model} ({provider})" for provider, model in self.model_entries])
         content_layout.addWidget(self.model_combo_box)
-
-        selected_model = self.settings.model
-        if selected_model in model_ids:
-            index = model_ids.index(selected_model)
-            self.model_combo_box.setCurrentIndex(index)
-        else:
-            self.model_combo_box.setCurrentIndex(0)
+        self.model_combo_box.setCurrentIndex(self.model_entry_index())
 
         self.model_combo_box.currentIndexChanged.connect(self.on_model_selection_changed)
 
@@ -457,6 +451,13 @@ class SettingsWindow(QDialog):
         self.max_tokens_input.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
         max_tokens_layout.addWidget(self.max_tokens_input)
         content_layout.addLayout(max_tokens_layout)
+
+        # Conversation Mode Checkbox (follow-up prompts see the earlier ones and their answers)
+        self.conversation_mode_checkbox = QCheckBox("Conversation Mode (remember earlier prompts)")
+        self.conversation_mode_checkbox.setChecked(self.settings['conversation_mode'])
+        self.conversation_mode_checkbox.stateChanged.connect(self.on_conversation_mode_changed)
+        self.conversation_mode_checkbox.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
+        content_layout.addWidget(self.conversation_mode_checkbox)
         
         # Auto-Type Checkbox
         self.auto_type_checkbox = QCheckBox("Auto-Type")
@@ -464,6 +465,20 @@ class SettingsWindow(QDialog):
         self.auto_type_checkbox.stateChanged.connect(self.on_auto_type_changed)
         self.auto_type_checkbox.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
         content_layout.addWidget(self.auto_type_checkbox)
+
+        # Output Mode (typing or chunked clipboard paste)
+        self.output_mode_layout = QHBoxLayout()
+        self.output_mode_label = QLabel("Output Mode:")
+        self.output_mode_label.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
+        self.output_mode_layout.addWidget(self.output_mode_label)
+
+        self.output_mode_combo_box = NoScrollComboBox()
+        self.output_mode_combo_box.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
+        self.output_mode_combo_box.addItems([label for _, label in output_modes])
+        self.output_mode_combo_box.setCurrentIndex(self.output_mode_index(self.settings['output_mode']))
+        self.output_mode_combo_box.currentIndexChanged.connect(self.on_output_mode_changed)
+        self.output_mode_layout.addWidget(self.output_mode_combo_box)
+        content_layout.addLayout(self.output_mode_layout)
         
         # Typing Speed Slider
         self.typing_speed_layout = QHBoxLayout()
@@ -508,8 +523,27 @@ class SettingsWindow(QDialog):
         self.tts_rate_layout.addWidget(self.tts_rate_slider)
         content_layout.addLayout(self.tts_rate_layout)
         
+        # TTS Voice (initially hidden)
+        self.tts_voice_layout = QHBoxLayout()
+        self.tts_voice_label = QLabel("TTS Voice:")
+        self.tts_voice_label.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
+        self.tts_voice_layout.addWidget(self.tts_voice_label)
+
+        self.tts_voices = [""] + self.installed_voices()
+        if self.settings['tts_voice'] not in self.tts_voices:
+            self.tts_voices.append(self.settings['tts_voice'])  # Keep a voice that is saved but not installed here
+        self.tts_voice_combo_box = NoScrollComboBox()
+        self.tts_voice_combo_box.setFont(make_normal(QFont(self.noto_sans_font.family()), normal_font_percentage,screen_height))  # Normal + bigger
+        self.tts_voice_combo_box.addItems([voice or "Default" for voice in self.tts_voices])
+        self.tts_voice_combo_box.setCurrentIndex(self.tts_voices.index(self.settings['tts_voice']))
+        self.tts_voice_combo_box.currentIndexChanged.connect(self.on_tts_voice_changed)
+        self.tts_voice_layout.addWidget(self.tts_voice_combo_box)
+        content_layout.addLayout(self.tts_voice_layout)
+
         self.tts_rate_slider.setVisible(self.play_tts_checkbox.isChecked())
         self.tts_rate_label.setVisible(self.play_tts_checkbox.isChecked())
+        self.tts_voice_label.setVisible(self.play_tts_checkbox.isChecked())
+        self.tts_voice_combo_box.setVisible(self.play_tts_checkbox.isChecked())
         
         # 6. Startup Buttons
         startup_buttons_layout = QHBoxLayout()
@@ -606,7 +640,7 @@ class SettingsWindow(QDialog):
         self.current_action = action
         button.setStyleSheet("background-color: yellow")
 
-        # Use keyboard.hook to detect the key press in the background
+        # Subscribe to the key dispatcher to detect the key press in the background
         def on_key_event(event):
             if event.event_type == "down":  # Only capture key down events
                 key = event.name
@@ -623,28 +657,89 @@ class SettingsWindow(QDialog):
 
                 # Reset the button color
                 button.setStyleSheet("")
-                keyboard.unhook_all()  # Stop listening for keyboard events
+                dispatcher.unsubscribe(self.keybind_listener)  # Stop listening for keyboard events
                 self.current_action = None
 
-        keyboard.hook(on_key_event)  # Hook keyboard events for key detection
+        self.keybind_listener = dispatcher.subscribe(on_key_event)  # Listen to keyboard events for key detection
 
     def revert_to_default_keybinds(self):
-        """Revert to default keybinds and update UI."""
-        self.settings.keybinds = DEFAULT_SETTINGS["keybinds"].copy()
-        self.saved_settings.keybinds = DEFAULT_SETTINGS["keybinds"].copy()
-        save_settings(self.saved_settings.settings_dict)
+        """Revert to default keybinds and update UI. A named profile's keybinds are cleared instead (the defaults are the default profile's)."""
+        keybinds = DEFAULT_SETTINGS["keybinds"] if self.settings.profile == DEFAULT_PROFILE else NO_KEYBINDS
+        self.settings.keybinds = dict(keybinds)
+        if self.settings.profile in profile_names(self.saved_settings.settings_dict):  # Not a new, unsaved profile
+            self.saved_settings.keybinds = dict(keybinds)
+            save_settings(self.saved_settings.settings_dict)
         self.prompt_keybind_input.setText(self.settings.keybinds["prompt"])
         self.completion_keybind_input.setText(self.settings.keybinds["completion"])
         # save_settings(self.settings.settings_dict)
         QMessageBox.information(self, "Info", "Keybinds reverted to default!")
 
+    def read_text_fields(self) -> None:
+        """Write the fields without change handlers (instructions, max tokens) to the selected profile.
+        \n\nRaises ValueError if max tokens isn't an integer."""
+        self.settings['custom_instructions'] = self.custom_instructions_text.toPlainText()
+        self.settings['max_tokens'] = int(self.max_tokens_input.text())
+
+    def select_profile(self, profile: str) -> None:
+        """Show (and edit) another profile's settings."""
+        self.settings.profile = profile
+        self.saved_settings.profile = profile
+        self.update_fields()
+
+    def on_profile_changed(self):
+        try:
+            self.read_text_fields()  # Keep what was typed for the profile that was shown until now
+        except ValueError:
+            QMessageBox.warning(self, "Error", "Max tokens must be an integer!")
+            self.profile_combo_box.blockSignals(True)
+            self.profile_combo_box.setCurrentText(self.settings.profile)
+            self.profile_combo_box.blockSignals(False)
+            return
+        self.select_profile(self.profile_combo_box.currentText())
+
+    def new_profile(self):
+        """Add a profile, starting from the selected profile's settings but without keybinds."""
+        name, ok = QInputDialog.getText(self, "New Profile", "Profile name (e.g. code, email, translate):")
+        name = name.strip()
+        if not ok or not name:
+            return
+        if name in profile_names(self.settings.settings_dict) or ":" in name:
+            QMessageBox.warning(self, "Error", f"Can't name a profile \"{name}\": the name is taken, or contains \":\".")
+            return
+        try:
+            self.read_text_fields()
+        except ValueError:
+            QMessageBox.warning(self, "Error", "Max tokens must be an integer!")
+            return
+        current = self.settings.resolved()
+        profile = {field: copy.deepcopy(current[field]) for field in PROFILE_FIELDS if field in current}
+        profile["keybinds"] = dict(NO_KEYBINDS)  # Set them below, they have to differ from every other profile's
+        self.settings["profiles"][name] = profile
+        self.select_profile(name)
+
+    def delete_profile(self):
+        profile = self.settings.profile
+        if profile == DEFAULT_PROFILE:
+            return
+        confirm = QMessageBox.question(self, "Delete Profile", f"Delete the profile \"{profile}\"?")
+        if confirm != QMessageBox.StandardButton.Yes:
+            return
+        self.settings["profiles"].pop(profile, None)
+        self.select_profile(DEFAULT_PROFILE)
+
     def on_instructions_text_changed(self):
         self.settings.custom_instructions = self.custom_instructions_text.toPlainText()
 
     def on_model_selection_changed(self):
         """Save the selected model when the selection changes."""
-        model_id = self.model_combo_box.currentText()
+        provider, model_id = self.model_entries[self.model_combo_box.currentIndex()]
         self.settings.model = model_id
+        self.settings.provider = provider
+
+    def model_entry_index(self) -> int:
+        """Position of the selected model (on the provider it's sent to) in the model combo box, 0 if it isn't offered."""
+        entry = (provider_for_model(self.settings.resolved()), self.settings.model)
+        return self.model_entries.index(entry) if entry in self.model_entries else 0
         
     def on_temperature_changed(self):
         """Update temperature label when the slider value changes."""
@@ -659,6 +754,22 @@ class SettingsWindow(QDialog):
         self.typing_speed_slider.setVisible(auto_type_enabled)
         self.typing_speed_label.setVisible(auto_type_enabled)
         self.letter_by_letter_checkbox.setVisible(auto_type_enabled)
+        self.output_mode_label.setVisible(auto_type_enabled)
+        self.output_mode_combo_box.setVisible(auto_type_enabled)
+
+    def on_conversation_mode_changed(self):
+        """Update the conversation mode setting when the checkbox is toggled."""
+        self.settings['conversation_mode'] = self.conversation_mode_checkbox.isChecked()
+
+    @staticmethod
+    def output_mode_index(output_mode: str) -> int:
+        """Position of an output_mode setting in the Output Mode combo box (typing if unknown)."""
+        values = [value for value, _ in output_modes]
+        return values.index(output_mode) if output_mode in values else 0
+
+    def on_output_mode_changed(self):
+        """Update the output mode when a different one is selected."""
+        self.settings['output_mode'] = output_modes[self.output_mode_combo_box.currentIndex()][0]
 
     def on_typing_speed_changed(self):
         """Update typing speed label when the slider value changes."""
@@ -681,37 +792,106 @@ class SettingsWindow(QDialog):
         play_tts_enabled = self.play_tts_checkbox.isChecked()
         self.tts_rate_slider.setVisible(play_tts_enabled)
         self.tts_rate_label.setVisible(play_tts_enabled)
+        self.tts_voice_label.setVisible(play_tts_enabled)
+        self.tts_voice_combo_box.setVisible(play_tts_enabled)
         self.settings['play_tts'] = play_tts_enabled
 
+    @staticmethod
+    def installed_voices() -> list:
+        """Names of the voices the TTS engine can use (empty if it isn't available)."""
+        try:
+            return default_backend().voices()
+        except Exception as e:
+            print(f"Could not list TTS voices: {e}")
+            return []
+
+    def on_tts_voice_changed(self):
+        """Update the TTS voice when a different one is selected."""
+        self.settings['tts_voice'] = self.tts_voices[self.tts_voice_combo_box.currentIndex()]
+
+
+    def refresh(self) -> None:
+        """Load the current settings snapshot into the (reused) window. Called every time it's opened."""
+        settings_dict = load_settings()
+        profile = self.settings.profile if self.settings.profile in profile_names(settings_dict) else DEFAULT_PROFILE
+        self.settings = self.Settings(settings_dict, profile)
+        self.saved_settings = self.Settings(copy.deepcopy(settings_dict), profile)
+        self.load_api_key()
+        self.update_fields()
+
+    def update_fields(self) -> None:
+        """Set every widget from self.settings."""
+        # Without their change handlers, which would write the (e.g. rounded) widget values back into self.settings
+        inputs = [self.profile_combo_box, self.model_combo_box, self.custom_instructions_text, self.temperature_slider, self.conversation_mode_checkbox, self.auto_type_checkbox,
+                  self.letter_by_letter_checkbox, self.output_mode_combo_box, self.typing_speed_slider,
+                  self.play_tts_checkbox, self.tts_rate_slider, self.tts_voice_combo_box]
+        for widget in inputs:
+            widget.blockSignals(True)
+        try:
+            names = profile_names(self.settings.settings_dict)
+            if names != [self.profile_combo_box.itemText(index) for index in range(self.profile_combo_box.count())]:
+                self.profile_combo_box.clear()
+                self.profile_combo_box.addItems(names)
+            self.profile_combo_box.setCurrentText(self.settings.profile)
+            self.delete_profile_button.setEnabled(self.settings.profile != DEFAULT_PROFILE)
+            entries = model_entries(self.settings.settings_dict)
+            if entries != self.model_entries:  # The "providers" setting changed since the window was built
+                self.model_entries = entries
+                self.model_combo_box.clear()
+                self.model_combo_box.addItems([f"{model} ({provider})" for provider, model in self.model_entries])
+            self.model_combo_box.setCurrentIndex(self.model_entry_index())
+            self.custom_instructions_text.setPlainText(self.settings.custom_instructions)
+            self.completion_keybind_input.setText(self.settings.keybinds["completion"])
+            self.prompt_keybind_input.setText(self.settings.keybinds["prompt"])
+            self.temperature_slider.setValue(int(self.settings['temperature'] * 10))
+            self.temperature_label.setText(f"Temperature: {self.settings['temperature']}")
+            self.max_tokens_input.setText(str(self.settings['max_tokens']))
+            self.conversation_mode_checkbox.setChecked(self.settings['conversation_mode'])
+            self.auto_type_checkbox.setChecked(self.settings['auto_type'])
+            self.letter_by_letter_checkbox.setChecked(self.settings['letter_by_letter'])
+            self.output_mode_combo_box.setCurrentIndex(self.output_mode_index(self.settings['output_mode']))
+            self.typing_speed_slider.setValue(self.settings['typing_speed_wpm'])
+            self.typing_speed_label.setText(f"Typing Speed: {self.settings['typing_speed_wpm']} WPM")
+            self.play_tts_checkbox.setChecked(self.settings['play_tts'])
+            self.tts_rate_slider.setValue(self.settings['tts_rate'])
+            self.tts_rate_label.setText(f"TTS Rate: {self.settings['tts_rate']}")
+            if self.settings['tts_voice'] not in self.tts_voices:
+                self.tts_voices.append(self.settings['tts_voice'])  # Keep a voice that is saved but not installed here
+                self.tts_voice_combo_box.addItem(self.settings['tts_voice'])
+            self.tts_voice_combo_box.setCurrentIndex(self.tts_voices.index(self.settings['tts_voice']))
+        finally:
+            for widget in inputs:
+                widget.blockSignals(False)
+        # Show or hide the typing and TTS options to match the checkboxes
+        self.on_auto_type_changed()
+        self.on_play_tts_changed()
+
+    def changeEvent(self, event) -> None:
+        super().changeEvent(event)
+        if event.type() == QEvent.ActivationChange and self.on_active_changed is not None:
+            self.on_active_changed(self.isActiveWindow())
 
     def revert_to_default_settings(self):
         """Revert all settings to default values."""
-        self.settings = self.Settings(DEFAULT_SETTINGS.copy())
-        self.model_combo_box.setCurrentIndex(model_ids.index(self.settings["model"]))
-        self.custom_instructions_text.setPlainText(self.settings.custom_instructions)
-        self.completion_keybind_input.setText(self.settings.keybinds["completion"])
-        self.prompt_keybind_input.setText(self.settings.keybinds["prompt"])
-        self.temperature_slider.setValue(int(self.settings['temperature'] * 10))
-        self.temperature_label.setText(f"Temperature: {self.settings['temperature']}")
-        self.max_tokens_input.setText(str(self.settings['max_tokens']))
-        self.auto_type_checkbox.setChecked(self.settings['auto_type'])
-        self.letter_by_letter_checkbox.setChecked(self.settings['letter_by_letter'])
-        self.typing_speed_slider.setValue(self.settings['typing_speed_wpm'])
-        self.typing_speed_label.setText(f"Typing Speed: {self.settings['typing_speed_wpm']} WPM")
-        self.play_tts_checkbox.setChecked(self.settings['play_tts'])
-        self.tts_rate_slider.setValue(self.settings['tts_rate'])
-        self.tts_rate_label.setText(f"TTS Rate: {self.settings['tts_rate']}")
+        self.settings = self.Settings(copy.deepcopy(DEFAULT_SETTINGS))  # Deep, so editing keybinds can't change the defaults
+        self.saved_settings.profile = DEFAULT_PROFILE  # There are no named profiles in the defaults
+        self.update_fields()
         QMessageBox.information(self, "Info", "Settings reverted to default!")
 
     def save_settings(self):
         try:
             # all other settings, when the buttons or sliders are interacted with, are written to the self.settings object. 
             # Need to catch the ones that don't have these on edit events here.
-            self.settings['custom_instructions'] = self.custom_instructions_text.toPlainText()
-            self.settings['max_tokens'] = int(self.max_tokens_input.text())
+            self.read_text_fields()
             self.settings['play_tts'] = self.play_tts_checkbox.isChecked()
-            # TTS rate is already updated via on_tts_rate_changed
-            self.saved_settings = self.Settings(self.settings.settings_dict)
+            # TTS rate and voice are already updated via on_tts_rate_changed and on_tts_voice_changed
+            duplicates = duplicate_keybinds(self.settings.settings_dict)
+            if duplicates:
+                keybind, first, second = duplicates[0]
+                QMessageBox.warning(self, "Error", f"\"{keybind}\" is the keybind of both {first} and {second}. Give each one its own.")
+                return
+            # Deep, so later edits (to keybinds or profiles) don't also change what counts as saved
+            self.saved_settings = self.Settings(copy.deepcopy(self.settings.settings_dict), self.settings.profile)
             # save the settings to the file
             save_settings(self.saved_settings.settings_dict)
             QMessageBox.information(self, "Success", "Settings saved successfully!")
@@ -0,0 +1,6 @@
+def percentile(values, fraction: float):
+    """Nearest-rank percentile of a list of numbers (None if it's empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import namedtuple
+
+from settings_service import PRIVATE_FOLDER
+
+# What is known about a model: which API endpoint it's called through, its context window and maximum output (in
+# tokens, None if unknown), whether it can stream, and the provider that serves it.
+ModelInfo = namedtuple("ModelInfo", ["id", "provider", "endpoint", "context_window", "max_output", "streaming"])
+
+# One consistent view of every known model, published to readers as a single reference: models is provider ->
+# {model id -> ModelInfo} in listing order, by_id is model id -> ModelInfo (for a model asked for on a provider that
+# doesn't list it), guesses is (provider, model id) -> inferred ModelInfo (for models nobody lists, filled in lazily).
+Catalog = namedtuple("Catalog", ["models", "by_id", "guesses"])
+
+CHAT, COMPLETION, OTHER = "chat", "completion", "other"  # OTHER: embeddings, speech, images, ... (never selectable)
+
+# Found next to this file, whatever the working directory the app was started from
+DEFAULT_MODELS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "defaultModels.json")
+MODELS_CACHE_FILE = os.path.join(PRIVATE_FOLDER, "models_cache.json")
+
+# How to guess the endpoint of a listed model that isn't in the bundled file (a model listing only gives ids)
+NON_TEXT_MODEL = re.compile(r"embed|whisper|tts|dall-e|moderation|image|transcribe|realtime|audio")
+COMPLETION_MODEL = re.compile(r"instruct|^(text-)?(davinci|curie|babbage|ada)\b")
+
+# A failed listing (server down, no key, ...) isn't retried for this long, whatever the TTL
+RETRY_AFTER = 600
+
+
+def infer_model(model_id: str, provider: str) -> ModelInfo:
+    """What a model that isn't in the registry most likely is. OpenAI-compatible servers serve chat models."""
+    if NON_TEXT_MODEL.search(model_id):
+        endpoint = OTHER
+    elif COMPLETION_MODEL.search(model_id):
+        endpoint = COMPLETION
+    else:
+        endpoint = CHAT
+    return ModelInfo(model_id, provider, endpoint, None, None, True)
+
+
+async def list_model_ids(client) -> list:
+    """The ids of a provider's /models listing, through the async client (on the stream engine's loop)."""
+    return [model.id async for model in client.models.list()]
+
+
+class ModelRegistry:
+    """Every known model and what it can do, looked up in O(1) by the request path and listed by the settings menu.
+
+    \n\nSeeded from the bundled defaultModels.json, then from the on-disk cache of each provider's last model listing,
+    so startup never waits on the network. refresh_if_stale() re-lists a provider's models on a background thread once
+    its cache is older than the TTL; the new models are published as a new Catalog, in one reference assignment, so a
+    lookup without the lock always sees one listing or the other, never a mix."""
+
+    def __init__(self, default_file: str = DEFAULT_MODELS_FILE, cache_file: str | None = MODELS_CACHE_FILE):
+        self.cache_file = cache_file
+        self._catalog = Catalog({}, {}, {})
+        self.fetched_at = {}   # provider -> time.time() of its last listing
+        self._attempted = {}   # provider -> time.time() of its last listing attempt
+        self._lock = threading.Lock()
+
+        # Instrumentation
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+        with open(default_file, "r") as file:
+            records = json.load(file)["models"]
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, "r") as file:
+                    cache = json.load(file)
+                self.fetched_at = dict(cache.get("fetched_at", {}))
+                # A provider's cached listing replaces its bundled models
+                records = [record for record in records if record["provider"] not in self.fetched_at] + cache["models"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not read the model cache: {e}")
+        self._swap([ModelInfo(**record) for record in records])
+
+    def _swap(self, models: list) -> None:
+        by_provider, by_id = {}, {}
+        for model in models:
+            by_provider.setdefault(model.provider, {})[model.id] = model
+            by_id.setdefault(model.id, model)
+        self._catalog = Catalog(by_provider, by_id, {})
+
+    def get(self, provider: str, model_id: str) -> ModelInfo | None:
+        """The model as listed by that provider, or None."""
+        return self._catalog.models.get(provider, {}).get(model_id)
+
+    def lookup(self, model_id: str, provider: str) -> ModelInfo:
+        """What model_id is when sent to provider: its listing there, else anywhere, else a guess from its id."""
+        catalog = self._catalog
+        model = catalog.models.get(provider, {}).get(model_id) or catalog.by_id.get(model_id)
+        if model is None:
+            model = catalog.guesses.get((provider, model_id))
+            if model is None:
+                model = catalog.guesses[(provider, model_id)] = infer_model(model_id, provider)
+        return model
+
+    def models_for(self, provider: str) -> list:
+        """The ids of the provider's selectable (chat and completion) models, in listing order."""
+        return [model.id for model in self._catalog.models.get(provider, {}).values() if model.endpoint != OTHER]
+
+    def is_stale(self, provider: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        return (now - self.fetched_at.get(provider, 0) > ttl_seconds
+                and now - self._attempted.get(provider, 0) > min(ttl_seconds, RETRY_AFTER))
+
+    def refresh_if_stale(self, provider, engine, ttl_seconds: float = 86400) -> bool:
+        """Re-list provider's models in the background if its cache has expired. Returns True if a refresh was started."""
+        with self._lock:
+            if not self.is_stale(provider.name, ttl_seconds):
+                return False
+            self._attempted[provider.name] = time.time()
+        threading.Thread(target=self.refresh, args=(provider, engine), daemon=True, name="model-refresh").start()
+        return True
+
+    def refresh(self, provider, engine, timeout: float = 30) -> None:
+        """List provider's models (blocking), merge them into the registry, and save the cache."""
+        try:
+            model_ids = engine.run(list_model_ids(provider.client)).result(timeout)
+        except Exception as e:
+            self.refresh_failures += 1
+            print(f"Could not list the models of {provider.name}: {e}")
+            return
+        if not model_ids:
+            return  # Keep what's known rather than empty the menu
+        with self._lock:
+            catalog = self._catalog
+            known = catalog.models.get(provider.name, {})
+            listed = []
+            for model_id in model_ids:
+                model = known.get(model_id) or catalog.by_id.get(model_id)
+                listed.append(model._replace(provider=provider.name) if model is not None else infer_model(model_id, provider.name))
+            # Known models first, in their bundled order, then the new ones alphabetically
+            order = {model_id: position for position, model_id in enumerate(known)}
+            listed.sort(key=lambda model: (order.get(model.id, len(order)), model.id))
+            others = [model for name, models in catalog.models.items() if name != provider.name for model in models.values()]
+            self.fetched_at[provider.name] = time.time()
+            self._swap(others + listed)
+            self.refreshes += 1
+            self._save()
+        print(f"Listed {len(listed)} models of {provider.name}")
+
+    def _save(self) -> None:
+        """Write the listed providers' models to the cache file (whole, then renamed over the old one)."""
+        if self.cache_file is None:
+            return
+        models = self._catalog.models
+        cache = {"fetched_at": self.fetched_at,
+                 "models": [model._asdict() for name in self.fetched_at for model in models.get(name, {}).values()]}
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file + ".tmp", "w") as file:
+                json.dump(cache, file, indent=1)
+            os.replace(self.cache_file + ".tmp", self.cache_file)
+        except OSError as e:
+            print(f"Could not save the model cache: {e}")
+
+    def stats(self) -> dict:
+        return {"models": sum(len(models) for models in self._catalog.models.values()), "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures,
+                "cache_age_s": {name: round(time.time() - fetched) for name, fetched in self.fetched_at.items()}}
+
+
+# The single registry shared by the providers, the request path and the settings menu
+model_registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    # Refresh from a local /models listing, then compare a lookup with the linear scan it replaced.
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from stream_engine import StreamEngine
+    from providers import Provider
+
+    class ModelsHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            listing = ["gpt-4o-mini", "gpt-4o", "o3-mini", "gpt-3.5-turbo-instruct", "text-embedding-3-small", "tts-1"]
+            body = json.dumps({"object": "list", "data": [{"id": model_id, "object": "model", "created": 0,
+                                                           "owned_by": "bench"} for model_id in listing]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ModelsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cache_file = os.path.join(tempfile.mkdtemp(), "models_cache.json")
+
+    started = time.perf_counter()
+    registry = ModelRegistry(cache_file=cache_file)
+    print(f"seeded {registry.stats()['models']} models in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    engine = StreamEngine()
+    provider = Provider("openai", {"base_url": f"http://127.0.0.1:{server.server_address[1]}/v1/"}, "key")
+    print("refresh started:", registry.refresh_if_stale(provider, engine))
+    print("again right away:", registry.refresh_if_stale(provider, engine))
+    while not registry.refreshes:
+        time.sleep(0.01)
+    print("selectable now:", registry.models_for("openai"))
+    print("o3-mini:", registry.lookup("o3-mini", "openai"))
+    started = time.perf_counter()
+    cached = ModelRegistry(cache_file=cache_file)
+    print(f"reloaded from the cache in {(time.perf_counter() - started) * 1000:.2f} ms:", cached.models_for("openai"))
+
+    seeded = ModelRegistry(cache_file=None)
+    legacy_list = [model.id for model in seeded._catalog.models["openai"].values()]
+    lookups = 200_000
+    started = time.perf_counter()
+    for _ in range(lookups):
+        "text-ada-001" in legacy_list  # The old is_chat_model()/OPENAI_MODELS scan, worst case
+    scan_ns = (time.perf_counter() - started) / lookups * 1e9
+    started = time.perf_counter()
+    for _ in range(lookups):
+        seeded.lookup("text-ada-001", "openai")
+    lookup_ns = (time.perf_counter() - started) / lookups * 1e9
+    print(f"list scan: {scan_ns:.0f} ns, registry lookup: {lookup_ns:.0f} ns")
+    engine.shutdown()
+    server.shutdown()
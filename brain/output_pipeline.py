@@ -0,0 +1,273 @@
+import time
+import threading
+from collections import deque
+
+# Items passed from the stream loop to each sink's thread
+BEGIN, TOKEN, END = "begin", "token", "end"
+
+# What a sink does with a new token when its buffer is full
+BACKPRESSURE_POLICIES = ("coalesce", "block", "drop_oldest")
+
+
+class CancelToken:
+    """One cancellation signal shared by the stream loop and every sink of a request.
+
+    \n\nHas the same is_set() as threading.Event, so it can be passed anywhere a stop event was used."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback) -> None:
+        """Run callback() when the token is cancelled (right away if it already is)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class OutputSink:
+    """A consumer of streamed tokens, running on its own long-lived thread with a bounded buffer.
+
+    \n\nSubclasses override enabled(), begin(), consume() and end(). The thread sleeps on a condition variable and
+    is woken by new tokens or by cancellation, so an idle sink costs nothing."""
+
+    name = "sink"
+    wake_interval = None  # If set (seconds), tick() is called whenever the sink has been idle this long
+
+    def __init__(self, capacity: int = 256, policy: str = "coalesce"):
+        self.capacity = capacity
+        self.policy = policy
+        self.cancel_token = CancelToken()
+        self.timeline = None  # The timeline of the answer being output, if the caller gave one
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._session_done = threading.Event()
+        self._session_done.set()
+        self._thread = None
+        self._reset_metrics()
+
+    # --- Overridable hooks (all run on the sink's own thread, except enabled()) ---
+
+    def enabled(self, settings) -> bool:
+        """Whether this sink takes part in a request with these settings."""
+        return True
+
+    def begin(self, settings) -> None:
+        pass
+
+    def consume(self, token: str) -> None:
+        raise NotImplementedError
+
+    def tick(self) -> None:
+        """Called after wake_interval seconds without a new item (for sinks that flush on time)."""
+        pass
+
+    def end(self, cancelled: bool) -> None:
+        pass
+
+    # --- Used by OutputPipeline ---
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-sink", daemon=True)
+            self._thread.start()
+
+    def _reset_metrics(self) -> None:
+        self.tokens = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def _put_control(self, item) -> None:
+        # Control items are never subject to backpressure
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def open_session(self, settings, cancel_token: CancelToken, timeline=None) -> None:
+        self._session_done.clear()
+        self._reset_metrics()  # The previous session has finished, so this can't race with the sink's thread
+        self.cancel_token = cancel_token  # Set here too, so offer() already sees it before the BEGIN item is processed
+        cancel_token.on_cancel(self._wake)
+        self._put_control((BEGIN, settings, cancel_token, timeline))
+
+    def offer(self, token: str) -> None:
+        """Queue a token, applying the backpressure policy when the buffer is full."""
+        enqueued_at = time.perf_counter()
+        with self._cond:
+            if len(self._items) >= self.capacity:
+                if self.policy == "block":
+                    while len(self._items) >= self.capacity and not self.cancel_token.is_set():
+                        self._cond.wait()
+                elif self.policy == "drop_oldest":
+                    for i, item in enumerate(self._items):
+                        if item[0] == TOKEN:
+                            del self._items[i]
+                            self.dropped += 1
+                            break
+                elif self._items[-1][0] == TOKEN:  # coalesce: merge into the last queued token, nothing is lost
+                    _, text, first_enqueued_at = self._items[-1]
+                    self._items[-1] = (TOKEN, text + token, first_enqueued_at)
+                    self.coalesced += 1
+                    return
+            self._items.append((TOKEN, token, enqueued_at))
+            self.high_water = max(self.high_water, len(self._items))
+            self._cond.notify_all()
+
+    def close_session(self) -> None:
+        self._put_control((END,))
+
+    def wait_session(self, timeout: float | None = None) -> bool:
+        return self._session_done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._items:
+                    if not self._cond.wait(self.wake_interval):
+                        break  # Idle for wake_interval
+                item = self._items.popleft() if self._items else None
+                self._cond.notify_all()  # Room for a producer blocked by the "block" policy
+
+            if item is None:
+                try:
+                    self.tick()  # Outside the lock, so producers aren't held up by it
+                except Exception as e:
+                    print(f"{self.name} sink failed: {e}")
+                continue
+
+            kind = item[0]
+            try:
+                if kind == BEGIN:
+                    self.cancel_token = item[2]
+                    self.timeline = item[3]
+                    self.begin(item[1])
+                elif kind == TOKEN:
+                    if self.cancel_token.is_set():
+                        continue  # Drain whatever was queued before the stop
+                    lag = time.perf_counter() - item[2]
+                    self.total_lag += lag
+                    self.max_lag = max(self.max_lag, lag)
+                    self.tokens += 1
+                    self.consume(item[1])
+                elif kind == END:
+                    self.end(self.cancel_token.is_set())
+            except Exception as e:
+                print(f"{self.name} sink failed: {e}")
+            finally:
+                if kind == END:
+                    self._session_done.set()
+
+    def metrics(self) -> dict:
+        return {
+            "tokens": self.tokens,
+            "mean_lag_ms": round(self.total_lag / self.tokens * 1000, 2) if self.tokens else 0.0,
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "high_water": self.high_water,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+class FileSink(OutputSink):
+    """Appends every answer to a transcript file, if transcript_file is set."""
+
+    name = "file"
+
+    def enabled(self, settings) -> bool:
+        return bool(settings.get('transcript_file'))
+
+    def begin(self, settings) -> None:
+        self.file = open(settings['transcript_file'], "a", encoding="utf-8")
+
+    def consume(self, token: str) -> None:
+        self.file.write(token)
+
+    def end(self, cancelled: bool) -> None:
+        self.file.write("\n\n")
+        self.file.close()
+
+
+class OutputSession:
+    """The sinks taking part in one answer. A sink is in at most one session at a time (the caller makes sure of that,
+    e.g. the job scheduler only outputs answers with disjoint sinks at once)."""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def publish(self, token: str) -> None:
+        for sink in self.sinks:
+            sink.offer(token)
+
+    def queue_depths(self) -> dict:
+        return {sink.name: len(sink._items) for sink in self.sinks}
+
+    def end(self) -> dict:
+        """Tell the sinks the stream is over, wait for them to finish, and return their lag metrics."""
+        for sink in self.sinks:
+            sink.close_session()
+        for sink in self.sinks:
+            sink.wait_session()
+        return {sink.name: sink.metrics() for sink in self.sinks}
+
+
+class OutputPipeline:
+    """Fans the token stream out to every registered sink that is enabled for the request."""
+
+    def __init__(self):
+        self._sinks = {}   # name -> sink
+
+    def register(self, sink: OutputSink) -> None:
+        sink.start()
+        self._sinks[sink.name] = sink
+
+    def unregister(self, name: str) -> None:
+        self._sinks.pop(name, None)
+
+    def get(self, name: str) -> OutputSink | None:
+        return self._sinks.get(name)
+
+    def enabled(self, settings) -> list:
+        """The names of the sinks that would take part in a request with these settings."""
+        return [name for name, sink in self._sinks.items() if sink.enabled(settings)]
+
+    def open(self, settings, cancel_token: CancelToken, timeline=None) -> OutputSession:
+        """Start outputting one answer to every enabled sink. timeline, if given, is where the sinks mark keystrokes and
+        audio (otherwise they use the recorder's current timeline)."""
+        capacity = settings.get('output_buffer_size', 256)
+        policy = settings.get('output_backpressure', "coalesce")
+        if policy not in BACKPRESSURE_POLICIES:
+            policy = "coalesce"
+        sinks = [sink for sink in self._sinks.values() if sink.enabled(settings)]
+        for sink in sinks:
+            sink.capacity = capacity
+            sink.policy = policy
+            sink.open_session(settings, cancel_token, timeline)
+        return OutputSession(sinks)
@@ -0,0 +1,85 @@
+from output_pipeline import OutputSink
+from pacing import PacingEngine
+from speech import SentenceSegmenter
+from timeline import FIRST_AUDIO
+
+
+def clean_text(text:str) -> str:
+    """Clean the text by removing newlines and non-printable characters."""
+    # Remove newlines
+    text = text.replace('\n', ' ').replace('\r', ' ')
+    # Remove non-printable or unwanted characters
+    text = ''.join(c for c in text if c.isprintable())
+    return text.strip()
+
+
+class TypingSink(OutputSink):
+    """Types the streamed text into the focused window, paced to typing_speed_wpm.
+
+    \n\nwrite is what injects the keys: keyboard.write in the app, a recording fake in the benchmarks."""
+
+    name = "typing"
+
+    def __init__(self, write, timelines, capacity: int = 256, policy: str = "coalesce"):
+        super().__init__(capacity, policy)
+        self.write = write
+        self.timelines = timelines  # Keystrokes are marked on the current activation's timeline
+        self.pacer = None
+
+    def enabled(self, settings) -> bool:
+        return settings.get('auto_type', True) and settings.get('output_mode', "type") == "type"
+
+    def begin(self, settings) -> None:
+        self.letter_by_letter = settings.get('letter_by_letter', True)
+        if self.timeline is None:
+            self.timeline = self.timelines.current
+        # Characters are scheduled against absolute deadlines, so injection cost and sleep overshoot don't slow the WPM down
+        self.pacer = PacingEngine(settings.get('typing_speed_wpm', 200), self.inject)
+
+    def inject(self, text: str) -> None:
+        self.write(text)
+        self.timeline.keystrokes(len(text))
+
+    def consume(self, token: str) -> None:
+        self.pacer.type(token, self.cancel_token, self.letter_by_letter)
+
+    def end(self, cancelled: bool) -> None:
+        print("Typing stats:", self.pacer.stats())
+
+
+class TTSSink(OutputSink):
+    """Speaks the streamed text sentence by sentence, rendering the next sentence while the current one plays."""
+
+    name = "tts"
+
+    def __init__(self, speech, timelines, capacity: int = 256, policy: str = "coalesce"):
+        super().__init__(capacity, policy)
+        self.speech = speech  # The long-lived SpeechService
+        self.timelines = timelines
+
+    def enabled(self, settings) -> bool:
+        return settings.get('play_tts', False)
+
+    def begin(self, settings) -> None:
+        self.segmenter = SentenceSegmenter()
+        # The engine is created once and reused; only the rate/voice are (re)applied, and only if they changed
+        self.speech.configure(settings)
+        timeline = self.timeline or self.timelines.current
+        self.speech.begin_request(lambda: timeline.mark(FIRST_AUDIO))
+        self.cancel_token.on_cancel(self.speech.interrupt)  # Stops speaking immediately
+
+    def speak(self, text: str) -> None:
+        clean_sentence = clean_text(text)
+        if clean_sentence and not self.cancel_token.is_set():
+            self.speech.say(clean_sentence)
+
+    def consume(self, token: str) -> None:
+        for sentence in self.segmenter.feed(token):
+            self.speak(sentence)
+
+    def end(self, cancelled: bool) -> None:
+        # Process any remaining text
+        if not cancelled:
+            self.speak(self.segmenter.flush())
+            self.speech.mark().wait()  # Returns once everything has been spoken
+        print("TTS stats:", self.speech.stats())
@@ -0,0 +1,138 @@
+import time
+
+
+class PacingEngine:
+    """Types text at a target WPM by scheduling every character against an absolute deadline.
+
+    \n\nCharacter n is due at start + n * delay_per_char. Because deadlines are absolute, the cost of injecting a key and
+    the time a sleep overshoots don't add up over a long answer. When the schedule has fallen behind, every character
+    that is already due is sent in a single inject() call, which is what makes very high rates reachable.
+    Time spent waiting for the next token from the network doesn't count as falling behind."""
+
+    def __init__(self, typing_speed_wpm: int, inject, clock=time.perf_counter, sleep=time.sleep, max_batch: int = 64):
+        chars_per_minute = typing_speed_wpm * 5  # Approximate words per minute to characters per minute
+        self.typing_speed_wpm = typing_speed_wpm
+        self.delay_per_char = 60 / chars_per_minute  # Time per character in seconds
+        self.inject = inject  # e.g. keyboard.write, or a fake backend that records the text
+        self.clock = clock
+        self.sleep = sleep
+        self.max_batch = max_batch
+
+        self._start = None      # Deadline of the first character
+        self._typed = 0         # Characters injected so far
+        self._idle_since = None # When the previous type() call returned
+
+        # Instrumentation
+        self.inject_calls = 0
+        self.total_lateness = 0.0  # Sum over characters of (time injected - deadline)
+        self._last_inject = None
+
+    def _deadline(self, index: int) -> float:
+        return self._start + index * self.delay_per_char
+
+    def type(self, text: str, stop_event=None, letter_by_letter: bool = True) -> None:
+        """Inject text on schedule. letter_by_letter=False sends the whole text at once, then waits out its share of time."""
+        now = self.clock()
+        if self._start is None:
+            self._start = now
+        elif self._idle_since is not None:
+            # Waiting for this text to arrive isn't lag: shift the schedule by the idle time, but never ahead of now
+            behind = now - self._deadline(self._typed)
+            if behind > 0:
+                self._start += min(behind, now - self._idle_since)
+
+        position = 0
+        while position < len(text):
+            if stop_event is not None and stop_event.is_set():
+                break
+            now = self.clock()
+            wait = self._deadline(self._typed) - now
+            if wait > 0:
+                self.sleep(wait)
+                continue
+
+            if letter_by_letter:
+                # Every character whose deadline has passed goes out in the same call
+                due = int((now - self._start) / self.delay_per_char) + 1 - self._typed
+                count = max(1, min(due, self.max_batch, len(text) - position))
+            else:
+                count = len(text) - position
+            batch = text[position:position + count]
+            self.inject(batch)
+
+            injected_at = self.clock()
+            self.inject_calls += 1
+            for i in range(count):
+                self.total_lateness += injected_at - self._deadline(self._typed + i)
+            self._last_inject = injected_at
+            self._typed += count
+            position += count
+
+        if not letter_by_letter and not (stop_event is not None and stop_event.is_set()):
+            # Hold the next token back until this one's share of the schedule has passed
+            wait = self._deadline(self._typed) - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+        self._idle_since = self.clock()
+
+    @property
+    def achieved_wpm(self) -> float:
+        if self._typed < 2 or self._last_inject is None:
+            return 0.0
+        elapsed = self._last_inject - self._start
+        if elapsed <= 0:
+            return 0.0
+        return (self._typed - 1) / 5 / (elapsed / 60)  # The first character is due at elapsed = 0
+
+    def stats(self) -> dict:
+        return {
+            "target_wpm": self.typing_speed_wpm,
+            "achieved_wpm": round(self.achieved_wpm, 1),
+            "chars": self._typed,
+            "inject_calls": self.inject_calls,
+            "mean_lateness_ms": round(self.total_lateness / self._typed * 1000, 3) if self._typed else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    # Benchmark over 10k characters on a simulated clock, with Windows-like sleep overshoot and per-call injection cost.
+    import sys
+
+    class SimulatedTime:
+        def __init__(self, sleep_overshoot=0.001, inject_cost=0.0003):
+            self.now = 0.0
+            self.sleep_overshoot = sleep_overshoot
+            self.inject_cost = inject_cost
+            self.typed = []
+
+        def clock(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.now += seconds + self.sleep_overshoot
+
+        def inject(self, text):
+            self.now += self.inject_cost
+            self.typed.append(text)
+
+    total_chars = 10_000
+    text = "lorem ipsum dolor sit amet " * (total_chars // 27 + 1)
+    text = text[:total_chars]
+    for target_wpm in [int(arg) for arg in sys.argv[1:]] or [200, 1000, 2000, 5000]:
+        # What typing_worker used to do: write, then sleep a fixed delay per character
+        naive = SimulatedTime()
+        delay = 60 / (target_wpm * 5)
+        for char in text:
+            naive.inject(char)
+            naive.sleep(delay)
+        naive_wpm = (total_chars - 1) / 5 / ((naive.now - delay - naive.sleep_overshoot) / 60)
+
+        simulated = SimulatedTime()
+        engine = PacingEngine(target_wpm, simulated.inject, clock=simulated.clock, sleep=simulated.sleep)
+        for start in range(0, total_chars, 4):  # Roughly token-sized pieces
+            engine.type(text[start:start + 4])
+        assert "".join(simulated.typed) == text
+        stats = engine.stats()
+        print(f"target {target_wpm:>5} WPM | naive {naive_wpm:8.1f} WPM ({(naive_wpm / target_wpm - 1) * 100:+6.1f}%) | "
+              f"engine {stats['achieved_wpm']:8.1f} WPM ({(stats['achieved_wpm'] / target_wpm - 1) * 100:+6.1f}%), "
+              f"{stats['inject_calls']} inject calls, mean lateness {stats['mean_lateness_ms']} ms")
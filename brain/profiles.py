@@ -0,0 +1,171 @@
+import threading
+from types import MappingProxyType
+
+from key_dispatcher import parse_binding
+
+# The top-level settings are a profile of their own
+DEFAULT_PROFILE = "default"
+
+# The trigger keybinds every profile has
+ACTIONS = ("prompt", "completion")
+
+# What a profile can set for itself. Everything else (typing speed, TTS rate and voice, providers, caches, ...) is shared.
+PROFILE_FIELDS = ("model", "provider", "temperature", "max_tokens", "custom_instructions", "output_mode", "auto_type",
+                  "play_tts", "conversation_mode", "keybinds")
+
+# A named profile without keybinds of its own has no trigger, it doesn't share the default profile's
+NO_KEYBINDS = MappingProxyType({action: "" for action in ACTIONS})
+
+
+def hotkey_name(profile: str, action: str) -> str:
+    """The name a profile's trigger is registered (and timed) under: "prompt" for the default profile, "code:prompt"
+    for the prompt keybind of a profile named code."""
+    return action if profile == DEFAULT_PROFILE else f"{profile}:{action}"
+
+
+def profile_names(settings) -> list:
+    return [DEFAULT_PROFILE] + [name for name in settings.get('profiles', {}) if name != DEFAULT_PROFILE]
+
+
+def profile_settings(settings, profile: str) -> dict:
+    """The settings of one profile: the top-level settings with the profile's own fields on top."""
+    if profile == DEFAULT_PROFILE:
+        return dict(settings)
+    overrides = settings.get('profiles', {}).get(profile, {})
+    resolved = dict(settings, keybinds=NO_KEYBINDS)
+    resolved.update((field, value) for field, value in overrides.items() if field in PROFILE_FIELDS)
+    resolved['profile'] = profile
+    return resolved
+
+
+def trigger_bindings(settings) -> list:
+    """(hotkey name, keybind) of every profile's triggers, default profile first, skipping empty keybinds and any keybind
+    that an earlier trigger already uses (only the first one would ever see the key press)."""
+    bindings, taken = [], set()
+    for profile in profile_names(settings):
+        keybinds = profile_settings(settings, profile).get('keybinds', NO_KEYBINDS)
+        for action in ACTIONS:
+            path = parse_binding(keybinds.get(action, ""))
+            if path and path not in taken:
+                taken.add(path)
+                bindings.append((hotkey_name(profile, action), keybinds[action]))
+    return bindings
+
+
+def duplicate_keybinds(settings) -> list:
+    """(keybind, hotkey name, hotkey name) for every keybind used by more than one trigger. Used by the settings menu."""
+    duplicates, taken = [], {}
+    for profile in profile_names(settings):
+        keybinds = profile_settings(settings, profile).get('keybinds', NO_KEYBINDS)
+        for action in ACTIONS:
+            path = parse_binding(keybinds.get(action, ""))
+            if path in taken:
+                duplicates.append((keybinds[action], taken[path], hotkey_name(profile, action)))
+            elif path:
+                taken[path] = hotkey_name(profile, action)
+    return duplicates
+
+
+class ProfileSet:
+    """Every profile of one settings snapshot, resolved once, when the snapshot is published.
+
+    \n\nEach profile is a frozen mapping like the snapshot itself, so an activation picks its settings from the name of
+    the hotkey that was pressed with one dict lookup: no file reads, no merging, no copies on the hot path."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.profiles = {}
+        for profile in profile_names(snapshot):
+            self.profiles[profile] = snapshot if profile == DEFAULT_PROFILE else MappingProxyType(profile_settings(snapshot, profile))
+        self.bindings = trigger_bindings(snapshot)
+        # Hotkey name -> (action, the profile's settings)
+        self.triggers = {}
+        for profile, settings in self.profiles.items():
+            for action in ACTIONS:
+                self.triggers[hotkey_name(profile, action)] = (action, settings)
+
+    def resolve(self, hotkey: str) -> tuple:
+        """(action, settings) for the trigger that was pressed."""
+        trigger = self.triggers.get(hotkey)
+        if trigger is None:
+            # Pressed just before its profile was removed: use the default profile's settings
+            return hotkey.rpartition(":")[2], self.snapshot
+        return trigger
+
+
+class ProfileRegistry:
+    """Holds the ProfileSet of the current settings snapshot, swapped (like the snapshot) in one reference assignment."""
+
+    def __init__(self, snapshot=MappingProxyType({})):
+        self._lock = threading.Lock()  # Only configure() takes it, resolve() never does
+        self.current = ProfileSet(snapshot)
+        self.switches = {}  # Profile -> activations, for the stats
+
+    def configure(self, snapshot) -> ProfileSet:
+        with self._lock:
+            if snapshot is not self.current.snapshot:
+                self.current = ProfileSet(snapshot)
+        return self.current
+
+    def resolve(self, hotkey: str) -> tuple:
+        action, settings = self.current.resolve(hotkey)
+        profile = settings.get('profile', DEFAULT_PROFILE)
+        self.switches[profile] = self.switches.get(profile, 0) + 1
+        return action, settings
+
+    def stats(self) -> dict:
+        return {"profiles": list(self.current.profiles), "activations": dict(self.switches)}
+
+
+if __name__ == "__main__":
+    # Benchmark: picking the profile for an activation, with settings published from another thread meanwhile.
+    import os
+    import json
+    import time
+    import tempfile
+    from settings_service import SettingsService
+
+    settings_path = os.path.join(tempfile.mkdtemp(), "settings.json")
+    base = {"model": "gpt-4o-mini", "temperature": 1.0, "max_tokens": 256, "custom_instructions": "",
+            "keybinds": {"prompt": "right shift", "completion": "right ctrl"},
+            "profiles": {"code": {"model": "gpt-4o", "temperature": 0.2, "custom_instructions": "Answer with code only.",
+                                  "keybinds": {"prompt": "ctrl+alt+c", "completion": ""}},
+                         "email": {"custom_instructions": "Write a polite email.", "keybinds": {"prompt": "ctrl+alt+e"}},
+                         "translate": {"custom_instructions": "Translate to French.", "keybinds": {"prompt": "ctrl+alt+t"}}}}
+    with open(settings_path, "w") as file:
+        json.dump(base, file)
+    service = SettingsService(settings_path, base)
+    registry = ProfileRegistry(service.get())
+    service.subscribe(registry.configure)
+    print("triggers:", registry.current.bindings)
+    reads_before = service.file_reads
+
+    stop = threading.Event()
+
+    def keep_saving():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            service.publish(dict(base, max_tokens=i))
+            time.sleep(0.001)
+
+    saver = threading.Thread(target=keep_saving)
+    saver.start()
+    hotkeys = ["prompt", "code:prompt", "email:prompt", "translate:prompt", "completion"]
+    activations = 500_000
+    wrong_profile = 0
+    start = time.perf_counter()
+    for i in range(activations):
+        hotkey = hotkeys[i % len(hotkeys)]
+        action, settings = registry.resolve(hotkey)
+        if settings.get('profile', DEFAULT_PROFILE) != hotkey.partition(":")[0] and ":" in hotkey:
+            wrong_profile += 1
+    elapsed = time.perf_counter() - start
+    stop.set()
+    saver.join()
+
+    print(f"activations: {activations}, snapshot swaps during run: {service.swaps}")
+    print(f"file reads per activation: {(service.file_reads - reads_before) / activations}")
+    print(f"activations with the wrong profile: {wrong_profile}")
+    print(f"cost per profile switch: {elapsed / activations * 1e9:.0f} ns")
+    print("stats:", registry.stats())
@@ -0,0 +1,233 @@
+import os
+import threading
+from urllib.parse import urlparse
+
+from transport import WarmTransport, DEFAULT_BASE_URL
+from model_registry import model_registry
+
+DEFAULT_PROVIDER = "openai"
+DEFAULT_PROVIDERS = {
+    "openai": {"base_url": DEFAULT_BASE_URL, "api_key": "saved", "timeout": 600, "connect_timeout": 10},
+}
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+def provider_configs(settings) -> dict:
+    """The "providers" setting: name -> {base_url, api_key, timeout, connect_timeout, models}."""
+    return settings.get('providers') or DEFAULT_PROVIDERS
+
+
+def provider_models(name: str, config) -> list:
+    """The models offered for a provider: its "models" setting if it has one, else the model registry's listing."""
+    return list(config.get('models') or model_registry.models_for(name))
+
+
+def offers_model(name: str, config, model: str) -> bool:
+    if config.get('models'):
+        return model in config['models']
+    return model_registry.get(name, model) is not None  # O(1)
+
+
+def model_entries(settings) -> list:
+    """Every (provider, model) pair that can be selected, in settings order. Used by the settings menu."""
+    return [(name, model) for name, config in provider_configs(settings).items() for model in provider_models(name, config)]
+
+
+def provider_for_model(settings) -> str:
+    """The provider the selected model is sent to: the "provider" setting if it offers the model, else the first one that does."""
+    configs = provider_configs(settings)
+    model = settings.get('model')
+    selected = settings.get('provider', DEFAULT_PROVIDER)
+    if selected in configs and offers_model(selected, configs[selected], model):
+        return selected
+    for name, config in configs.items():
+        if offers_model(name, config, model):
+            return name
+    return selected if selected in configs else next(iter(configs))
+
+
+def resolve_api_key(auth, load_saved_key) -> str:
+    """"saved" is the key saved from the settings window, "env:NAME" reads an environment variable, "" means no auth."""
+    if auth in (None, "saved"):
+        return load_saved_key()
+    if auth.startswith("env:"):
+        return os.environ.get(auth[len("env:"):], "")
+    return auth
+
+
+class Provider:
+    """One OpenAI-compatible endpoint: its own keep-alive connection pool and async client.
+
+    \n\nBoth are created on first use, i.e. when the first request to this provider is warmed up, so that httpx and
+    the openai package aren't imported on the way to the tray icon. on_response(name, response), if given, sees the
+    headers of every response (see WarmTransport)."""
+
+    def __init__(self, name: str, config: dict, api_key: str, keepalive_ttl: float = 60.0, on_response=None):
+        self.name = name
+        self.config = config
+        self.api_key = api_key
+        self.keepalive_ttl = keepalive_ttl
+        self.on_response = on_response
+        self.base_url = config.get('base_url', DEFAULT_BASE_URL)
+        self._transport = None
+        self._client = None
+        self._lock = threading.RLock()  # The background task and the warm-up thread may both get here first
+
+    @property
+    def transport(self) -> WarmTransport:
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    on_response = None
+                    if self.on_response is not None:
+                        on_response = lambda response: self.on_response(self.name, response)
+                    self._transport = WarmTransport(base_url=self.base_url, keepalive_ttl=self.keepalive_ttl,
+                                                    timeout=self.config.get('timeout', 600),
+                                                    connect_timeout=self.config.get('connect_timeout', 10),
+                                                    on_response=on_response)
+        return self._transport
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import AsyncOpenAI  # The slowest import of the app, so it's done on first use
+                    # Local servers usually ignore the key, but the client requires one
+                    # Retries are left to the resilience layer, which also knows about timeouts and fallbacks
+                    self._client = AsyncOpenAI(api_key=self.api_key or "no-key", base_url=self.base_url,
+                                               http_client=self.transport.http_client, max_retries=0)
+        return self._client
+
+    @property
+    def is_loaded(self) -> bool:
+        """True once the client (and so the openai package) has been created."""
+        return self._client is not None
+
+    @property
+    def is_local(self) -> bool:
+        """True for a server on this machine (no TLS, no internet round trip)."""
+        return urlparse(self.base_url).hostname in LOCAL_HOSTS
+
+
+class ProviderRegistry:
+    """Builds a Provider for every entry of the "providers" setting, and rebuilds them when that setting changes.
+
+    \n\nconfigure() is subscribed to the settings service; looking a provider up never reconfigures, since the settings
+    snapshot a job was started with may be older than the registry. Replaced providers are dropped, not closed: a
+    stream started before the change may still be reading from their pool, which is released with the last reference to
+    it. on_response is handed to every provider (see Provider)."""
+
+    def __init__(self, load_saved_key, engine=None, on_response=None):
+        self.load_saved_key = load_saved_key
+        self.engine = engine
+        self.on_response = on_response
+        self._providers = {}
+        self._configuration = None
+        self._lock = threading.Lock()  # The background task and speculative requests both look providers up
+
+    def configure(self, settings) -> None:
+        configuration = (repr(provider_configs(settings)), settings.get('keepalive_ttl', 60))
+        with self._lock:
+            if configuration == self._configuration:
+                return
+            self._providers = {
+                name: Provider(name, config, resolve_api_key(config.get('api_key', "saved"), self.load_saved_key),
+                               keepalive_ttl=settings.get('keepalive_ttl', 60), on_response=self.on_response)
+                for name, config in provider_configs(settings).items()
+            }
+            self._configuration = configuration
+
+    def get(self, name: str) -> Provider:
+        return self._providers[name]
+
+    def for_settings(self, settings) -> Provider:
+        """The provider the settings' model is sent to (the first one if the settings name a provider that was removed)."""
+        if self._configuration is None:
+            self.configure(settings)  # Used without a settings service (benches, demos): built on first use
+        providers = self._providers  # Swapped whole, so reading it needs no lock
+        return providers.get(provider_for_model(settings)) or next(iter(providers.values()))
+
+    def warm_up(self, settings) -> Provider:
+        """Open a connection to the settings' provider while the user types, creating its client first if needed.
+
+        \n\nThe first time, creating the client imports the openai package, so that's done on a separate thread."""
+        provider = self.for_settings(settings)
+
+        def warm():
+            provider.client
+            if self.engine is not None:
+                self.engine.warm_up(provider.transport)
+
+        if provider.is_loaded:
+            warm()
+        else:
+            threading.Thread(target=warm, daemon=True, name="provider-warm-up").start()
+        return provider
+
+    def stats(self) -> dict:
+        return {name: provider._transport.stats() for name, provider in self._providers.items() if provider._transport is not None}
+
+
+if __name__ == "__main__":
+    # End to end against a local OpenAI-compatible mock server: the "local" model goes to localhost over plain HTTP,
+    # with no key, while the OpenAI models stay on the OpenAI provider.
+    import json
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from stream_engine import StreamEngine
+    from response_cache import chunk_text
+
+    requests_seen = []
+
+    class LocalServerHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            requests_seen.append((self.path, body["model"], self.headers.get("Authorization")))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in ["Hello ", "from ", "the ", "local ", "model."]:
+                event = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                         "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                data = f"data: {json.dumps(event)}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            done = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalServerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    settings = {
+        "model": "local-model",
+        "provider": "openai",  # Doesn't offer local-model, so the model's own provider is used
+        "providers": {
+            "openai": DEFAULT_PROVIDERS["openai"],
+            "local": {"base_url": f"http://127.0.0.1:{server.server_address[1]}/v1/", "api_key": "",
+                      "timeout": 30, "connect_timeout": 1, "models": ["local-model"]},
+        },
+    }
+    engine = StreamEngine()
+    registry = ProviderRegistry(lambda: "saved-openai-key", engine)
+    print("selectable:", [f"{model} ({name})" for name, model in model_entries(settings)][-3:])
+
+    provider = registry.for_settings(settings)
+    print(f"local-model -> {provider.name} at {provider.base_url} (local: {provider.is_local})")
+    for attempt in ("cold", "warm"):
+        started = time.perf_counter()
+        handle = engine.stream(provider.client.chat.completions.create, model=settings["model"], stream=True,
+                               messages=[{"role": "user", "content": "hi"}], max_tokens=16)
+        text = ''.join(chunk_text(chunk) or "" for chunk in handle)
+        print(f"{attempt}: {text!r} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print("server saw:", requests_seen[-1])
+    print("openai model ->", registry.for_settings(dict(settings, model="gpt-4o-mini")).name)
+    print("connections:", registry.stats()["local"])
+    engine.shutdown()
+    server.shutdown()
@@ -0,0 +1,244 @@
+import re
+import json
+import time
+import threading
+
+from conversation import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+from resilience import retry_after_seconds
+
+# The durations of the x-ratelimit-reset-* headers: "20ms", "1.5s", "6m0s", "1h2m3s"
+RESET_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+RESET_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# The rate-limit headers that name a request's model (any of them means the response is worth parsing)
+LIMIT_HEADERS = ("x-ratelimit-limit-requests", "x-ratelimit-limit-tokens")
+
+
+def parse_reset(value) -> float | None:
+    """Seconds until a rate-limit bucket is full again, from an x-ratelimit-reset-* header."""
+    if not value:
+        return None
+    parts = RESET_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * RESET_UNITS[unit] for number, unit in parts)
+
+
+def request_cost(texts, max_tokens: int) -> int:
+    """The tokens a request counts against a tokens-per-minute limit: its messages (estimated locally) plus max_tokens,
+    which the provider reserves up front whatever the answer's length turns out to be."""
+    return sum(estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS for text in texts if text) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """One rate limit: capacity units that refill at rate units per second. The level can go below zero (requests sent
+    on the strength of a stale estimate), which the next requests then wait off."""
+    __slots__ = ("capacity", "rate", "level", "updated")
+
+    def __init__(self, capacity: float, rate: float, level: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = level
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (until the bucket is full, for more than it holds)."""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 and self.rate > 0 else 0.0
+
+    def utilization(self, now: float) -> float:
+        self.refill(now)
+        return min(1.0, max(0.0, 1 - self.level / self.capacity)) if self.capacity else 0.0
+
+
+class ModelBudget:
+    """The request and token buckets of one model on one provider, as last reported by the provider."""
+    __slots__ = ("requests", "tokens", "blocked_until")
+
+    def __init__(self):
+        self.requests = None      # TokenBucket, once the provider has sent x-ratelimit-*-requests headers
+        self.tokens = None        # TokenBucket, once it has sent x-ratelimit-*-tokens headers
+        self.blocked_until = 0.0  # After a 429, the clock time its Retry-After points to
+
+    def wait_for(self, cost: int, now: float) -> float:
+        waits = [self.blocked_until - now]
+        if self.requests is not None:
+            waits.append(self.requests.wait_for(1, now))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_for(cost, now))
+        return max(0.0, *waits)
+
+
+class RateLimiter:
+    """A client-side view of each model's rate limits, so a request that would be rejected with a 429 is held briefly
+    or sent to a cheaper model instead.
+
+    \n\nThe limits are learned from the x-ratelimit-* headers of every response (observe_response() is the transports'
+    response hook), which also bring the buckets back in line with the provider's own count. In between, admit()
+    charges each request's estimated cost to its buckets. Models whose limits aren't known yet are never held."""
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self._budgets = {}  # (provider, model) -> ModelBudget
+        self._lock = threading.Lock()
+
+        # Instrumentation
+        self.admitted = 0
+        self.held = 0
+        self.held_seconds = 0.0
+        self.rerouted = 0
+        self.rejections_seen = 0  # 429s the provider answered with anyway
+
+    def observe(self, provider: str, model: str, headers, status: int = 200) -> None:
+        """Learn the model's limits and remaining budget from a response's headers."""
+        now = self.clock()
+        with self._lock:
+            budget = self._budgets.setdefault((provider, model), ModelBudget())
+            for kind in ("requests", "tokens"):
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                    remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if limit <= 0:
+                    continue
+                # The limits are per minute; the reset time, when the bucket isn't full, gives the actual refill rate
+                reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                rate = (limit - remaining) / reset if reset and remaining < limit else limit / 60
+                setattr(budget, kind, TokenBucket(limit, rate, remaining, now))
+            if status == 429:
+                self.rejections_seen += 1
+                wait = retry_after_seconds(headers)
+                if wait is not None:
+                    budget.blocked_until = max(budget.blocked_until, now + wait)
+
+    def observe_response(self, provider: str, response) -> None:
+        """The transports' response hook (an httpx response, on the stream engine's loop, before the body is read)."""
+        headers = response.headers
+        if response.status_code != 429 and not any(name in headers for name in LIMIT_HEADERS):
+            return  # A server without rate-limit headers (e.g. a local one): nothing to learn
+        try:
+            model = json.loads(response.request.content).get("model")
+        except (ValueError, AttributeError, TypeError):
+            return
+        if model:
+            self.observe(provider, model, headers, response.status_code)
+
+    def wait_time(self, provider: str, model: str, cost: int) -> float:
+        """Seconds until the model has room for a request of cost tokens (0 if now, or if its limits aren't known)."""
+        with self._lock:
+            budget = self._budgets.get((provider, model))
+            return budget.wait_for(cost, self.clock()) if budget is not None else 0.0
+
+    def _charge(self, provider: str, model: str, cost: int) -> None:
+        with self._lock:
+            budget = self._budgets.get((provider, model))
+            if budget is None:
+                return
+            now = self.clock()
+            if budget.requests is not None:
+                budget.requests.refill(now)
+                budget.requests.level -= 1
+            if budget.tokens is not None:
+                budget.tokens.refill(now)
+                budget.tokens.level -= cost
+
+    def admit(self, routes: list, cost: int, max_wait: float) -> int:
+        """Pick where a request of cost tokens goes, from routes [(provider, model), ...] (the selected model first,
+        then cheaper ones), and charge it there. Returns the index of the route.
+
+        \n\nThe selected model is used if it has room now, else the first cheaper one that does. If none does, the
+        request is held (on the calling thread) until the selected model has room, but never for longer than max_wait
+        seconds: then it's sent anyway, and a 429 is left to the resilience layer's retries."""
+        for index, (provider, model) in enumerate(routes):
+            if self.wait_time(provider, model, cost) == 0:
+                if index:
+                    self.rerouted += 1
+                    print(f"{routes[0][1]} is at its rate limit, sending the request to {model}")
+                self._charge(provider, model, cost)
+                self.admitted += 1
+                return index
+        provider, model = routes[0]
+        wait = min(self.wait_time(provider, model, cost), max_wait)
+        print(f"{model} is at its rate limit, holding the request for {wait * 1000:.0f} ms")
+        self.held += 1
+        self.held_seconds += wait
+        self.sleep(wait)
+        self._charge(provider, model, cost)
+        self.admitted += 1
+        return 0
+
+    def utilization(self) -> dict:
+        """The share of each known limit in use right now: {"provider/model": {"requests": 0.25, "tokens": 0.9}}."""
+        now = self.clock()
+        with self._lock:
+            return {f"{provider}/{model}": {kind: round(getattr(budget, kind).utilization(now), 2)
+                                            for kind in ("requests", "tokens") if getattr(budget, kind) is not None}
+                    for (provider, model), budget in self._budgets.items()}
+
+    def summary_text(self) -> str:
+        """The busiest limit of each model, for the tray tooltip ("" until a provider has sent rate-limit headers)."""
+        lines = []
+        for name, kinds in self.utilization().items():
+            if kinds:
+                kind, used = max(kinds.items(), key=lambda item: item[1])
+                lines.append(f"{name.split('/', 1)[1]}: {used * 100:.0f}% of {kind}/min")
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "held": self.held,
+            "held_ms": round(self.held_seconds * 1000),
+            "rerouted": self.rerouted,
+            "rejections_seen": self.rejections_seen,
+            "utilization": self.utilization(),
+        }
+
+
+if __name__ == "__main__":
+    # A burst of requests against a mock server with a small tokens-per-minute limit: sent as they come (as before),
+    # then through the rate limiter, holding requests or moving them to a cheaper model instead of collecting 429s.
+    from stream_engine import StreamEngine
+    from providers import Provider
+    from response_cache import chunk_text
+    from bench.mock_server import MockOpenAIServer
+
+    MAX_TOKENS = 60
+    BURST = 16
+
+    def run_burst(limiter, routes, max_wait):
+        server = MockOpenAIServer(ttft_ms=20, gap_ms=1, tokens=10, rpm=600, tpm=900).start()
+        engine = StreamEngine()
+        provider = Provider("mock", {"base_url": server.url}, "key", on_response=limiter.observe_response if limiter else None)
+        answered, rejected = 0, 0
+        started = time.perf_counter()
+        for n in range(BURST):
+            messages = [{"role": "user", "content": f"Question number {n}, asked in a hurry."}]
+            index = limiter.admit(routes, request_cost([m["content"] for m in messages], MAX_TOKENS), max_wait) if limiter else 0
+            handle = engine.stream(provider.client.chat.completions.create, model=routes[index][1], messages=messages,
+                                   stream=True, max_tokens=MAX_TOKENS)
+            text = ''.join(chunk_text(chunk) or '' for chunk in handle)
+            if handle.error is not None:
+                rejected += 1
+            elif text:
+                answered += 1
+        elapsed = time.perf_counter() - started
+        engine.shutdown()
+        server.stop()
+        return answered, rejected, elapsed
+
+    for name, limiter, routes, max_wait in (
+            ("unmanaged", None, [("mock", "big-model")], 0),
+            ("hold (up to 5 s)", RateLimiter(), [("mock", "big-model")], 5),
+            ("cheaper model", RateLimiter(), [("mock", "big-model"), ("mock", "small-model")], 5)):
+        answered, rejected, elapsed = run_burst(limiter, routes, max_wait)
+        print(f"{name:>17}: {answered}/{BURST} answered, {rejected} rejected with 429, {elapsed:.1f} s")
+        if limiter is not None:
+            print(f"{'':>17}  {limiter.stats()}")
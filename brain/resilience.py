@@ -0,0 +1,359 @@
+import time
+import random
+import threading
+from queue import Queue, Empty
+from collections import namedtuple
+
+from response_cache import chunk_text
+
+_DONE = object()  # An attempt's stream has ended
+
+# One way of answering a request: a label for the logs ("primary", "fallback"), the endpoint its circuit breaker is
+# kept for (the provider's name), and a factory that starts the request and returns an iterable stream.
+Candidate = namedtuple("Candidate", ["label", "endpoint", "factory"])
+
+# HTTP statuses worth trying again: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUSES = (408, 409, 429)
+
+# Errors without a status that are worth trying again, matched by name so the openai and httpx packages don't have to
+# be imported here: connection failures and timeouts, and a connection dropped in the middle of a response
+RETRYABLE_ERRORS = ("APIConnectionError", "APITimeoutError", "TransportError", "TimeoutException", "StreamTimeout",
+                    "ConnectionError", "TimeoutError")
+
+
+class StreamTimeout(Exception):
+    """No first token, or no next token, within its timeout."""
+
+
+def is_retryable(error) -> bool:
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def retry_after_seconds(headers) -> float | None:
+    """The wait a response's retry-after-ms or Retry-After header asks for, in seconds, if it has one."""
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def retry_after(error) -> float | None:
+    """The seconds a 429/503 response asked to wait, if any."""
+    return retry_after_seconds(getattr(getattr(error, 'response', None), 'headers', None))
+
+
+def describe(error) -> str:
+    """A short description for the logs and the tray: "429 Rate limit reached ...", "no first token within 20 s", ..."""
+    status = getattr(error, 'status_code', None)
+    body = getattr(error, 'body', None)
+    if status is not None and isinstance(body, dict) and body.get('message'):
+        return f"{status} {body['message']}"
+    return str(error) or type(error).__name__
+
+
+class RetryPolicy:
+    """Timeouts and retries of one activation, from its settings."""
+
+    def __init__(self, first_token_timeout: float = 20.0, inter_token_timeout: float = 10.0, max_retries: int = 2,
+                 base_delay: float = 0.25, max_delay: float = 4.0, rng=random):
+        self.first_token_timeout = first_token_timeout
+        self.inter_token_timeout = inter_token_timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng
+
+    @classmethod
+    def from_settings(cls, settings) -> "RetryPolicy":
+        return cls(first_token_timeout=settings.get('first_token_timeout', 20),
+                   inter_token_timeout=settings.get('inter_token_timeout', 10),
+                   max_retries=settings.get('max_retries', 2),
+                   base_delay=settings.get('retry_base_ms', 250) / 1000,
+                   max_delay=settings.get('retry_max_ms', 4000) / 1000)
+
+    def delay(self, retry: int, error) -> float:
+        """Full jitter: a random wait up to base_delay * 2^retry (capped), or what the server asked for if it did."""
+        asked = retry_after(error)
+        if asked is not None:
+            return min(asked, self.max_delay)
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint after failure_threshold consecutive failures, for cooldown seconds.
+
+    \n\nAfter the cooldown a single trial request is let through (half-open): its success closes the circuit again,
+    its failure opens it for another cooldown."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                return True  # The one trial request
+            return self.state == self.CLOSED
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class ResilientStream:
+    """Streams the answer of the first candidate that produces one, within the policy's timeouts and retries.
+
+    \n\nEach attempt is read by its own thread into a queue, so the consumer never blocks longer than the first-token
+    or inter-token timeout: a stalled stream is cancelled instead of holding up the background task. An attempt that
+    fails before its first token is retried (retryable errors, with jittered backoff) and then fails over to the next
+    candidate. Once tokens have been passed on, a failure ends the stream (retrying would type the answer twice).
+    The first attempt starts right away, so a speculative request is sent as early as before. cancel() is thread-safe."""
+
+    def __init__(self, layer: "ResilientRequests", candidates: list, policy: RetryPolicy):
+        self.layer = layer
+        self.candidates = candidates
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._current = None          # The attempt's response, to cancel it
+        self._attempt = 0             # Bumped for every attempt started or abandoned, so a late response is cancelled
+        self.started_ns = time.perf_counter_ns()
+        self.error = None             # Why there is no (complete) answer, once iteration has ended
+        self.attempts = []            # (candidate label, outcome) of every attempt, for the logs
+        self.fallback_used = False
+        self.cut_off = False          # The answer stopped part-way
+        self._first = self._start(candidates[0]) if candidates and layer.breaker(candidates[0].endpoint).allow() else None
+
+    def _start(self, candidate: Candidate) -> Queue:
+        events = Queue()
+        with self._lock:
+            self._attempt += 1
+            attempt = self._attempt
+        threading.Thread(target=self._read, args=(candidate, events, attempt), daemon=True,
+                         name=f"resilient-{candidate.label}").start()
+        return events
+
+    def _read(self, candidate: Candidate, events: Queue, attempt: int) -> None:
+        error = None
+        try:
+            response = candidate.factory()
+            if response is None:
+                raise RuntimeError("The request could not be started")
+            with self._lock:
+                abandoned = self._cancel_event.is_set() or attempt != self._attempt
+                if not abandoned:
+                    self._current = response
+            if abandoned:
+                response.cancel()  # Timed out (or cancelled) before the request was even sent
+            for chunk in response:
+                events.put(chunk)
+            error = getattr(response, 'error', None)
+        except Exception as e:
+            error = e
+        events.put((_DONE, error))
+
+    def _cancel_current(self) -> None:
+        with self._lock:
+            response, self._current = self._current, None
+            self._attempt += 1  # Abandon the current attempt, even if its response hasn't been created yet
+        if response is not None and hasattr(response, 'cancel'):
+            response.cancel()
+
+    def __iter__(self):
+        try:
+            yield from self._iterate()
+        except GeneratorExit:
+            self.cancel()
+            raise
+
+    def _iterate(self):
+        error = None
+        for position, candidate in enumerate(self.candidates):
+            breaker = self.layer.breaker(candidate.endpoint)
+            if position > 0:
+                if not breaker.allow():
+                    self.attempts.append((candidate.label, "circuit open"))
+                    continue
+                self.fallback_used = True
+            elif self._first is None:
+                self.attempts.append((candidate.label, "circuit open"))
+                continue
+            for retry in range(self.policy.max_retries + 1):
+                if retry:
+                    delay = self.policy.delay(retry - 1, error)
+                    print(f"Retrying the {candidate.label} request in {delay * 1000:.0f} ms ({describe(error)})")
+                    if self._cancel_event.wait(delay):
+                        return
+                events = self._first if position == 0 and retry == 0 else self._start(candidate)
+                tokens, error = 0, None
+                timeout = self.policy.first_token_timeout
+                while True:
+                    try:
+                        event = events.get(timeout=timeout)
+                    except Empty:
+                        error = StreamTimeout(f"no {'next' if tokens else 'first'} token within {timeout:g} s")
+                        self._cancel_current()
+                        break
+                    if isinstance(event, tuple) and event and event[0] is _DONE:
+                        error = event[1]
+                        break
+                    if chunk_text(event):
+                        tokens += 1
+                        timeout = self.policy.inter_token_timeout
+                    yield event
+                if self._cancel_event.is_set():
+                    return  # Stopped by the user, not a failure
+                if error is None:
+                    breaker.record_success()
+                    self.attempts.append((candidate.label, "ok"))
+                    self.layer.record(self)
+                    return
+                breaker.record_failure()
+                self.attempts.append((candidate.label, describe(error)))
+                if tokens:
+                    # Part of the answer has been typed already
+                    self.cut_off = True
+                    self.error = error
+                    self.layer.failed(self, f"The answer was cut off: {describe(error)}")
+                    return
+                if not is_retryable(error) or not breaker.allow():
+                    break  # Try the next candidate (e.g. a model the provider doesn't serve, or the circuit just opened)
+        self.error = error or RuntimeError("every endpoint's circuit is open")
+        self.layer.failed(self, f"No answer: {describe(self.error)}")
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+        self._cancel_current()
+
+    close = cancel
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+
+class ResilientRequests:
+    """Keeps a circuit breaker per endpoint and counts outcomes across activations; stream() wraps one request.
+
+    \n\non_error(title, message) is called when an activation ends without a complete answer (backgroundai shows it as
+    a tray notification)."""
+
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.failure_threshold = 3
+        self.cooldown = 30.0
+
+        # Instrumentation
+        self.streams = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.cut_offs = 0
+
+    def configure(self, settings) -> None:
+        self.failure_threshold = settings.get('circuit_failures', 3)
+        self.cooldown = settings.get('circuit_cooldown', 30)
+        for breaker in list(self._breakers.values()):
+            breaker.failure_threshold, breaker.cooldown = self.failure_threshold, self.cooldown
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(self.failure_threshold, self.cooldown))
+        return breaker
+
+    def stream(self, candidates: list, settings) -> ResilientStream:
+        """Start the first candidate's request, with the settings' timeouts, retries and circuit breaker settings."""
+        self.configure(settings)
+        self.streams += 1
+        return ResilientStream(self, candidates, RetryPolicy.from_settings(settings))
+
+    def record(self, stream: ResilientStream) -> None:
+        self.retries += max(0, len(stream.attempts) - 1)
+        self.fallbacks += stream.fallback_used
+
+    def failed(self, stream: ResilientStream, message: str) -> None:
+        self.record(stream)
+        self.failures += 1
+        self.cut_offs += stream.cut_off
+        print(f"{message} (attempts: {stream.attempts})")
+        if self.on_error is not None:
+            try:
+                self.on_error("KeyGenie request failed", message)
+            except Exception as e:
+                print(f"Could not show the error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "streams": self.streams,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "cut_offs": self.cut_offs,
+            "circuits": {endpoint: breaker.state for endpoint, breaker in self._breakers.items()},
+        }
+
+
+if __name__ == "__main__":
+    # Against local mock servers that inject errors: retries, the stall watchdog, a cut-off, the circuit breaker and
+    # the fallback model.
+    from stream_engine import StreamEngine
+    from providers import Provider
+    from bench.mock_server import MockOpenAIServer
+
+    engine = StreamEngine()
+    fallback_server = MockOpenAIServer(ttft_ms=50, gap_ms=2, tokens=20).start()
+    fallback = Provider("fallback", {"base_url": fallback_server.url}, "key")
+    fallback.client  # Imports openai, so the first case isn't timed with it
+    notifications = []
+    layer = ResilientRequests(on_error=lambda title, message: notifications.append(message))
+    settings = {"first_token_timeout": 1, "inter_token_timeout": 0.3, "max_retries": 2, "retry_base_ms": 50,
+                "retry_max_ms": 400, "circuit_failures": 3, "circuit_cooldown": 60}
+
+    def request(provider):
+        return lambda: engine.stream(provider.client.chat.completions.create, model="mock", stream=True, max_tokens=20,
+                                     messages=[{"role": "user", "content": "hi"}])
+
+    for script in ("503,429,ok", "delay:3000,ok", "stall:5", "disconnect:5", "500,500,500", "ok"):
+        server = MockOpenAIServer(ttft_ms=50, gap_ms=2, tokens=20, script=script).start()
+        # The stall and the disconnect count as failures too, so the 500 opens the circuit and the last request goes
+        # straight to the fallback
+        primary = Provider("primary", {"base_url": server.url}, "key")
+        started = time.perf_counter()
+        stream = layer.stream([Candidate("primary", "primary", request(primary)),
+                               Candidate("fallback", "fallback", request(fallback))], settings)
+        text = ''.join(chunk_text(chunk) or '' for chunk in stream)
+        print(f"{script:>14}: {len(text.split()):>2} words in {(time.perf_counter() - started) * 1000:6.0f} ms, "
+              f"attempts {stream.attempts}")
+        server.stop()
+    print("notifications:", notifications)
+    print("stats:", layer.stats())
+    fallback_server.stop()
+    engine.shutdown()
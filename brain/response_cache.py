@@ -0,0 +1,177 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from types import SimpleNamespace
+
+# Splits cached text back into word-sized pieces, so replaying it looks like a stream to the typing and TTS workers
+REPLAY_PIECES = re.compile(r"\S+\s*|\s+")
+
+
+def chunk_text(chunk) -> str | None:
+    """Return the text carried by a streamed chunk (chat or legacy completion), or None."""
+    if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
+        choice = chunk.choices[0]
+        if hasattr(choice, 'delta') and hasattr(choice.delta, 'content'):
+            return choice.delta.content  # Chat completion response
+        elif hasattr(choice, 'text'):
+            return choice.text  # Legacy completion response
+    return None
+
+
+class ResponseCache:
+    """An on-disk (SQLite) cache of complete responses, keyed on everything that determines the model's output.
+
+    \n\nEntries are evicted least-recently-used first once the stored text exceeds max_bytes. Responses sampled with
+    temperature > 0 are only cached if the user opts in with the cache_nonzero_temperature setting, since replaying
+    them removes the variation they asked for."""
+
+    def __init__(self, path: str, max_bytes: int = 20 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        self._db.commit()
+        # Hit/miss counters and last-used times of hits, kept in memory so a lookup never writes to disk; they're
+        # written out with the next put() and on close()
+        self._pending_stats = {}
+        self._touched = {}
+
+    @staticmethod
+    def make_key(model: str, custom_instructions: str, prompt: str, temperature: float, max_tokens: int) -> str:
+        key_material = json.dumps([model, custom_instructions, prompt, float(temperature), int(max_tokens)])
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(settings) -> bool:
+        """Deterministic requests are always cacheable, sampled ones only when the user opted in."""
+        if not settings.get('response_cache', True) or settings.get('conversation_mode', False):
+            return False  # In conversation mode the answer also depends on the earlier turns
+        return settings.get('temperature', 1.0) == 0 or settings.get('cache_nonzero_temperature', False)
+
+    def _bump(self, name: str, amount: int) -> None:
+        self._pending_stats[name] = self._pending_stats.get(name, 0) + amount
+
+    def _write_pending(self) -> None:
+        """Write the in-memory counters and last-used times out (with the lock held; the caller commits)."""
+        for name, amount in self._pending_stats.items():
+            self._db.execute("INSERT INTO stats (name, value) VALUES (?, ?) "
+                             "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, amount))
+        self._db.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                             [(last_used, key) for key, last_used in self._touched.items()])
+        self._pending_stats, self._touched = {}, {}
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response text for key, or None on a miss. Only reads from disk."""
+        with self._lock:
+            row = self._db.execute("SELECT text, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._bump("misses", 1)
+                return None
+            text, size = row
+            self._touched[key] = time.time()
+            self._bump("hits", 1)
+            self._bump("bytes_saved", size)
+            return text
+
+    def put(self, key: str, text: str) -> None:
+        """Store a complete response, then evict the least recently used entries until the cache fits in max_bytes."""
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._write_pending()
+            self._db.execute("INSERT OR REPLACE INTO responses (key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                             (key, text, size, time.time()))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, old_size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= old_size
+                    if total <= self.max_bytes:
+                        break
+            self._db.commit()
+
+    def replay(self, text: str):
+        """Yield the cached text as chat-completion-shaped chunks, so it goes through the normal streaming path."""
+        for piece in REPLAY_PIECES.findall(text):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    def record(self, key: str, response, keep=None) -> "RecordingStream":
+        """Wrap a live stream so its full text is stored once it has been read to the end. keep(), if given, is asked
+        then whether the answer belongs under key (e.g. False when a backup model answered instead)."""
+        return RecordingStream(self, key, response, keep)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+            for name, amount in self._pending_stats.items():
+                counters[name] = counters.get(name, 0) + amount
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "bytes_saved": counters.get("bytes_saved", 0),
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_pending()
+            self._db.commit()
+            self._db.close()
+
+
+class RecordingStream:
+    """Passes a live stream through unchanged, and stores the full text in the cache once it has been read to the end.
+
+    \n\nIf the stream is cancelled or the consumer stops early (the user interrupted the output) the partial response
+    is not cached, nor is one that keep() rejects."""
+
+    def __init__(self, cache: ResponseCache, key: str, response, keep=None):
+        self.cache = cache
+        self.key = key
+        self.response = response
+        self.keep = keep
+        self._cancelled = False
+
+    def __iter__(self):
+        pieces = []
+        try:
+            for chunk in self.response:
+                text = chunk_text(chunk)
+                if text:
+                    pieces.append(text)
+                yield chunk
+        except GeneratorExit:
+            self.cancel()
+            raise
+        if pieces and not self._cancelled and not getattr(self.response, 'cancelled', False) \
+                and not getattr(self.response, 'error', None) and (self.keep is None or self.keep()):
+            self.cache.put(self.key, ''.join(pieces))
+
+    def cancel(self) -> None:
+        """Thread-safe: forwards to the underlying stream, which stops it right away."""
+        self._cancelled = True
+        if hasattr(self.response, 'cancel'):
+            self.response.cancel()
+
+    close = cancel
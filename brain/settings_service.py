@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import threading
+from types import MappingProxyType
+
+
+def freeze(value):
+    """Return a read-only copy of a parsed settings value (dicts become mappingproxies, lists become tuples)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Return a plain, mutable deep copy of a frozen settings value (for the settings menu to edit)."""
+    if isinstance(value, MappingProxyType) or isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class SettingsService:
+    """Holds one parsed, immutable snapshot of settings.json and swaps it atomically when the file changes.
+
+    \n\nReaders call get(), which only returns the current reference, so the hot path never touches the disk.
+    Writers (the settings menu, or the file watcher) build a whole new snapshot and replace the reference in one step,
+    so a reader can never see the prompt keybind from one version and the completion keybind from another."""
+
+    def __init__(self, settings_file: str, default_settings: dict, poll_interval: float = 0.5):
+        self.settings_file = settings_file
+        self.default_settings = default_settings
+        self.poll_interval = poll_interval
+
+        self._write_lock = threading.Lock()  # Only writers take the lock, readers never do
+        self._subscribers = []
+        self._watcher_thread = None
+        self._stop_watching = threading.Event()
+
+        # Counters, so it can be checked that activations do no file I/O
+        self.file_reads = 0
+        self.swaps = 0
+
+        self._mtime = None
+        self._snapshot = freeze(default_settings)
+        self.reload()
+
+    def get(self) -> MappingProxyType:
+        """Return the current settings snapshot. O(1), no locking, no file access."""
+        return self._snapshot
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.settings_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self) -> MappingProxyType:
+        """Re-read settings.json from disk and publish it as the new snapshot."""
+        with self._write_lock:
+            mtime = self._file_mtime()
+            if mtime is None:
+                settings = self.default_settings
+            else:
+                try:
+                    with open(self.settings_file, "r") as file:
+                        settings = json.load(file)
+                    self.file_reads += 1
+                except (OSError, ValueError) as e:
+                    # A half-written file (e.g. caught mid-save by another program), keep the current snapshot
+                    print(f"Could not read settings file: {e}")
+                    return self._snapshot
+            self._mtime = mtime
+            self._swap(settings)
+        return self._snapshot
+
+    def publish(self, settings: dict) -> MappingProxyType:
+        """Publish settings that were just saved (by SettingsWindow) without reading them back from disk."""
+        with self._write_lock:
+            self._mtime = self._file_mtime()  # Don't let the watcher re-read the file we just wrote
+            self._swap(settings)
+        return self._snapshot
+
+    def _swap(self, settings: dict) -> None:
+        snapshot = freeze(settings)
+        self._snapshot = snapshot  # A single reference assignment, which is atomic for readers
+        self.swaps += 1
+        for callback in list(self._subscribers):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Settings subscriber failed: {e}")
+
+    def subscribe(self, callback) -> None:
+        """Call callback(snapshot) every time a new snapshot is published."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback) -> None:
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def start_watching(self) -> None:
+        """Start a daemon thread that reloads the snapshot whenever settings.json's mtime changes."""
+        if self._watcher_thread is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher_thread = threading.Thread(target=self._watch, daemon=True)
+        self._watcher_thread.start()
+
+    def stop_watching(self) -> None:
+        self._stop_watching.set()
+        if self._watcher_thread is not None:
+            self._watcher_thread.join()
+            self._watcher_thread = None
+
+    def _watch(self) -> None:
+        # A stat() call every poll_interval is enough here, the file only changes when the user edits settings
+        while not self._stop_watching.wait(self.poll_interval):
+            if self._file_mtime() != self._mtime:
+                self.reload()
+
+
+
+# File paths for saving settings
+PRIVATE_FOLDER = os.path.join(os.path.expanduser("~"), "privateVariables")
+API_KEY_FILE = os.path.join(PRIVATE_FOLDER, "apikey.txt")
+SETTINGS_FILE = os.path.join(PRIVATE_FOLDER, "settings.json")
+
+# Found next to this file, whatever the working directory the app was started from
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "defaultSettings.json"), "r") as file: DEFAULT_SETTINGS = json.load(file)
+
+# The single in-memory copy of settings.json shared by the menu and the background task
+settings_service = SettingsService(SETTINGS_FILE, DEFAULT_SETTINGS)
+
+
+def load_or_create_api_key() -> str:
+    """Load or create an API key."""
+    if not os.path.exists(PRIVATE_FOLDER):
+        os.makedirs(PRIVATE_FOLDER)
+
+    if os.path.exists(API_KEY_FILE):
+        with open(API_KEY_FILE, "r") as file:
+            api_key = file.read().strip()
+        if api_key:
+            return api_key
+    return ""
+
+if __name__ == "__main__":
+    # Benchmark: activations read the snapshot while another thread keeps saving new keybinds.
+    import tempfile
+
+    settings_path = os.path.join(tempfile.mkdtemp(), "settings.json")
+    with open(settings_path, "w") as file:
+        json.dump({"keybinds": {"prompt": "a0", "completion": "b0"}}, file)
+
+    service = SettingsService(settings_path, {"keybinds": {"prompt": "right shift", "completion": "right ctrl"}})
+    reads_before = service.file_reads
+    stop = threading.Event()
+
+    def keep_saving():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            service.publish({"keybinds": {"prompt": f"a{i}", "completion": f"b{i}"}})
+
+    saver = threading.Thread(target=keep_saving)
+    saver.start()
+
+    activations = 200_000
+    torn_reads = 0
+    start = time.perf_counter()
+    for _ in range(activations):
+        keybinds = service.get()["keybinds"]
+        if keybinds["prompt"][1:] != keybinds["completion"][1:]:
+            torn_reads += 1
+    elapsed = time.perf_counter() - start
+    stop.set()
+    saver.join()
+
+    print(f"activations: {activations}, snapshot swaps during run: {service.swaps}")
+    print(f"file reads per activation: {(service.file_reads - reads_before) / activations}")
+    print(f"torn keybind reads: {torn_reads}")
+    print(f"cost per get(): {elapsed / activations * 1e9:.0f} ns")
@@ -144,7 +144,7 @@ DEFAULT_KEYBINDS = {
 }
 
 DEFAULT_MODEL = "gpt-3.5-turbo"
-with open(os.path.join("brain","defaultSettings.json"), "r") as file: DEFAULT_SETTINGS = json.load(file)
+with open(os.path.join(script_directory, "defaultSettings.json"), "r") as file: DEFAULT_SETTINGS = json.load(file)
 
 # Ensure the private variables folder exists
 if not os.path.exists(PRIVATE_FOLDER):
@@ -165,6 +165,7 @@ if not os.path.exists(SETTINGS_FILE):
 
 # ----------------------------------------------------------------------
 
-# Run the background script with pythonw.exe
-print("Running backgroundai.py with pythonw.exe...")
-subprocess.Popen([pythonw_executable, background_script_path])
+# Run the background script with pythonw.exe, unless RUN.py is going to run it in its own process
+if "--no-launch" not in sys.argv:
+    print("Running backgroundai.py with pythonw.exe...")
+    subprocess.Popen([pythonw_executable, background_script_path])
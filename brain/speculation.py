@@ -0,0 +1,151 @@
+import time
+import threading
+from queue import Queue
+
+from response_cache import chunk_text
+
+_DONE = object()  # Marks the end of a speculative stream's buffer
+
+
+class SpeculativeStream:
+    """A request started in the background on a partial prompt. Its chunks are buffered until the final prompt is known."""
+
+    def __init__(self, prompt: str, response_factory):
+        self.prompt = prompt
+        self.started_ns = time.perf_counter_ns()  # When the request was sent
+        self.tokens = 0  # Chunks with text received so far
+        self._buffer = Queue()
+        self._response = None
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(response_factory,), daemon=True)
+        self._thread.start()
+
+    def _run(self, response_factory) -> None:
+        try:
+            response = self._response = response_factory(self.prompt)
+            if response is None:
+                return
+            if self._cancelled.is_set():
+                response.cancel()  # Cancelled while the request was being made
+            for chunk in response:
+                if self._cancelled.is_set():
+                    break
+                if chunk_text(chunk):
+                    self.tokens += 1
+                self._buffer.put(chunk)
+        except Exception as e:
+            print(f"Speculative request failed: {e}")
+        finally:
+            self._buffer.put(_DONE)
+
+    def cancel(self) -> None:
+        """Thread-safe: stops the underlying request right away, so a stream nobody is going to use isn't downloaded."""
+        self._cancelled.set()
+        if self._response is not None:
+            self._response.cancel()
+
+    def __iter__(self):
+        """Yield the buffered chunks, then keep following the live stream until it ends."""
+        try:
+            while True:
+                chunk = self._buffer.get()
+                if chunk is _DONE:
+                    return
+                yield chunk
+        except GeneratorExit:
+            self.cancel()  # The output was interrupted, so the rest of the stream isn't needed
+            raise
+
+    close = cancel
+
+
+class Speculator:
+    """Fires a request on the partially captured prompt whenever the user pauses typing.
+
+    \n\nIf the prompt is unchanged when the stop key is pressed, the already-running stream is used, hiding the network
+    round trip and the model's time to first token. Otherwise the stale stream is cancelled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._current = None
+        self._build_prompt = None
+        self._response_factory = None
+        self._pause_seconds = 0.7
+        self._budget = 0
+
+        # Counters across all activations
+        self.hits = 0
+        self.misses = 0
+        self.wasted_tokens = 0
+        self.requests = 0
+
+    def begin(self, build_prompt, response_factory, pause_ms: int = 700, max_requests: int = 2) -> None:
+        """Start speculating for a new activation. build_prompt turns captured text into the prompt that would be sent."""
+        with self._lock:
+            self._discard()
+            self._build_prompt = build_prompt
+            self._response_factory = response_factory
+            self._pause_seconds = pause_ms / 1000
+            self._budget = max_requests
+
+    def on_keystroke(self, captured_text: str) -> None:
+        """Restart the typing-pause timer with the text captured so far."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._budget <= 0 and self._current is None:
+                return  # Out of speculative requests for this activation
+            self._timer = threading.Timer(self._pause_seconds, self._speculate, args=(captured_text,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _speculate(self, captured_text: str) -> None:
+        with self._lock:
+            if not captured_text.strip() or self._build_prompt is None:
+                return
+            prompt = self._build_prompt(captured_text)
+            if self._current is not None and self._current.prompt == prompt:
+                return  # Already speculating on exactly this prompt
+            if self._budget <= 0:
+                return
+            self._discard()
+            self._budget -= 1
+            self.requests += 1
+            self._current = SpeculativeStream(prompt, self._response_factory)
+
+    def _discard(self) -> None:
+        """Cancel the pending timer and any speculative stream (must hold the lock)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._current is not None:
+            self._current.cancel()
+            self.wasted_tokens += self._current.tokens
+            self._current = None
+
+    def take(self, final_prompt: str) -> SpeculativeStream | None:
+        """Return the speculative stream if it was started on final_prompt, otherwise cancel it and return None."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            stream, self._current = self._current, None
+            self._build_prompt = self._response_factory = None
+        if stream is None:
+            return None
+        if stream.prompt == final_prompt:
+            self.hits += 1
+            return stream
+        self.misses += 1
+        stream.cancel()
+        self.wasted_tokens += stream.tokens
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "wasted_tokens": self.wasted_tokens,
+        }
@@ -0,0 +1,567 @@
+import re
+import sys
+import time
+import shutil
+import threading
+import subprocess
+from queue import Queue
+
+SENTENCE_TERMINATORS = frozenset('.!?')
+CLAUSE_BREAKS = frozenset(',;:')
+CLOSERS = frozenset('"\')]}»”’')  # May follow a terminator and still belong to the sentence
+BOUNDARY_CANDIDATES = re.compile(r"[.!?,;:\n]")  # The only characters the segmenter has to look at
+
+# Abbreviations that are never the end of a sentence ("Dr. Smith"), and ones that are unless a lowercase word follows
+TITLES = frozenset(["mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "vs", "no", "fig", "approx"])
+ABBREVIATIONS = frozenset(["etc", "e.g", "i.e", "cf", "al", "inc", "ltd", "co", "jan", "feb", "mar", "apr", "jun",
+                           "jul", "aug", "sep", "sept", "oct", "nov", "dec"])
+
+_DONE = object()  # Ends a SpeechPipeline's queues
+
+
+class SentenceSegmenter:
+    """Splits streamed text into speakable sentences in a single incremental pass.
+
+    \n\nOnly text added since the last feed() is scanned. A terminator ends a sentence when whitespace follows it, so
+    decimals ("3.14") and ellipses ("...") wait for the next character, and abbreviations ("Dr.", "e.g.") are skipped.
+    A sentence that runs past max_chars is split at its next clause break (",", ";", ":") so speech can start sooner."""
+
+    def __init__(self, max_chars: int = 160):
+        self.max_chars = max_chars
+        self._pending = ""  # Text not yet returned as a sentence (never longer than about one sentence)
+        self._scan = 0      # Everything before this index has already been scanned
+
+    def feed(self, text: str) -> list:
+        """Add streamed text, and return the sentences it completed."""
+        self._pending += text
+        sentences = []
+        pending, i = self._pending, self._scan
+        while True:
+            match = BOUNDARY_CANDIDATES.search(pending, i)
+            if match is None:
+                i = len(pending)
+                break
+            i = match.start()
+            character = pending[i]
+            end = None
+            if character in SENTENCE_TERMINATORS:
+                end, resume = self._sentence_end(pending, i)
+                if resume is None:
+                    break  # Need more text to decide; scanning resumes at this terminator
+                if end is None:
+                    i = resume
+                    continue
+            elif character == '\n':
+                end = i + 1  # Line breaks (list items, headings) end a sentence even without punctuation
+            elif character in CLAUSE_BREAKS and i >= self.max_chars:
+                if i + 1 == len(pending):
+                    break  # Need more text to decide
+                if pending[i + 1].isspace():
+                    end = i + 1
+            if end is None:
+                i += 1
+                continue
+            sentence = pending[:end].strip()
+            if sentence:
+                sentences.append(sentence)
+            pending, i = pending[end:], 0
+        self._pending, self._scan = pending, i
+        return sentences
+
+    def _sentence_end(self, text: str, i: int) -> tuple:
+        """For a terminator at text[i], return (end of sentence or None, index to continue scanning from).
+
+        \n\nReturns (None, None) if the text after it hasn't arrived yet."""
+        j = i
+        while j < len(text) and text[j] in SENTENCE_TERMINATORS:
+            j += 1  # "?!" and "..." end a sentence once, after the whole run
+        k = j
+        while k < len(text) and text[k] in CLOSERS:
+            k += 1
+        if k == len(text):
+            return None, None
+        if not text[k].isspace():
+            return None, k  # "3.14", "example.com", "e.g" part-way
+        if j - i == 1 and text[i] == '.':
+            word_start = i
+            while word_start > 0 and (text[word_start - 1].isalpha() or text[word_start - 1] == '.'):
+                word_start -= 1
+            word = text[word_start:i].lower()
+            if word in TITLES or (len(word) == 1 and word.isalpha()):
+                return None, k  # "Dr. Smith", "J. R. R. Tolkien"
+            if word in ABBREVIATIONS:
+                following = k
+                while following < len(text) and text[following].isspace():
+                    following += 1
+                if following == len(text):
+                    return None, None
+                if not text[following].isupper():
+                    return None, k  # "e.g. the first" continues the sentence
+        return k, k
+
+    def flush(self) -> str:
+        """Return whatever text is left over (the last sentence, if it had no terminator)."""
+        rest, self._pending, self._scan = self._pending.strip(), "", 0
+        return rest
+
+
+class SpeechBackend:
+    """Renders text to audio and plays it. synthesize() runs on the SpeechService's owner thread and play() on its
+    player thread, so the next sentence is rendered while the current one plays."""
+
+    name = "speech"
+
+    def open_thread(self) -> None:
+        """Called on each service thread before anything else (e.g. COM initialization)."""
+
+    def close_thread(self) -> None:
+        """Called on each service thread when it exits."""
+
+    def warm_up(self) -> None:
+        """Create the synthesis engine ahead of the first sentence (on the owner thread)."""
+
+    def configure(self, rate: int = 0, voice: str = "") -> None:
+        """Apply a rate (-10 to 10, as in SAPI) and a voice ("" for the default) to the sentences rendered from now on."""
+
+    def synthesize(self, text: str):
+        raise NotImplementedError
+
+    def play(self, audio, stop_event: threading.Event) -> None:
+        """Play rendered audio, returning early once stop_event is set."""
+        raise NotImplementedError
+
+
+class SapiBackend(SpeechBackend):
+    """Windows SAPI. Sentences are rendered into memory streams, then played by a second voice."""
+
+    name = "sapi"
+    AUDIO_FORMAT = 22  # SAFT22kHz16BitMono
+    SVSFlagsAsync = 1
+    SVSFPurgeBeforeSpeak = 2
+
+    def __init__(self, rate: int = 0, voice: str = ""):
+        self.rate = rate
+        self.voice = voice
+        self._local = threading.local()  # COM objects can only be used on the thread that created them
+
+    def open_thread(self) -> None:
+        import pythoncom
+        pythoncom.CoInitialize()
+
+    def close_thread(self) -> None:
+        import pythoncom
+        self._local.__dict__.clear()
+        pythoncom.CoUninitialize()
+
+    def _voice(self):
+        if getattr(self._local, 'voice', None) is None:
+            from win32com.client import Dispatch
+            self._local.voice = Dispatch("SAPI.SpVoice")
+            self._apply(self._local.voice)
+        return self._local.voice
+
+    def _apply(self, voice) -> None:
+        voice.Rate = self.rate
+        if self.voice:
+            for token in voice.GetVoices():
+                if self.voice.lower() in token.GetDescription().lower():
+                    voice.Voice = token
+                    break
+
+    def voices(self) -> list:
+        """Descriptions of the installed voices, for the settings menu."""
+        return [token.GetDescription() for token in self._voice().GetVoices()]
+
+    def warm_up(self) -> None:
+        self._voice()
+
+    def configure(self, rate: int = 0, voice: str = "") -> None:
+        self.rate, self.voice = rate, voice
+        if getattr(self._local, 'voice', None) is not None:
+            self._apply(self._local.voice)
+
+    def _memory_stream(self):
+        from win32com.client import Dispatch
+        audio_format = Dispatch("SAPI.SpAudioFormat")
+        audio_format.Type = self.AUDIO_FORMAT
+        stream = Dispatch("SAPI.SpMemoryStream")
+        stream.Format = audio_format
+        return stream
+
+    def synthesize(self, text: str) -> bytes:
+        stream = self._memory_stream()
+        voice = self._voice()
+        voice.AudioOutputStream = stream
+        voice.Speak(text, 0)  # Renders faster than real time, since nothing is played
+        return bytes(stream.GetData())
+
+    def play(self, audio: bytes, stop_event: threading.Event) -> None:
+        stream = self._memory_stream()
+        stream.SetData(audio)
+        voice = self._voice()  # This thread's voice still outputs to the speakers
+        voice.SpeakStream(stream, self.SVSFlagsAsync)
+        while not voice.WaitUntilDone(50):
+            if stop_event.is_set():
+                voice.Speak("", self.SVSFlagsAsync | self.SVSFPurgeBeforeSpeak)  # Stop speaking immediately
+                return
+
+
+class EspeakBackend(SpeechBackend):
+    """espeak / espeak-ng rendering to WAV, played with aplay. The stand-in used on Linux."""
+
+    name = "espeak"
+
+    def __init__(self, rate: int = 0, voice: str = "", command: str | None = None, player: str = "aplay"):
+        self.command = command or shutil.which("espeak-ng") or "espeak"
+        self.player = player
+        self.configure(rate, voice)
+
+    def voices(self) -> list:
+        listing = subprocess.run([self.command, "--voices"], capture_output=True, text=True).stdout.splitlines()
+        return [line.split()[3] for line in listing[1:] if len(line.split()) > 3]
+
+    def configure(self, rate: int = 0, voice: str = "") -> None:
+        self.words_per_minute = round(175 * 3 ** (rate / 10))  # SAPI rates go from 1/3x (-10) to 3x (10)
+        self.voice = voice
+
+    def synthesize(self, text: str) -> bytes:
+        command = [self.command, "--stdout", "-s", str(self.words_per_minute)]
+        if self.voice:
+            command += ["-v", self.voice]
+        return subprocess.run(command + [text], capture_output=True, check=True).stdout
+
+    def play(self, audio: bytes, stop_event: threading.Event) -> None:
+        process = subprocess.Popen([self.player, "-q", "-"], stdin=subprocess.PIPE)
+        try:
+            process.stdin.write(audio)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        while process.poll() is None:
+            if stop_event.wait(0.02):
+                process.terminate()
+                break
+        process.wait()
+
+
+class FakeSpeechBackend(SpeechBackend):
+    """Sleeps instead of rendering and playing, at a configurable speed. For tests and benchmarks.
+
+    \n\nsetup_seconds stands in for creating the engine (CoInitialize, Dispatch("SAPI.SpVoice"), setting Rate)."""
+
+    name = "fake"
+
+    def __init__(self, render_seconds_per_char: float = 0.0015, speech_chars_per_second: float = 15.0,
+                 setup_seconds: float = 0.0):
+        self.render_seconds_per_char = render_seconds_per_char
+        self.speech_chars_per_second = speech_chars_per_second
+        self.setup_seconds = setup_seconds
+        self.ready = False
+        self.rate = 0
+        self.synthesized = []
+        self.played = []
+
+    def warm_up(self) -> None:
+        if not self.ready:
+            time.sleep(self.setup_seconds)
+            self.ready = True
+
+    def voices(self) -> list:
+        return ["Fake Voice"]
+
+    def configure(self, rate: int = 0, voice: str = "") -> None:
+        self.rate = rate
+
+    def synthesize(self, text: str) -> bytes:
+        self.warm_up()
+        time.sleep(len(text) * self.render_seconds_per_char)
+        self.synthesized.append(text)
+        seconds = len(text) / self.speech_chars_per_second / 3 ** (self.rate / 10)
+        return bytes(round(seconds * 1000))  # The "audio" is one byte per millisecond of speech
+
+    def play(self, audio: bytes, stop_event: threading.Event) -> None:
+        self.played.append(audio)
+        stop_event.wait(len(audio) / 1000)
+
+
+def default_backend() -> SpeechBackend:
+    """SAPI on Windows, espeak elsewhere."""
+    if sys.platform == "win32":
+        return SapiBackend()
+    return EspeakBackend()
+
+
+class SpeechService:
+    """The one long-lived speech engine, reused by every request.
+
+    \n\nAll commands (say, configure, mark) go through one queue to an owner thread, which creates the backend once and
+    renders each sentence while a player thread plays the previous one. At most lookahead rendered sentences wait
+    for the speakers. interrupt() drops everything queued so far and stops the sentence being played, without
+    tearing anything down. The threads are started lazily, on the first command or an explicit start().
+    With an audio_cache, sentences already rendered with the same engine, voice and rate are played without
+    synthesizing them again."""
+
+    audio_cache = None  # An AudioCache, set before the service starts
+
+    def __init__(self, backend_factory=default_backend, lookahead: int = 2, clock=time.perf_counter):
+        self.backend_factory = backend_factory
+        self.backend = None
+        self.clock = clock
+        self._commands = Queue()
+        self._audio = Queue(maxsize=lookahead)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._interrupt = threading.Event()  # Replaced by interrupt(); every queued sentence carries the one it was said under
+        self._configuration = None
+        self._applied = (0, "")  # The (rate, voice) the backend renders with; only touched by the owner thread
+        self._first_of_request = False
+        self._ready = threading.Event()
+
+        # Instrumentation
+        self.setup_ms = None          # Time the owner thread took to create the engine
+        self.latencies = []           # Seconds from say() to the sentence's audio starting
+        self.first_audio = []         # Seconds from begin_request() to the request's first audio
+        self._request_started = None
+        self._on_first_audio = None
+
+    def start(self) -> "SpeechService":
+        """Start the threads and create the engine now, so it's off the path to the first spoken word."""
+        with self._lock:
+            if not self._threads:
+                self._threads = [threading.Thread(target=self._own, daemon=True, name="speech-owner"),
+                                 threading.Thread(target=self._play, daemon=True, name="speech-player")]
+                for thread in self._threads:
+                    thread.start()
+        return self
+
+    def configure(self, settings) -> None:
+        """Apply tts_rate and tts_voice to the sentences rendered from now on. Used as a settings subscriber."""
+        configuration = (settings.get('tts_rate', 0), settings.get('tts_voice', ""))
+        with self._lock:
+            if configuration == self._configuration:
+                return
+            self._configuration = configuration
+        self._commands.put(("configure", configuration))
+
+    def begin_request(self, on_first_audio=None) -> None:
+        """Mark the start of an answer, for the first-audio latency. on_first_audio() is called when its audio starts."""
+        with self._lock:
+            self._request_started = self.clock()
+            self._on_first_audio = on_first_audio
+            self._first_of_request = True
+
+    def say(self, text: str) -> None:
+        self.start()
+        with self._lock:
+            first, self._first_of_request = self._first_of_request, False
+            request = (self._request_started, self._on_first_audio) if first else None
+            self._commands.put(("say", (text, self.clock(), request, self._interrupt)))
+
+    def interrupt(self) -> None:
+        """Thread-safe: stop speaking now and drop every sentence not yet spoken."""
+        with self._lock:
+            self._interrupt.set()
+            self._interrupt = threading.Event()
+
+    def mark(self) -> threading.Event:
+        """Return an Event that is set once everything said before this call has been spoken (or interrupted)."""
+        reached = threading.Event()
+        if not self._threads:
+            reached.set()
+            return reached
+        self._commands.put(("mark", reached))
+        return reached
+
+    def shutdown(self) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if threads:
+            self.interrupt()
+            self._commands.put(_DONE)
+            for thread in threads:
+                thread.join()
+
+    def _own(self) -> None:
+        started = self.clock()
+        self.backend = self.backend_factory()
+        self.backend.open_thread()
+        try:
+            self.backend.warm_up()
+        except Exception as e:
+            print(f"Speech engine setup failed: {e}")
+        self.setup_ms = round((self.clock() - started) * 1000, 1)
+        self._ready.set()
+        try:
+            while True:
+                command = self._commands.get()
+                if command is _DONE:
+                    break
+                kind, argument = command
+                try:
+                    if kind == "configure":
+                        self.backend.configure(*argument)
+                        self._applied = argument
+                    elif kind == "mark":
+                        self._audio.put(command)
+                    elif kind == "say":
+                        text, said_at, request, interrupted = argument
+                        if not interrupted.is_set():
+                            self._audio.put((self._render(text), said_at, request, interrupted))
+                except Exception as e:
+                    print(f"Speech command {kind} failed: {e}")
+        finally:
+            self._audio.put(_DONE)
+            self.backend.close_thread()
+
+    def _render(self, text: str):
+        if self.audio_cache is None:
+            return self.backend.synthesize(text)
+        key = self.audio_cache.make_key(self.backend.name, self._applied[1], self._applied[0], text)
+        audio = self.audio_cache.get(key)
+        if audio is None:
+            audio = self.backend.synthesize(text)
+            self.audio_cache.put(key, audio)
+        return audio
+
+    def _play(self) -> None:
+        self._ready.wait()  # The backend is created on the owner thread
+        self.backend.open_thread()
+        try:
+            while True:
+                item = self._audio.get()
+                if item is _DONE:
+                    break
+                if item[0] == "mark":
+                    item[1].set()
+                    continue
+                audio, said_at, request, interrupted = item
+                if interrupted.is_set():
+                    continue
+                now = self.clock()
+                self.latencies.append(now - said_at)
+                if request is not None:
+                    request_started, on_first_audio = request
+                    self.first_audio.append(now - request_started)
+                    if on_first_audio is not None:
+                        on_first_audio()
+                try:
+                    self.backend.play(audio, interrupted)
+                except Exception as e:
+                    print(f"Speech playback failed: {e}")
+        finally:
+            self.backend.close_thread()
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "sentences": len(latencies),
+            "engine_setup_ms": self.setup_ms,
+            "first_audio_ms": round(self.first_audio[-1] * 1000, 1) if self.first_audio else None,
+            "median_latency_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "audio_cache": self.audio_cache.stats() if self.audio_cache is not None else None,
+        }
+
+
+# The one speech service shared by every request (its engine is created on first use)
+speech_service = SpeechService()
+
+
+if __name__ == "__main__":
+    # 1. Segmenter: correctness on the tricky cases, then CPU cost against the old rescan-per-token loop.
+    segmenter = SentenceSegmenter(max_chars=60)
+    text = ("Dr. Smith paid $3.50 for it... Really? Yes! See e.g. the docs, i.e. the manual. "
+            "It was written by J. R. R. Tolkien. This sentence runs on for quite a while, well past the limit, "
+            "so it is split at a clause break; the rest follows.\nA list item\n")
+    streamed = []
+    for position in range(0, len(text), 3):
+        streamed += segmenter.feed(text[position:position + 3])
+    streamed.append(segmenter.flush() or "(nothing left over)")
+    for sentence in streamed:
+        print(f"  [{sentence}]")
+
+    def old_segmenter(tokens):
+        buffer, sentences = "", []
+        for token in tokens:
+            buffer += token
+            while True:
+                indices = [buffer.find(t) for t in {'.', '!', '?'} if buffer.find(t) != -1]
+                if not indices:
+                    break
+                end = min(indices) + 1
+                sentences.append(buffer[:end])
+                buffer = buffer[end:]
+        return sentences
+
+    tokens = (["word "] * 400 + ["ends here. "]) * 25  # Long sentences, as in code or list-free paragraphs
+    started = time.perf_counter()
+    old_segmenter(tokens)
+    old_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    segmenter = SentenceSegmenter()
+    for token in tokens:
+        segmenter.feed(token)
+    new_ms = (time.perf_counter() - started) * 1000
+    print(f"segmenting {len(tokens)} tokens: old {old_ms:.1f} ms, incremental {new_ms:.1f} ms")
+
+    # 2. Latency from a sentence terminator arriving to its audio starting, serial (render then play, like
+    #    Speak + WaitUntilDone) vs. pipelined. The model streams a 60-character sentence every 0.5 s.
+    sentences = [f"Sentence number {n} is about sixty characters long, roughly." for n in range(8)]
+
+    def serial_latencies(backend):
+        latencies, arrivals = [], Queue()
+
+        def model():
+            for sentence in sentences:
+                arrivals.put((sentence, time.perf_counter()))
+                time.sleep(0.5)
+            arrivals.put(_DONE)
+
+        threading.Thread(target=model, daemon=True).start()
+        stop = threading.Event()
+        while (item := arrivals.get()) is not _DONE:
+            sentence, arrived = item
+            audio = backend.synthesize(sentence)
+            latencies.append(time.perf_counter() - arrived)
+            backend.play(audio, stop)
+        return latencies
+
+    def pipelined_latencies(backend):
+        service = SpeechService(lambda: backend).start()
+        for sentence in sentences:
+            service.say(sentence)
+            time.sleep(0.5)
+        service.mark().wait()
+        service.shutdown()
+        return service.latencies
+
+    for name, measure in [("serial", serial_latencies), ("pipelined", pipelined_latencies)]:
+        latencies = measure(FakeSpeechBackend(render_seconds_per_char=0.004, speech_chars_per_second=100))
+        print(f"{name:>9}: terminator -> audio  first {latencies[0] * 1000:.0f} ms, "
+              f"mean {sum(latencies) / len(latencies) * 1000:.0f} ms, worst {max(latencies) * 1000:.0f} ms")
+
+    # 3. First-audio latency of five short answers: an engine created per request (as tts_worker did) vs. the
+    #    persistent service. Pass "real" to use this platform's backend instead of the stand-in.
+    if sys.argv[1:] == ["real"]:
+        make_backend = default_backend
+    else:
+        def make_backend():
+            return FakeSpeechBackend(render_seconds_per_char=0.002, speech_chars_per_second=200, setup_seconds=0.12)
+
+    def first_audio(service):
+        service.begin_request()
+        service.say("Short answer.")
+        service.mark().wait()
+        return service.first_audio[-1] * 1000
+
+    per_request = []
+    for _ in range(5):
+        service = SpeechService(make_backend)
+        per_request.append(first_audio(service))
+        service.shutdown()
+    persistent_service = SpeechService(make_backend).start()
+    persistent_service.mark().wait()  # Startup, off the request path
+    persistent = [first_audio(persistent_service) for _ in range(5)]
+    persistent_service.shutdown()
+    print(f"first audio, engine per request: {', '.join(f'{ms:.0f}' for ms in per_request)} ms")
+    print(f"first audio, persistent service: {', '.join(f'{ms:.0f}' for ms in persistent)} ms "
+          f"(engine setup {persistent_service.setup_ms} ms, paid once)")
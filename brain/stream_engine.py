@@ -0,0 +1,215 @@
+import time
+import asyncio
+import threading
+from queue import Queue
+from types import SimpleNamespace
+
+from response_cache import chunk_text
+
+_DONE = object()  # Marks the end of a handle's chunk queue
+
+
+def whole_response_chunk(response):
+    """A complete (non-streamed) chat or legacy completion response, as a single chunk of the matching streamed shape."""
+    choice = response.choices[0]
+    if hasattr(choice, 'message'):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=choice.message.content or ""))])
+    return SimpleNamespace(choices=[SimpleNamespace(text=choice.text)])
+
+
+class StreamHandle:
+    """A streaming request running on the StreamEngine's event loop, iterable from any ordinary thread.
+
+    \n\ncancel() can be called from any thread (e.g. the keyboard hook). It cancels the asyncio task, which closes the
+    HTTP response straight away, so the server stops sending and the pool gets the connection slot back."""
+
+    def __init__(self, engine, max_tokens: int):
+        self._engine = engine
+        self._chunks = Queue()
+        self._task = None
+        self._cancel_requested = False
+        self.max_tokens = max_tokens
+        self.tokens_received = 0
+        self.error = None
+        self.cancelled_at = None
+        self.closed_at = None
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _DONE:
+                    return
+                yield chunk
+        except GeneratorExit:
+            self.cancel()  # The consumer stopped reading, so the rest of the stream isn't needed
+            raise
+
+    def cancel(self) -> None:
+        if self._cancel_requested or self.closed_at is not None:
+            return
+        self._cancel_requested = True
+        self.cancelled_at = time.perf_counter()
+        self._engine.loop.call_soon_threadsafe(self._cancel_task)
+
+    close = cancel
+
+    def _cancel_task(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_requested
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens the server would still have generated if the stream hadn't been cancelled (at most max_tokens)."""
+        if not self._cancel_requested:
+            return 0
+        return max(0, self.max_tokens - self.tokens_received)
+
+
+class StreamEngine:
+    """Runs the async OpenAI client on a dedicated asyncio event loop thread.
+
+    \n\nThe rest of KeyGenie stays synchronous: it calls stream() and iterates the returned StreamHandle."""
+
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="stream-engine", daemon=True)
+        self._thread.start()
+
+        # Instrumentation
+        self.streams = 0
+        self.cancellations = 0
+        self.tokens_saved = 0
+        self.total_cancel_latency = 0.0
+
+    def run(self, coroutine):
+        """Schedule a coroutine on the engine's loop from any thread. Returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def warm_up(self, transport=None) -> None:
+        """Warm up a transport's connection pool (the engine's own by default) in the background."""
+        transport = transport or self.transport
+        if transport is not None:
+            self.run(transport.warm_up())
+
+    def stream(self, create, **kwargs) -> StreamHandle:
+        """Start create(**kwargs) (e.g. async_client.chat.completions.create with stream=True) and return its handle.
+
+        \n\nWith stream=False (for a model that can't stream), the whole answer arrives as one chunk."""
+        handle = StreamHandle(self, kwargs.get('max_tokens') or 0)
+        self.streams += 1
+
+        def start():
+            if handle._cancel_requested:
+                handle._chunks.put(_DONE)  # Cancelled before it even started
+                return
+            handle._task = self.loop.create_task(self._pump(handle, create, kwargs))
+
+        self.loop.call_soon_threadsafe(start)
+        return handle
+
+    async def _pump(self, handle: StreamHandle, create, kwargs) -> None:
+        stream = None
+        try:
+            if not kwargs.get('stream', True):
+                response = await create(**kwargs)
+                handle.tokens_received += 1
+                handle._chunks.put(whole_response_chunk(response))
+                return
+            stream = await create(**kwargs)
+            async for chunk in stream:
+                if chunk_text(chunk):
+                    handle.tokens_received += 1
+                handle._chunks.put(chunk)
+        except asyncio.CancelledError:
+            pass  # Stopped by the user, the response is closed below
+        except Exception as e:
+            handle.error = e
+            print(f"Error: {str(e)}")
+        finally:
+            if stream is not None:
+                await stream.close()  # Closes the HTTP response, even half-way through the body
+            handle.closed_at = time.perf_counter()
+            if handle.cancelled:
+                self.cancellations += 1
+                self.tokens_saved += handle.tokens_saved
+                self.total_cancel_latency += handle.closed_at - handle.cancelled_at
+            handle._chunks.put(_DONE)
+
+    def stats(self) -> dict:
+        return {
+            "streams": self.streams,
+            "cancellations": self.cancellations,
+            "tokens_saved": self.tokens_saved,
+            "mean_cancel_ms": round(self.total_cancel_latency / self.cancellations * 1000, 2) if self.cancellations else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        if self.transport is not None:
+            self.run(self.transport.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    # Cancel a stream from a local SSE stand-in server and count how many bytes it actually sent.
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from openai import AsyncOpenAI
+    from transport import WarmTransport
+
+    TOTAL_TOKENS = 500
+    sent = {"bytes": 0, "full": 0}
+
+    class SSEHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(TOTAL_TOKENS):
+                event = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "stand-in",
+                         "choices": [{"index": 0, "delta": {"content": f"word{i} "}, "finish_reason": None}]}
+                data = f"data: {json.dumps(event)}\n\n".encode()
+                sent["full"] += len(data)
+                try:
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                    sent["bytes"] += len(data)
+                except OSError:
+                    self.close_connection = True
+                    return  # The client hung up
+                time.sleep(0.01)
+            done = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SSEHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+    transport = WarmTransport(base_url=base_url)
+    engine = StreamEngine(transport)
+    client = AsyncOpenAI(api_key="stand-in", base_url=base_url, http_client=transport.http_client)
+
+    handle = engine.stream(client.chat.completions.create, max_tokens=TOTAL_TOKENS, model="stand-in",
+                           messages=[{"role": "user", "content": "hi"}], stream=True)
+    for count, chunk in enumerate(handle, start=1):
+        if count == 20:
+            handle.cancel()  # What the stop listener does when a key is pressed
+    time.sleep(0.2)  # Give the server a moment to notice the closed connection
+    print(f"received {handle.tokens_received} of {TOTAL_TOKENS} tokens, "
+          f"server sent {sent['bytes']} bytes (it generated {sent['full']} before noticing the hang-up)")
+    print("engine stats:", engine.stats())
+    engine.shutdown()
+    server.shutdown()
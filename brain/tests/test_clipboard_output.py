@@ -0,0 +1,28 @@
+import pytest
+
+from clipboard_output import ChunkedPaster, InMemoryClipboard
+
+
+def test_chunks_are_pasted_and_the_clipboard_restored():
+    clipboard = InMemoryClipboard("copied")
+    paster = ChunkedPaster(clipboard, clipboard.paste, chunk_chars=5, sleep=lambda seconds: None)
+    for token in ["hello ", "world"]:
+        paster.feed(token)
+    paster.flush()
+    assert ''.join(clipboard.document) == "hello world"
+    assert clipboard.text == "copied"
+
+
+@pytest.mark.parametrize("failing", ["paste", "sleep"])
+def test_clipboard_is_restored_when_the_paste_fails(failing):
+    clipboard = InMemoryClipboard("copied")
+
+    def fail(*args):
+        raise RuntimeError("interrupted")
+
+    paster = ChunkedPaster(clipboard, fail if failing == "paste" else clipboard.paste, chunk_chars=100,
+                           sleep=fail if failing == "sleep" else lambda seconds: None)
+    paster.feed("an answer")
+    with pytest.raises(RuntimeError):
+        paster.flush()
+    assert clipboard.text == "copied"
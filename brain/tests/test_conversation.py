@@ -0,0 +1,46 @@
+import time
+import threading
+
+from conversation import Conversation, SUMMARY_PREFIX
+
+LONG_ANSWER = "word " * 60
+
+
+def wait_for_compaction(timeout=5):
+    deadline = time.monotonic() + timeout
+    while any(thread.name == "conversation-compaction" for thread in threading.enumerate()):
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_a_compaction_replaces_the_old_turns_with_the_summary():
+    conversation = Conversation(token_budget=100, keep_turns=1)
+    conversation.record("first", LONG_ANSWER, lambda summary, messages: "the first turn")
+    conversation.record("second", LONG_ANSWER, lambda summary, messages: "the first turn")
+    wait_for_compaction()
+    assert conversation.summary.payload["content"] == SUMMARY_PREFIX + "the first turn"
+    assert [user.payload["content"] for user, _ in conversation.turns] == ["second"]
+    assert conversation.compactions == 1
+
+
+def test_a_compaction_finishing_after_reset_is_discarded():
+    conversation = Conversation(token_budget=100, keep_turns=1)
+    summarizing, release = threading.Event(), threading.Event()
+
+    def slow_summarize(summary, messages):
+        summarizing.set()
+        release.wait(5)
+        return "the old session"
+
+    conversation.record("first", LONG_ANSWER, slow_summarize)
+    conversation.record("second", LONG_ANSWER, slow_summarize)
+    assert summarizing.wait(5)
+    conversation.reset()
+    conversation.record("new", "a short answer", slow_summarize)
+    release.set()
+    wait_for_compaction()
+
+    assert conversation.summary is None  # The old session's summary doesn't leak into the new one
+    assert [user.payload["content"] for user, _ in conversation.turns] == ["new"]  # Nor does it drop the new turns
+    assert conversation.compactions == 0
+    assert conversation.history_tokens == sum(user.tokens + assistant.tokens for user, assistant in conversation.turns)
@@ -0,0 +1,61 @@
+import time
+import threading
+
+from hedging import HedgedStream
+
+
+class SlowResponse:
+    """A response whose request takes a while to be answered, and which cancel() stops."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.cancelled = threading.Event()
+
+    def __iter__(self):
+        self.cancelled.wait(self.delay)
+        return iter([])
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def iterate_in_thread(stream):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("chunks", list(stream)), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_cancel_before_the_backup_starts_ends_iteration():
+    started = []
+
+    def slow_factory():
+        time.sleep(1)  # The request isn't even sent before the cancel
+        return SlowResponse(5)
+
+    def backup_factory():
+        started.append("backup")
+        return SlowResponse(5)
+
+    stream = HedgedStream(slow_factory, backup_factory, delay=0.3)
+    thread, result = iterate_in_thread(stream)
+    time.sleep(0.1)
+    cancelled_at = time.perf_counter()
+    stream.cancel()
+    thread.join(2)
+    assert not thread.is_alive(), "iteration kept spinning after cancel()"
+    assert time.perf_counter() - cancelled_at < 1
+    assert result["chunks"] == []
+    assert started == []  # The backup isn't started once the stream is cancelled
+    assert stream.cancelled
+
+
+def test_cancel_while_the_primary_streams_ends_iteration():
+    primary = SlowResponse(5)
+    stream = HedgedStream(lambda: primary, lambda: SlowResponse(5), delay=10)
+    thread, result = iterate_in_thread(stream)
+    time.sleep(0.1)
+    stream.cancel()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert primary.cancelled.is_set()
@@ -0,0 +1,85 @@
+import threading
+
+from jobs import JobScheduler, Job, HELD, WAITING, OUTPUT, CANCELLED
+
+TIMEOUT = 5
+
+
+class GatedJob:
+    """A job whose request is recorded and whose output runs until its gate is opened."""
+
+    def __init__(self, name, targets, log):
+        self.sent = threading.Event()
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.finished = threading.Event()
+        self.log = log
+
+        def request():
+            self.sent.set()
+            return name
+
+        def output(response, cancel_token):
+            self.started.set()
+            log.append((response, "start"))
+            while not self.gate.wait(0.005) and not cancel_token.is_set():
+                pass
+            log.append((response, "end"))
+
+        self.job = Job(name, targets, request, output, lambda job: self.finished.set())
+
+
+def test_jobs_on_a_shared_target_are_output_in_submission_order():
+    scheduler, log = JobScheduler(queue_depth=5), []
+    first, second, third = (GatedJob(name, ["typing"], log) for name in ("first", "second", "third"))
+    speech = GatedJob("speech", ["tts"], log)
+    for gated in (first, second, third, speech):
+        assert scheduler.submit(gated.job)
+    assert first.started.wait(TIMEOUT)
+    assert speech.started.wait(TIMEOUT)  # Another target doesn't wait for the typing
+    assert second.sent.wait(TIMEOUT) and third.sent.wait(TIMEOUT)  # Requests go out straight away...
+    assert not second.started.is_set() and (second.job.state, third.job.state) == (WAITING, WAITING)  # ...outputs wait
+    for gated in (speech, third, second, first):  # Opening the later gates first doesn't let them overtake
+        gated.gate.set()
+    assert third.finished.wait(TIMEOUT)
+    typing = [entry for entry in log if entry[0] != "speech"]
+    assert typing == [("first", "start"), ("first", "end"), ("second", "start"), ("second", "end"),
+                      ("third", "start"), ("third", "end")]
+
+
+def test_a_held_job_is_admitted_once_there_is_room():
+    scheduler, log = JobScheduler(queue_depth=1, policy="queue"), []
+    running, waiting, held = (GatedJob(name, ["typing"], log) for name in ("running", "waiting", "held"))
+    scheduler.submit(running.job)
+    assert running.started.wait(TIMEOUT)
+    scheduler.submit(waiting.job)
+    scheduler.submit(held.job)
+    assert (running.job.state, waiting.job.state, held.job.state) == (OUTPUT, WAITING, HELD)
+    assert waiting.sent.wait(TIMEOUT)
+    assert not held.sent.wait(0.05)  # Its request is held too, not just its output
+
+    running.gate.set()
+    assert held.sent.wait(TIMEOUT)  # The waiting job's output started, so the held one moved up
+    assert held.job.state == WAITING
+    waiting.gate.set()
+    held.gate.set()
+    assert held.finished.wait(TIMEOUT)
+    assert scheduler.stats()["completed"] == 3
+
+
+def test_cancelling_a_held_job_never_sends_its_request():
+    scheduler, log = JobScheduler(queue_depth=1, policy="queue"), []
+    running, waiting, held = (GatedJob(name, ["typing"], log) for name in ("running", "waiting", "held"))
+    for gated in (running, waiting, held):
+        scheduler.submit(gated.job)
+    assert running.started.wait(TIMEOUT)
+    assert held.job.state == HELD
+
+    held.job.cancel()
+    assert held.finished.wait(TIMEOUT)  # finish() still runs, e.g. to close the activation's timeline
+    running.gate.set()
+    waiting.gate.set()
+    assert waiting.finished.wait(TIMEOUT)
+    assert not held.sent.is_set() and not held.started.is_set()
+    assert held.job.state == CANCELLED
+    assert scheduler.stats()["cancelled"] == 1
@@ -0,0 +1,61 @@
+from key_dispatcher import KeyDispatcher, KEY_DOWN, KEY_UP
+
+
+def make_dispatcher():
+    dispatcher = KeyDispatcher()
+    fired = []
+    dispatcher.add_hotkey("right shift", lambda: fired.append("prompt"))
+    dispatcher.add_hotkey("ctrl+alt+k, ctrl+alt+j", lambda: fired.append("sequence"))
+    return dispatcher, fired
+
+
+def press(dispatcher, *keys):
+    for key in keys:
+        dispatcher.inject(key, KEY_DOWN)
+    for key in reversed(keys):
+        dispatcher.inject(key, KEY_UP)
+
+
+def test_key_renamed_between_down_and_up_is_released():
+    dispatcher, fired = make_dispatcher()
+    dispatcher.inject("shift", KEY_DOWN, scan_code=42)
+    dispatcher.inject("!", KEY_DOWN, scan_code=2)
+    dispatcher.inject("1", KEY_UP, scan_code=2)
+    dispatcher.inject("shift", KEY_UP, scan_code=42)
+    dispatcher.inject("right shift", KEY_DOWN, scan_code=54)
+    assert fired == ["prompt"]
+
+
+def test_missed_key_up_doesnt_block_triggers():
+    dispatcher, fired = make_dispatcher()
+    dispatcher.inject("x", KEY_DOWN, scan_code=45)  # e.g. Win+L: its key-up never arrives
+    press(dispatcher, "right shift")
+    press(dispatcher, "ctrl", "alt", "k")
+    press(dispatcher, "ctrl", "alt", "j")
+    assert fired == ["prompt", "sequence"]
+
+
+def test_modifier_pressed_between_sequence_steps_keeps_the_sequence():
+    dispatcher, fired = make_dispatcher()
+    press(dispatcher, "ctrl", "alt", "k")
+    press(dispatcher, "shift")  # A stray modifier between the steps
+    press(dispatcher, "ctrl", "alt", "j")
+    assert fired == ["sequence"]
+
+
+def test_other_key_between_sequence_steps_breaks_the_sequence():
+    dispatcher, fired = make_dispatcher()
+    press(dispatcher, "ctrl", "alt", "k")
+    press(dispatcher, "x")
+    press(dispatcher, "ctrl", "alt", "j")
+    assert fired == []
+
+
+def test_injected_keys_dont_trigger_hotkeys_and_are_marked():
+    dispatcher, fired = make_dispatcher()
+    seen = []
+    dispatcher.subscribe(seen.append)
+    with dispatcher.injecting:
+        press(dispatcher, "right shift")
+    assert fired == []
+    assert seen and all(keyboard_input.injected for keyboard_input in seen)
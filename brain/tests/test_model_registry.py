@@ -0,0 +1,14 @@
+from model_registry import ModelRegistry, ModelInfo, CHAT, COMPLETION
+
+
+def test_a_swap_publishes_one_new_catalog():
+    registry = ModelRegistry(cache_file=None)
+    before = registry._catalog
+    guessed = registry.lookup("local-model", "local")
+    assert guessed.endpoint == CHAT
+    registry._swap([ModelInfo("local-model", "local", COMPLETION, 4096, 512, True)])
+    after = registry._catalog
+    assert after is not before
+    assert before.guesses and not after.guesses  # Old guesses don't leak into the new listing
+    assert registry.lookup("local-model", "local").endpoint == COMPLETION
+    assert before.models.get("local") is None  # A reader holding the old catalog still sees it whole
@@ -0,0 +1,26 @@
+from providers import ProviderRegistry
+from stream_engine import StreamEngine
+
+
+def settings_with(*names):
+    return {"model": "local-model", "provider": names[0],
+            "providers": {name: {"base_url": f"http://127.0.0.1:1/{name}/", "api_key": "", "models": ["local-model"]}
+                          for name in names}}
+
+
+def test_an_older_snapshot_does_not_rebuild_the_providers():
+    engine = StreamEngine()
+    try:
+        registry = ProviderRegistry(lambda: "", engine)
+        registry.configure(settings_with("a"))
+        in_use = registry.for_settings(settings_with("a"))
+        transport = in_use.transport
+        # Another job's snapshot, taken before the settings changed
+        assert registry.for_settings(settings_with("b")) is in_use
+        assert registry.get("a") is in_use
+
+        registry.configure(settings_with("b"))  # The settings really changed
+        assert registry.for_settings(settings_with("b")).name == "b"
+        assert not transport.http_client.is_closed  # A stream still reading from the old pool isn't cut off
+    finally:
+        engine.shutdown()
@@ -0,0 +1,48 @@
+from rate_limits import RateLimiter
+
+PRIMARY, CHEAPER = ("openai", "gpt-4o"), ("openai", "gpt-4o-mini")
+
+
+def exhausted(reset="60s"):
+    return {"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": reset}
+
+
+def fake_limiter():
+    now, slept = [100.0], []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    return RateLimiter(clock=lambda: now[0], sleep=sleep), slept
+
+
+def test_a_model_at_its_limit_is_rerouted_to_the_cheaper_one():
+    limiter, slept = fake_limiter()
+    limiter.observe(*PRIMARY, exhausted())
+    assert limiter.admit([PRIMARY, CHEAPER], cost=100, max_wait=3) == 1
+    assert slept == []
+    assert limiter.stats()["rerouted"] == 1
+
+
+def test_without_room_anywhere_the_request_is_held_for_the_selected_model():
+    limiter, slept = fake_limiter()
+    limiter.observe(*PRIMARY, exhausted("60s"))
+    limiter.observe(*CHEAPER, exhausted("600s"))
+    assert limiter.admit([PRIMARY, CHEAPER], cost=100, max_wait=3) == 0
+    assert slept == [1.0]  # 60 requests refill in 60 s, so one in a second
+    assert limiter.stats()["held"] == 1
+
+
+def test_a_hold_never_exceeds_max_wait():
+    limiter, slept = fake_limiter()
+    limiter.observe(*PRIMARY, {"retry-after": "30"}, status=429)
+    assert limiter.admit([PRIMARY], cost=100, max_wait=3) == 0
+    assert slept == [3]
+    assert limiter.stats()["rejections_seen"] == 1
+
+
+def test_unknown_limits_are_never_held():
+    limiter, slept = fake_limiter()
+    assert limiter.admit([PRIMARY, CHEAPER], cost=10_000, max_wait=3) == 0
+    assert slept == [] and limiter.stats()["rerouted"] == 0
@@ -0,0 +1,47 @@
+import os
+
+from response_cache import ResponseCache, chunk_text
+
+
+def open_cache(tmp_path):
+    return ResponseCache(os.path.join(tmp_path, "cache.sqlite3"))
+
+
+def test_lookups_dont_write_to_disk(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put("a", "hello world")
+    changes = cache._db.total_changes
+    assert cache.get("a") == "hello world"
+    assert cache.get("missing") is None
+    assert cache._db.total_changes == changes
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_saved"]) == (1, 1, len("hello world"))
+
+
+def test_counters_are_persisted_on_put_and_close(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put("a", "hello")
+    cache.get("a")
+    cache.get("missing")
+    cache.close()
+    stats = open_cache(tmp_path).stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_hits_count_as_recent_use_for_eviction(tmp_path):
+    cache = ResponseCache(os.path.join(tmp_path, "cache.sqlite3"), max_bytes=10)
+    cache.put("old", "aaaa")
+    cache.put("newer", "bbbb")
+    cache.get("old")  # Now the most recently used
+    cache.put("newest", "cccc")
+    assert cache.get("old") == "aaaa"
+    assert cache.get("newer") is None
+
+
+def test_record_keeps_the_answer_only_if_keep_allows(tmp_path):
+    cache = open_cache(tmp_path)
+    chunks = list(cache.replay("an answer"))
+    assert ''.join(chunk_text(chunk) for chunk in cache.record("kept", iter(chunks), keep=lambda: True)) == "an answer"
+    list(cache.record("dropped", iter(chunks), keep=lambda: False))
+    assert cache.get("kept") == "an answer"
+    assert cache.get("dropped") is None
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from metrics import percentile
+
+# Milestones of one activation, in the order they normally happen
+TRIGGER = "trigger"
+SETTINGS_LOADED = "settings_loaded"
+CAPTURE_END = "capture_end"
+REQUEST_SENT = "request_sent"
+FIRST_CHUNK = "first_chunk"
+FIRST_KEYSTROKE = "first_keystroke"
+FIRST_AUDIO = "first_audio"
+LAST_CHUNK = "last_chunk"
+LAST_KEYSTROKE = "last_keystroke"
+
+# Durations summarized as p50/p95: name -> (from milestone, to milestone)
+SUMMARY_DURATIONS = {
+    "first_chunk": (CAPTURE_END, FIRST_CHUNK),
+    "first_keystroke": (CAPTURE_END, FIRST_KEYSTROKE),
+    "first_audio": (CAPTURE_END, FIRST_AUDIO),
+}
+
+
+def process_rss_bytes() -> int | None:
+    """This process's resident memory, or None where it can't be read."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if get_memory_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Timeline:
+    """The milestones of one activation, as time.perf_counter_ns() values, plus counters for throughput.
+
+    \n\nmark() keeps the first time a milestone is reached, mark_last() the latest one. Both are a dict lookup or
+    store, so they can be called on the keystroke path."""
+
+    def __init__(self, action: str = "", trigger_ns: int | None = None):
+        self.action = action
+        self.marks = {TRIGGER: trigger_ns if trigger_ns is not None else time.perf_counter_ns()}
+        self.chunks_received = 0
+        self.characters_typed = 0
+        self.queues = {}  # Sink name -> its metrics (high water mark, lag, ...) at the end of the output
+        self.extra = {}
+
+    def mark(self, milestone: str, at_ns: int | None = None) -> None:
+        if milestone not in self.marks:
+            self.marks[milestone] = at_ns if at_ns is not None else time.perf_counter_ns()
+
+    def mark_last(self, milestone: str) -> None:
+        self.marks[milestone] = time.perf_counter_ns()
+
+    def chunk(self) -> None:
+        """A streamed chunk with text was received."""
+        now = time.perf_counter_ns()
+        if FIRST_CHUNK not in self.marks:
+            self.marks[FIRST_CHUNK] = now
+        self.marks[LAST_CHUNK] = now
+        self.chunks_received += 1
+
+    def keystrokes(self, characters: int) -> None:
+        """characters were just injected into the focused window."""
+        now = time.perf_counter_ns()
+        if FIRST_KEYSTROKE not in self.marks:
+            self.marks[FIRST_KEYSTROKE] = now
+        self.marks[LAST_KEYSTROKE] = now
+        self.characters_typed += characters
+
+    def elapsed_ms(self, start: str, end: str) -> float | None:
+        if start not in self.marks or end not in self.marks:
+            return None
+        return round((self.marks[end] - self.marks[start]) / 1e6, 1)
+
+    @staticmethod
+    def _rate(count: int, start_ns: int | None, end_ns: int | None) -> float | None:
+        if not count or start_ns is None or end_ns is None or end_ns <= start_ns:
+            return None
+        return round(count / ((end_ns - start_ns) / 1e9), 1)
+
+    def to_record(self) -> dict:
+        """A JSON-ready record: each milestone as milliseconds after the trigger keypress, and the throughput."""
+        trigger = self.marks[TRIGGER]
+        return {
+            "time": time.time(),
+            "action": self.action,
+            "milestones_ms": {name: round((at - trigger) / 1e6, 1)
+                              for name, at in sorted(self.marks.items(), key=lambda mark: mark[1])},
+            "tokens_per_second_received": self._rate(self.chunks_received, self.marks.get(FIRST_CHUNK), self.marks.get(LAST_CHUNK)),
+            "characters_per_second_typed": self._rate(self.characters_typed, self.marks.get(FIRST_KEYSTROKE), self.marks.get(LAST_KEYSTROKE)),
+            "chunks_received": self.chunks_received,
+            "characters_typed": self.characters_typed,
+            "queues": self.queues,
+            **self.extra,
+        }
+
+
+class TimelineRecorder:
+    """Keeps the timeline of the current activation, and writes finished ones to a rotating JSONL file.
+
+    \n\nRecent timelines are kept in memory for the p50/p95 summary shown in the tray tooltip. on_finish, if set, is
+    called (on the background thread) after each activation, e.g. to refresh that tooltip."""
+
+    def __init__(self, path: str | None = None, max_bytes: int = 1024 * 1024, backups: int = 3, history: int = 100):
+        self.current = Timeline()  # Something to mark even before the first activation
+        self.recent = deque(maxlen=history)
+        self.on_finish = None
+        self._lock = threading.Lock()
+        self._log = None
+        if path:
+            self._log = logging.getLogger(f"keygenie.timeline.{path}")
+            self._log.propagate = False  # Only to the JSONL file, not to the root logger
+            self._log.setLevel(logging.INFO)
+            if not self._log.handlers:
+                handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._log.addHandler(handler)
+
+    def begin(self, action: str = "", trigger_ns: int | None = None) -> Timeline:
+        """Start the timeline of a new activation. trigger_ns is when the hook saw the trigger key."""
+        self.current = Timeline(action, trigger_ns)
+        return self.current
+
+    def finish(self, timeline: Timeline | None = None) -> dict:
+        """Write the timeline out (by default the current one) and return its record."""
+        record = (timeline or self.current).to_record()
+        with self._lock:
+            self.recent.append(record)
+        if self._log is not None:
+            self._log.info(json.dumps(record))
+        if self.on_finish is not None:
+            try:
+                self.on_finish()
+            except Exception as e:
+                print(f"Timeline callback failed: {e}")
+        return record
+
+    def summary(self) -> dict:
+        """p50/p95 (ms) of the time from the end of capture to the first chunk, keystroke and spoken audio."""
+        with self._lock:
+            records = list(self.recent)
+        summary = {}
+        for name, (start, end) in SUMMARY_DURATIONS.items():
+            values = []
+            for record in records:
+                milestones = record["milestones_ms"]
+                if start in milestones and end in milestones:
+                    values.append(milestones[end] - milestones[start])
+            if values:
+                summary[name] = {"p50": round(percentile(values, 0.5)), "p95": round(percentile(values, 0.95)), "n": len(values)}
+        return summary
+
+    def summary_text(self) -> str:
+        lines = [f"{name.replace('_', ' ')}: p50 {stats['p50']} ms, p95 {stats['p95']} ms"
+                 for name, stats in self.summary().items()]
+        return "\n".join(lines) if lines else "No activations yet"
+
+
+if __name__ == "__main__":
+    # Cost of the keystroke-path instrumentation, compared with the time budget of one keystroke at 200 WPM,
+    # then a few simulated activations written to a JSONL file and summarized.
+    import os
+    import tempfile
+
+    ITERATIONS = 200_000
+    timeline = Timeline()
+    started = time.perf_counter_ns()
+    for _ in range(ITERATIONS):
+        timeline.keystrokes(1)
+    per_keystroke_ns = (time.perf_counter_ns() - started) / ITERATIONS
+    keystroke_budget_ns = 60 / (200 * 5) * 1e9  # 200 WPM, 5 characters per word
+    print(f"instrumentation: {per_keystroke_ns:.0f} ns per keystroke = "
+          f"{per_keystroke_ns / keystroke_budget_ns * 100:.5f}% of a keystroke at 200 WPM")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "timeline.jsonl")
+        recorder = TimelineRecorder(path, max_bytes=2000, backups=2)
+        for n in range(8):
+            timeline = recorder.begin("prompt")
+            timeline.mark(SETTINGS_LOADED)
+            time.sleep(0.01)
+            timeline.mark(CAPTURE_END)
+            timeline.mark(REQUEST_SENT)
+            time.sleep(0.02 + 0.01 * n)
+            for _ in range(5):
+                timeline.chunk()
+            timeline.keystrokes(12)
+            recorder.finish()
+        with open(path, encoding="utf-8") as jsonl:
+            print("last record:", jsonl.readlines()[-1].strip())
+        print("files:", sorted(os.listdir(directory)))
+        print(recorder.summary_text())
+        logging.getLogger(f"keygenie.timeline.{path}").handlers[0].close()
@@ -0,0 +1,158 @@
+import time
+import asyncio
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1/"
+
+# httpcore trace events that make up opening a new connection
+CONNECT_STARTED = "connection.connect_tcp.started"
+HANDSHAKE_COMPLETE_EVENTS = ("connection.connect_tcp.complete", "connection.start_tls.complete")
+
+
+class HandshakeTrace:
+    """Records how long DNS/TCP/TLS setup took for one request, using httpx's trace extension."""
+
+    def __init__(self):
+        self.started = None
+        self.finished = None
+
+    async def __call__(self, event_name, info):
+        # The async connection pool awaits the trace callback, so this has to be a coroutine
+        if event_name == CONNECT_STARTED:
+            self.started = time.perf_counter()
+        elif event_name in HANDSHAKE_COMPLETE_EVENTS and self.started is not None:
+            self.finished = time.perf_counter()  # start_tls comes after connect_tcp, so the last one wins
+
+    @property
+    def seconds(self) -> float:
+        """Time spent opening a connection, 0.0 if the request reused a pooled connection."""
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class WarmTransport:
+    """A pooled, keep-alive HTTP transport for the async OpenAI client that can be warmed up ahead of a request.
+
+    \n\nwarm_up() is scheduled as soon as the trigger key is pressed, so the DNS/TCP/TLS handshake happens while the
+    user is still typing their prompt instead of after they've finished. Idle connections stay in the pool for
+    keepalive_ttl seconds. The client must only be used from the StreamEngine's event loop.
+
+    \n\non_response(response), if given, sees every API response as soon as its headers arrive (e.g. to read the
+    rate-limit headers), on the event loop, so it must be quick."""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, keepalive_ttl: float = 60.0, timeout: float = 600.0,
+                 connect_timeout: float = 10.0, on_response=None):
+        import httpx  # Loaded with the first transport, when a request is warmed up, not at startup
+        self.base_url = base_url
+        self.keepalive_ttl = keepalive_ttl
+        self.on_response = on_response
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4, keepalive_expiry=keepalive_ttl),
+            event_hooks={"request": [self._attach_trace], "response": [self._record_trace]},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),  # Defaults are the ones the OpenAI client uses
+        )
+        self._last_used = 0.0
+        self._warming = False
+
+        # Instrumentation
+        self.warmups = 0
+        self.requests = 0
+        self.requests_reusing_connection = 0
+        self.handshake_seconds_hidden = 0.0  # Paid by warm-ups, overlapping with capture_input
+        self.handshake_seconds_paid = 0.0    # Paid by real requests, on the user's critical path
+
+    async def _attach_trace(self, request: "httpx.Request") -> None:
+        if "trace" not in request.extensions:
+            request.extensions["trace"] = HandshakeTrace()
+
+    async def _record_trace(self, response: "httpx.Response") -> None:
+        self._last_used = time.monotonic()
+        if response.request.headers.get("x-keygenie-warmup"):
+            return
+        if self.on_response is not None:
+            try:
+                self.on_response(response)
+            except Exception as e:
+                print(f"Response hook failed: {e}")
+        trace = response.request.extensions.get("trace")
+        if not isinstance(trace, HandshakeTrace):
+            return
+        self.requests += 1
+        if trace.seconds:
+            self.handshake_seconds_paid += trace.seconds
+        else:
+            self.requests_reusing_connection += 1
+
+    def is_warm(self) -> bool:
+        """True if a connection was used recently enough that it should still be in the pool."""
+        return time.monotonic() - self._last_used < self.keepalive_ttl * 0.5
+
+    async def warm_up(self) -> None:
+        """Open (or refresh) a pooled connection to the API host. Any HTTP response, even a 404, means the connection is ready."""
+        import httpx
+        if self.is_warm() or self._warming:
+            return  # Still warm, or a warm-up is already in flight
+        self._warming = True
+        try:
+            trace = HandshakeTrace()
+            await self.http_client.head(self.base_url, headers={"x-keygenie-warmup": "1"}, extensions={"trace": trace})
+            self.warmups += 1
+            self.handshake_seconds_hidden += trace.seconds
+        except httpx.HTTPError as e:
+            print(f"Connection warm-up failed: {e}")
+        finally:
+            self._warming = False
+
+    def stats(self) -> dict:
+        return {
+            "warmups": self.warmups,
+            "requests": self.requests,
+            "requests_reusing_connection": self.requests_reusing_connection,
+            "handshake_ms_hidden": round(self.handshake_seconds_hidden * 1000, 1),
+            "handshake_ms_paid": round(self.handshake_seconds_paid * 1000, 1),
+        }
+
+    async def close(self) -> None:
+        await self.http_client.aclose()
+
+
+if __name__ == "__main__":
+    # Try it against a local stand-in for the API: the first request is warmed, the second one is cold.
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+        def do_HEAD(self):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+    async def main():
+        warm = WarmTransport(base_url=url, keepalive_ttl=5)
+        await warm.warm_up()  # Would run during capture_input
+        await warm.http_client.post(url + "chat/completions", json={})
+        print("warmed:", warm.stats())
+
+        cold = WarmTransport(base_url=url, keepalive_ttl=5)
+        await cold.http_client.post(url + "chat/completions", json={})
+        print("cold:  ", cold.stats())
+
+    asyncio.run(main())
+    server.shutdown()